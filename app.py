@@ -2,6 +2,7 @@ import logging
 from flask import Flask
 from model import *
 from mongo import *
+from model.utils import profile_requests
 
 
 def app():
@@ -27,6 +28,7 @@ def app():
     ]
     for api, prefix in api2prefix:
         app.register_blueprint(api, url_prefix=prefix)
+    profile_requests(app)
 
     if not User('first_admin'):
         ADMIN = {
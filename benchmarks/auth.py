@@ -0,0 +1,32 @@
+'''
+measure requests per second of an authenticated `GET /test/`, with and
+without the cached user snapshot.
+
+    python -m benchmarks.auth [number]
+'''
+
+import sys
+import time
+from app import app as create_app
+from mongo import User
+
+
+def run(client, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        rv = client.get('/test/')
+        assert rv.status_code == 200, rv.get_json()
+    return number / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    app = create_app()
+    client = app.test_client()
+    client.set_cookie('test.test', 'piann', User('first_admin').secret)
+    ttl = User.SNAPSHOT_TTL
+    for name, enabled in (('uncached', False), ('cached', True)):
+        User.SNAPSHOT_TTL = ttl if enabled else 0
+        User._snapshots.clear()
+        run(client, 10)
+        print(f'{name:>8}: {run(client, number):.0f} req/s')
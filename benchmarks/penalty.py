@@ -0,0 +1,36 @@
+'''
+compare the cost of evaluating a penalty per submission, between running
+the formula by `exec` and the compiled `Penalty`.
+
+    python -m benchmarks.penalty [number]
+'''
+
+import sys
+import timeit
+from mongo.penalty import Penalty
+
+FORMULAS = (
+    'score = score * (0.8 ** overtime)',
+    'score = score if overtime < 3 else score / 2',
+    'if overtime > 7:\n    score = 0\nelse:\n    score = score * (1 - overtime / 10)',
+)
+
+
+def run_exec(source: str):
+    d = {'score': 100, 'overtime': 3}
+    exec(source, d)
+    return d['score']
+
+
+def run_compiled(source: str):
+    return Penalty.compile(source)(100, 3)
+
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for source in FORMULAS:
+        print(repr(source))
+        assert run_exec(source) == run_compiled(source)
+        for name, func in (('exec', run_exec), ('compiled', run_compiled)):
+            cost = timeit.timeit(lambda: func(source), number=number)
+            print(f'  {name:>8}: {cost / number * 1e6:.2f} us/submission')
@@ -0,0 +1,42 @@
+'''
+measure the cost of serializing a page of the submission list, between
+loading submitters one by one and by one query for the whole page.
+
+    python -m benchmarks.submission_list [page size] [number]
+'''
+
+import sys
+import time
+from app import app as create_app
+from mongo import Submission
+
+
+def load(count: int):
+    return Submission.filter(
+        user=None,
+        count=count,
+        only=Submission.LIST_FIELDS,
+    )
+
+
+def run(serialize, count: int, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        serialize(load(count))
+    return (time.perf_counter() - start) / number
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    number = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    app = create_app()
+    methods = (
+        ('each', lambda page: [s.to_list_dict() for s in page]),
+        ('batch', Submission.to_list_dicts),
+    )
+    with app.app_context():
+        page = load(count)
+        assert methods[0][1](page) == methods[1][1](page)
+        for name, serialize in methods:
+            cost = run(serialize, count, number)
+            print(f'{name:>6}: {cost * 1e3:.2f} ms/page of {len(page)}')
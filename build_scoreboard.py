@@ -0,0 +1,13 @@
+'''
+build materialized scoreboard buckets from existing submissions. only
+given problems are rebuilt if problem ids are provided, and it's safe
+to run this script multiple times.
+'''
+
+import sys
+from mongo import *
+
+if __name__ == '__main__':
+    problem_ids = [int(pid) for pid in sys.argv[1:]] or None
+    count = Scoreboard.rebuild(problem_ids)
+    print(f'done. {count} buckets built')
@@ -0,0 +1,25 @@
+'''
+build indexes defined in documents in background. existing indexes
+which are no longer defined are listed, and will be dropped if
+`--drop-unused` is given.
+'''
+
+import sys
+from mongo import engine
+from mongo.utils import sync_indexes
+
+if __name__ == '__main__':
+    drop_unused = '--drop-unused' in sys.argv[1:]
+    documents = [
+        v for v in vars(engine).values()
+        if isinstance(v, type) and issubclass(v, engine.Document)
+        and v is not engine.Document and not v._meta.get('abstract')
+    ]
+    for document in documents:
+        diff = sync_indexes(document, drop_unused=drop_unused)
+        for index in diff['missing']:
+            print(f'{document.__name__}: built {index}')
+        for index in diff['extra']:
+            action = 'dropped' if drop_unused else 'unused'
+            print(f'{document.__name__}: {action} {index}')
+    print('done.')
@@ -0,0 +1,37 @@
+'''
+run the judge dispatcher worker, which takes submissions from the
+dispatch queue and sends them to sandboxes. queued rejudge and regrade jobs
+are also run here, so they survive restarts of the web workers.
+
+only one dispatcher runs at a time, a redis lock is held while running and
+another one waits until the lock is released or expired.
+
+environment variables:
+- DISPATCH_BATCH_SIZE: how many submissions are taken in a batch
+- DISPATCH_CONCURRENCY: how many submissions of a batch are sent in parallel
+- DISPATCH_MAX_ATTEMPTS: give up a submission after this many attempts
+- DISPATCH_BACKOFF: the base delay (in seconds) before retrying
+- DISPATCH_MAX_BACKOFF: the max delay (in seconds) before retrying
+- DISPATCH_REFRESH_INTERVAL: how often (in seconds) the sandbox loads are polled
+- DISPATCHER_LOCK_TTL: how long (in seconds) the lock is kept if the
+  dispatcher dies
+'''
+
+import os
+import logging
+from mongo import Dispatcher
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
+    )
+    dispatcher = Dispatcher(
+        batch_size=int(os.getenv('DISPATCH_BATCH_SIZE', '16')),
+        concurrency=int(os.getenv('DISPATCH_CONCURRENCY', '4')),
+        max_attempts=int(os.getenv('DISPATCH_MAX_ATTEMPTS', '10')),
+        backoff=float(os.getenv('DISPATCH_BACKOFF', '1')),
+        max_backoff=float(os.getenv('DISPATCH_MAX_BACKOFF', '60')),
+        refresh_interval=float(os.getenv('DISPATCH_REFRESH_INTERVAL', '5')),
+    )
+    dispatcher.run()
@@ -1,7 +1,16 @@
+import os
+
 bind = '0.0.0.0:8080'
 errorlog = 'gunicorn_error.log'
 accesslog = 'logs/access.log'
 loglevel = 'debug'
-threads = 5
+# see gunicorn.conf.py
+threads = 5 + int(os.getenv('EVENT_MAX_STREAMS', '16'))
 worker_class = 'gthread'
 reload = True
+
+
+def worker_exit(server, worker):
+    # flush metrics buffered by the worker
+    from mongo.metrics import REGISTRY
+    REGISTRY.flush()
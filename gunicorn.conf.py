@@ -1,5 +1,15 @@
+import os
+
 bind = '0.0.0.0:8080'
 errorlog = 'gunicorn_error.log'
 loglevel = 'debug'
-threads = 5
+# each event stream holds a thread until it's closed (EVENT_STREAM_TIMEOUT),
+# at most EVENT_MAX_STREAMS of them per worker, the others serve requests
+threads = 5 + int(os.getenv('EVENT_MAX_STREAMS', '16'))
 worker_class = 'gthread'
+
+
+def worker_exit(server, worker):
+    # flush metrics buffered by the worker
+    from mongo.metrics import REGISTRY
+    REGISTRY.flush()
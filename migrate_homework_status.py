@@ -0,0 +1,24 @@
+'''
+move student status embedded in homework documents into the homework
+status collection. it's safe to run this script multiple times.
+'''
+
+import sys
+from mongo import *
+from mongo import engine
+
+if __name__ == '__main__':
+    # only migrate given homeworks if ids are provided
+    if len(sys.argv) > 1:
+        homework_ids = sys.argv[1:]
+    else:
+        homework_ids = engine.Homework.objects.only('id').scalar('id')
+    total, moved = 0, 0
+    for homework_id in homework_ids:
+        total += 1
+        try:
+            if Homework(homework_id).migrate_student_status():
+                moved += 1
+        except Exception as e:
+            print(f'fail to migrate homework [{homework_id}]: {e}')
+    print(f'done. {moved}/{total} homeworks migrated')
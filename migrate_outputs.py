@@ -0,0 +1,32 @@
+'''
+move small stdout/stderr of judged submissions from GridFS into
+submission documents. the size limit is read from
+SUBMISSION_INLINE_OUTPUT_SIZE, and it's safe to run this script
+multiple times.
+'''
+
+import sys
+from mongo import *
+from mongo import engine
+
+if __name__ == '__main__':
+    if Submission.config().INLINE_OUTPUT_SIZE <= 0:
+        print('Inline output is disabled.')
+        exit(0)
+    # only migrate given submissions if ids are provided
+    if len(sys.argv) > 1:
+        submissions = engine.Submission.objects(id__in=sys.argv[1:])
+    else:
+        submissions = engine.Submission.objects(tasks__0__exists=True)
+    submission_ids = submissions.only('id').no_cache().scalar('id')
+    total, moved = 0, 0
+    for submission_id in submission_ids:
+        total += 1
+        try:
+            if Submission(submission_id).inline_outputs():
+                moved += 1
+        except Exception as e:
+            print(f'fail to migrate submission [{submission_id}]: {e}')
+        if total % 1000 == 0:
+            print(f'{moved}/{total} submissions migrated')
+    print(f'done. {moved}/{total} submissions migrated')
@@ -46,7 +46,7 @@ def login_required(func):
         json = jwt_decode(token)
         if json is None or not json.get('secret'):
             return HTTPError('Invalid Token', 403)
-        user = User(json['data']['username'])
+        user = User.get_cached(json['data']['username'])
         if json['data'].get('userId') != user.user_id:
             return HTTPError(f'Authorization Expired', 403)
         if not user.active:
@@ -216,3 +216,43 @@ def get_course_scoreboard(user, pids, start, end, course):
         'Success.',
         data=ret,
     )
+
+
+@course_api.route('/<course_name>/scoreboard/events', methods=['GET'])
+@login_required
+@Request.args('pids: str')
+@Request.doc('course_name', 'course', Course)
+def course_scoreboard_events(user, pids, course):
+    '''
+    stream score changes of course students as server-sent events, the
+    scoreboard can be updated without polling
+    '''
+    try:
+        pids = [int(pid.strip()) for pid in pids.split(',')]
+    except (AttributeError, ValueError):
+        return HTTPError('Error occurred when parsing `pids`.', 400)
+    if perm(course, user) < 2:
+        return HTTPError('Permission denied', 403)
+    pids = [*{*pids}]
+    if engine.Problem.objects(
+            problem_id__in=pids,
+            courses=course.obj,
+    ).count() != len(pids):
+        return HTTPError('Some problems are not in the course.', 400)
+    students = {*course.student_nicknames.keys()}
+
+    def deltas():
+        for item in EventChannel.listen(map(EventChannel.problem, pids)):
+            if item is not None:
+                event, data = item
+                if event != 'scoreboard' or data['username'] not in students:
+                    continue
+            yield item
+
+    stream_id = EventChannel.open_stream(user.username)
+    if stream_id is None:
+        return HTTPError('Too many event streams.', 429)
+    return HTTPEventStream(
+        deltas(),
+        on_close=lambda: EventChannel.close_stream(user.username, stream_id),
+    )
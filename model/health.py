@@ -1,8 +1,9 @@
-from flask import Blueprint
+from flask import Blueprint, Response
 from pymongo import MongoClient
 
 from .utils import *
 from mongo.utils import RedisCache
+from mongo.metrics import REGISTRY
 from mongo.engine import MONGO_HOST
 
 __all__ = ('health_api', )
@@ -33,3 +34,11 @@ def health():
 @health_api.route('/livez')
 def livez():
     return HTTPResponse()
+
+
+@health_api.route('/metrics')
+def metrics():
+    return Response(
+        REGISTRY.render(),
+        mimetype='text/plain; version=0.0.4',
+    )
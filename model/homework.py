@@ -2,6 +2,7 @@ from typing import List
 from flask import Blueprint, request
 from mongo import *
 from mongo import engine
+from mongo.utils import perm
 from .utils import *
 from .auth import login_required
 from .course import course_api
@@ -46,6 +47,8 @@ def homework_entry(user, homework_id=None):
                   'scoreboard_status', 'penalty')
     def update_homework(name, markdown, start, end, problem_ids,
                         scoreboard_status, penalty):
+        old = Homework(homework_id)
+        grading = old and (old.penalty, old.duration.end)
         homework = Homework.update(
             user=user,
             homework_id=homework_id,
@@ -57,6 +60,13 @@ def homework_entry(user, homework_id=None):
             scoreboard_status=scoreboard_status,
             penalty=penalty,
         )
+        # existing scores depend on the penalty and deadline
+        if grading != (homework.penalty, homework.duration.end):
+            job = start_regrade(user, str(homework.id))
+            return HTTPResponse(
+                'Update homework Success',
+                data={'regradeJobId': job.id},
+            )
         return HTTPResponse('Update homework Success')
 
     def delete_homework():
@@ -79,8 +89,8 @@ def homework_entry(user, homework_id=None):
             'markdown':
             homework.markdown,
             'studentStatus':
-            homework.student_status
-            if user.role < 2 else homework.student_status.get(user.username),
+            homework.student_status if user.role < 2 else
+            Homework(homework).get_student_status(user.username),
             'penalty':
             homework.penalty if hasattr(homework, 'penalty') else None,
         }
@@ -101,6 +111,44 @@ def homework_entry(user, homework_id=None):
         return HTTPError(str(e), 403)
 
 
+def start_regrade(user, homework_id: str, dry_run: bool = False):
+    # run by the dispatcher worker
+    return RegradeJob.create(user.username, homework_id, dry_run=dry_run)
+
+
+@homework_api.route('/<homework_id>/regrade', methods=['POST'])
+@login_required
+@Request.json('dry_run')
+def regrade(user, homework_id, dry_run):
+    '''
+    recompute student status of a homework with current penalty and
+    deadline in background
+    '''
+    try:
+        homework = Homework.get_by_id(homework_id)
+        course = Course(engine.Course.objects.get(id=homework.course_id))
+    except (engine.DoesNotExist, engine.ValidationError):
+        return HTTPError('homework not exist', 404)
+    if perm(course, user) < 2:
+        return HTTPError('forbidden.', 403)
+    job = start_regrade(user, str(homework.id), dry_run=bool(dry_run))
+    return HTTPResponse(f'{job} is created.', data={'jobId': job.id})
+
+
+@homework_api.route('/regrade/<job_id>', methods=['GET'])
+@login_required
+def regrade_job(user, job_id):
+    '''
+    get the progress of a regrade job, changes are included for dry run
+    '''
+    job = RegradeJob(job_id)
+    if not job:
+        return HTTPError(f'{job} not found', 404)
+    if user.role != 0 and job.creator != user.username:
+        return HTTPError('forbidden.', 403)
+    return HTTPResponse(data=job.progress())
+
+
 @course_api.route('/<course_name>/homework', methods=['GET'])
 @login_required
 def get_homework_list(user, course_name):
@@ -109,6 +157,11 @@ def get_homework_list(user, course_name):
     '''
     try:
         homeworks = Homework.get_homeworks(course_name=course_name)
+        # normal user can not view other's status
+        statuses = Homework.get_student_statuses(
+            homeworks,
+            None if user.role < 2 else user.username,
+        )
         data = []
         for homework in homeworks:
             new = {
@@ -117,16 +170,9 @@ def get_homework_list(user, course_name):
                 'end': int(homework.duration.end.timestamp()),
                 'problemIds': homework.problem_ids,
                 'markdown': homework.markdown,
-                'id': str(homework.id)
+                'id': str(homework.id),
+                'studentStatus': statuses[str(homework.id)],
             }
-            # normal user can not view other's status
-            if user.role < 2:
-                new.update({'studentStatus': homework.student_status})
-            else:
-                new.update({
-                    'studentStatus':
-                    homework.student_status.get(user.username)
-                })
             data.append(new)
     except FileNotFoundError:
         return HTTPError('course not exists',
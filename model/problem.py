@@ -1,6 +1,5 @@
 import json
 import hashlib
-import statistics
 from flask import Blueprint, request, send_file
 from urllib import parse
 from zipfile import BadZipFile
@@ -365,34 +364,47 @@ def publish_problem(user, problem: Problem):
 def problem_stats(user: User, problem: Problem):
     if not problem.check_view_permission(user=user):
         return permission_error_response()
+    stats = ProblemStats.get(problem.problem_id)
     ret = {}
     students = []
     for course in problem.courses:
-        students += [User(name) for name in course.student_nicknames.keys()]
-    students_high_scores = [problem.get_high_score(user=u) for u in students]
+        students += [*course.student_nicknames.keys()]
+    distribution = stats.score_distribution(students)
     # These score statistics are only counting the scores of the students in the course.
-    ret['acUserRatio'] = [problem.get_ac_user_count(), len(students)]
-    ret['triedUserCount'] = problem.get_tried_user_count()
-    ret['average'] = None if len(students) == 0 else statistics.mean(
-        students_high_scores)
-    ret['std'] = None if len(students) <= 1 else statistics.pstdev(
-        students_high_scores)
-    ret['scoreDistribution'] = students_high_scores
+    ret['acUserRatio'] = [stats.ac_user_count, len(students)]
+    ret['triedUserCount'] = stats.tried_user_count
+    ret['average'] = distribution['average']
+    ret['std'] = distribution['std']
+    ret['scoreDistribution'] = distribution['scores']
+    ret['scorePercentiles'] = distribution['percentiles']
+    ret['scoreHistogram'] = distribution['histogram']
     # However, submissions include the submissions of teacher and admin.
-    ret['statusCount'] = problem.get_submission_status()
-    params = {
-        'user': user,
-        'offset': 0,
-        'count': 10,
-        'problem': problem.id,
-        'status': 0,
+    ret['statusCount'] = stats.get_status_count()
+    # load submissions of both lists in one query
+    top_ids = {
+        field: stats.top_submission_ids(field)
+        for field in ('runTime', 'memoryUsage')
     }
-    top_10_runtime_submissions = [
-        s.to_dict() for s in Submission.filter(**params, sort_by='runTime')
+    submissions = engine.Submission.objects(
+        id__in=[_id for ids in top_ids.values()
+                for _id in ids]).only(*Submission.LIST_FIELDS)
+    submissions = [Submission(s) for s in submissions]
+    submissions = dict(
+        zip(
+            (s.obj.id for s in submissions),
+            Submission.to_list_dicts(submissions),
+        ))
+    # cached ids might point to deleted submissions
+    missing = {
+        _id
+        for ids in top_ids.values() for _id in ids if _id not in submissions
+    }
+    stats.discard_top_submissions(missing)
+    ret['top10RunTime'] = [
+        submissions[_id] for _id in top_ids['runTime'] if _id in submissions
     ]
-    ret['top10RunTime'] = top_10_runtime_submissions
-    top_10_memory_submissions = [
-        s.to_dict() for s in Submission.filter(**params, sort_by='memoryUsage')
+    ret['top10MemoryUsage'] = [
+        submissions[_id] for _id in top_ids['memoryUsage']
+        if _id in submissions
     ]
-    ret['top10MemoryUsage'] = top_10_memory_submissions
     return HTTPResponse('Success.', data=ret)
@@ -1,4 +1,5 @@
 import io
+import math
 from typing import Optional
 import requests as rq
 import random
@@ -11,8 +12,11 @@ from flask import (
     current_app,
 )
 from datetime import datetime, timedelta
+from werkzeug.wsgi import wrap_file
 from mongo import *
 from mongo import engine
+from mongo import sandbox
+from mongo.sandbox import SandboxRegistry, SandboxClient
 from mongo.utils import (
     RedisCache,
     perm,
@@ -134,6 +138,8 @@ def create_submission(user, language_type, problem_id):
     'course',
     'before',
     'after',
+    'cursor',
+    'with_count',
 )
 def get_submission_list(
     user,
@@ -146,9 +152,12 @@ def get_submission_list(
     before,
     after,
     language_type,
+    cursor,
+    with_count,
 ):
     '''
-    get the list of submission data
+    get the list of submission data, with the total count unless `withCount`
+    is 0, which saves a count query over the whole filter
     '''
 
     def parse_int(val: Optional[int], name: str):
@@ -159,6 +168,7 @@ def get_submission_list(
         except ValueError:
             raise ValueError(f'can not convert {name} to integer')
 
+    with_count = with_count not in ('0', 'false')
     cache_key = (
         'SUBMISSION_LIST_API',
         user,
@@ -171,6 +181,8 @@ def get_submission_list(
         count,
         before,
         after,
+        cursor,
+        with_count,
     )
     cache_key = '_'.join(map(str, cache_key))
     cache = RedisCache()
@@ -178,6 +190,7 @@ def get_submission_list(
     if cache.exists(cache_key):
         submissions = json.loads(cache.get(cache_key))
         submission_count = submissions['submission_count']
+        cursors = submissions['cursors']
         submissions = submissions['submissions']
     else:
         # convert args
@@ -215,16 +228,19 @@ def get_submission_list(
                 'before': before,
                 'after': after,
             })
-            submissions, submission_count = Submission.filter(
+            submissions, submission_count, *cursors = Submission.filter_page(
                 **params,
-                with_count=True,
+                cursor=cursor,
+                with_count=with_count,
+                only=Submission.LIST_FIELDS,
             )
-            submissions = [s.to_dict() for s in submissions]
+            submissions = Submission.to_list_dicts(submissions)
             cache.set(
                 cache_key,
                 json.dumps({
                     'submissions': submissions,
                     'submission_count': submission_count,
+                    'cursors': cursors,
                 }), 15)
         except ValueError as e:
             return HTTPError(str(e), 400)
@@ -239,6 +255,8 @@ def get_submission_list(
         'unicorn': random.choice(unicorns),
         'submissions': submissions,
         'submissionCount': submission_count,
+        'nextCursor': cursors[0],
+        'prevCursor': cursors[1],
     }
     return HTTPResponse(
         'here you are, bro',
@@ -246,10 +264,53 @@ def get_submission_list(
     )
 
 
-@submission_api.route('/<submission>', methods=['GET'])
+@submission_api.route('/events', methods=['GET'])
 @login_required
-@Request.doc('submission', Submission)
-def get_submission(user, submission: Submission):
+@Request.args('problem_id', 'username')
+def submission_events(user, problem_id, username):
+    '''
+    stream verdicts of submissions as server-sent events instead of
+    polling the submission list
+    '''
+    if problem_id is not None:
+        try:
+            problem_id = int(problem_id)
+        except ValueError:
+            return HTTPError('problemId must be an integer', 400)
+    # students can only get their own submissions
+    if user.role == User.engine.Role.STUDENT:
+        username = user.username
+    if username is not None:
+        channel = EventChannel.user(username)
+    elif problem_id is not None:
+        channel = EventChannel.problem(problem_id)
+    else:
+        channel = EventChannel.SUBMISSION
+
+    def verdicts():
+        for item in EventChannel.listen([channel]):
+            if item is not None:
+                event, data = item
+                if event != 'verdict':
+                    continue
+                if problem_id is not None and data['problemId'] != problem_id:
+                    continue
+            yield item
+
+    stream_id = EventChannel.open_stream(user.username)
+    if stream_id is None:
+        return HTTPError('Too many event streams.', 429)
+    return HTTPEventStream(
+        verdicts(),
+        on_close=lambda: EventChannel.close_stream(user.username, stream_id),
+    )
+
+
+def check_view(user, submission: Submission):
+    '''
+    check whether the user can view the detail of a submission, return
+    the error response if not
+    '''
     # check permission
     if submission.handwritten and submission.permission(user) < 2:
         return HTTPError('forbidden.', 403)
@@ -260,6 +321,15 @@ def get_submission(user, submission: Submission):
     if not all(submission.timestamp in hw.duration
                for hw in problem.running_homeworks() if hw.ip_filters):
         return HTTPError('You cannot view this submission during quiz.', 403)
+    return None
+
+
+@submission_api.route('/<submission>', methods=['GET'])
+@login_required
+@Request.doc('submission', Submission)
+def get_submission(user, submission: Submission):
+    if (err := check_view(user, submission)) is not None:
+        return err
     # serialize submission
     has_code = not submission.handwritten and submission.permission(user) >= 2
     has_output = submission.problem.can_view_stdout
@@ -312,6 +382,49 @@ def get_submission_output(
     return HTTPResponse('ok', data=output)
 
 
+@submission_api.route(
+    '/<submission>/output/<int:task_no>/<int:case_no>/<fd>',
+    methods=['GET'],
+)
+@login_required
+@Request.doc('submission', Submission)
+def stream_submission_output(
+    user,
+    submission: Submission,
+    task_no: int,
+    case_no: int,
+    fd: str,
+):
+    '''
+    stream stdout/stderr of a case, support HTTP range requests
+    '''
+    # the rest of outputs previewed in the detail view
+    if (err := check_view(user, submission)) is not None:
+        return err
+    if submission.permission(user) < 2 and \
+            not submission.problem.can_view_stdout:
+        return HTTPError('permission denied', 403)
+    try:
+        output, size = submission.open_output(task_no, case_no, fd)
+    except (ValueError, FileNotFoundError) as e:
+        return HTTPError(str(e), 400)
+    except AttributeError as e:
+        return HTTPError(str(e), 102)
+    rv = current_app.response_class(
+        wrap_file(request.environ, output),
+        mimetype='text/plain',
+        direct_passthrough=True,
+    )
+    rv.content_length = size
+    rv.set_etag(f'{submission.id}-{submission.last_send.timestamp()}'
+                f'-{task_no}-{case_no}-{fd}')
+    return rv.make_conditional(
+        request,
+        accept_ranges=True,
+        complete_length=size,
+    )
+
+
 @submission_api.route('/<submission>/pdf/<item>', methods=['GET'])
 @login_required
 @Request.doc('submission', Submission)
@@ -493,6 +606,76 @@ def rejudge(user, submission: Submission):
         return HTTPError('Some error occurred, please contact the admin', 500)
 
 
+@submission_api.route('/rejudge', methods=['POST'])
+@identity_verify(0, 1)
+@Request.json('problem_id', 'homework_id', 'status', 'before', 'after')
+def create_rejudge_job(user, problem_id, homework_id, status, before, after):
+    '''
+    rejudge submissions of a problem or homework in background
+    '''
+    try:
+        status, before, after = (None if v is None else int(v)
+                                 for v in (status, before, after))
+    except (TypeError, ValueError):
+        return HTTPError('status, before and after must be integer', 400)
+    try:
+        if any(v is not None and v < 0 for v in (before, after)):
+            raise ValueError
+        before, after = (None if v is None else datetime.fromtimestamp(v)
+                         for v in (before, after))
+    except (ValueError, OverflowError, OSError):
+        return HTTPError('before and after must be valid timestamps', 400)
+    if problem_id is not None:
+        problem = Problem(problem_id)
+        if not problem:
+            return HTTPError(f'{problem} not found', 404)
+        if not problem.check_manage_permission(user=user):
+            return HTTPError('forbidden.', 403)
+        problem_ids = [problem.problem_id]
+    elif homework_id is not None:
+        try:
+            homework = Homework.get_by_id(homework_id)
+            course = Course(engine.Course.objects.get(id=homework.course_id))
+        except (engine.DoesNotExist, ValidationError):
+            return HTTPError('homework not exist', 404)
+        if perm(course, user) < 2:
+            return HTTPError('forbidden.', 403)
+        problem_ids = homework.problem_ids
+    # only admin can rejudge submissions of all problems
+    elif user.role != 0:
+        return HTTPError('problemId or homeworkId is required', 400)
+    else:
+        problem_ids = None
+    try:
+        job = RejudgeJob.create(
+            user.username,
+            problem_ids=problem_ids,
+            status=status,
+            before=before,
+            after=after,
+        )
+    except ValueError as e:
+        return HTTPError(str(e), 400)
+    # the dispatcher worker will run it
+    return HTTPResponse(f'{job} is created.', data={'jobId': job.id})
+
+
+@submission_api.route('/rejudge/<job_id>', methods=['GET', 'DELETE'])
+@identity_verify(0, 1)
+def rejudge_job(user, job_id):
+    '''
+    get the progress of a rejudge job or cancel it
+    '''
+    job = RejudgeJob(job_id)
+    if not job:
+        return HTTPError(f'{job} not found', 404)
+    if user.role != 0 and job.creator != user.username:
+        return HTTPError('forbidden.', 403)
+    if request.method == 'DELETE':
+        job.cancel()
+    return HTTPResponse(data=job.progress())
+
+
 @submission_api.route('/config', methods=['GET', 'PUT'])
 @login_required
 @identity_verify(0)
@@ -505,8 +688,12 @@ def config(user):
         del ret['_id']
         return HTTPResponse('success.', data=ret)
 
-    @Request.json('rate_limit: int', 'sandbox_instances: list')
-    def modify_config(rate_limit, sandbox_instances):
+    @Request.json(
+        'rate_limit: int',
+        'sandbox_instances: list',
+        'sandbox_strategy',
+    )
+    def modify_config(rate_limit, sandbox_instances, sandbox_strategy):
         # try to convert json object to Sandbox instance
         try:
             sandbox_instances = [
@@ -523,28 +710,37 @@ def config(user):
             )
         # skip if during testing
         if not current_app.config['TESTING']:
-            resps = []
+            errs = []
             # check sandbox status
             for sb in sandbox_instances:
-                resp = rq.get(f'{sb.url}/status')
+                try:
+                    resp = SandboxClient(sb).status()
+                except rq.RequestException as e:
+                    errs.append({
+                        'name': sb.name,
+                        'statusCode': None,
+                        'response': str(e),
+                    })
+                    continue
                 if not resp.ok:
-                    resps.append((sb.name, resp))
+                    errs.append({
+                        'name': sb.name,
+                        'statusCode': resp.status_code,
+                        'response': resp.text,
+                    })
             # some exception occurred
-            if len(resps) != 0:
+            if len(errs) != 0:
                 return HTTPError(
                     'some error occurred when check sandbox status',
                     400,
-                    data=[{
-                        'name': name,
-                        'statusCode': resp.status_code,
-                        'response': resp.text,
-                    } for name, resp in resps],
+                    data=errs,
                 )
         try:
-            config.update(
-                rate_limit=rate_limit,
-                sandbox_instances=sandbox_instances,
-            )
+            config.update(**drop_none({
+                'rate_limit': rate_limit,
+                'sandbox_instances': sandbox_instances,
+                'sandbox_strategy': sandbox_strategy,
+            }))
         except ValidationError as e:
             return HTTPError(str(e), 400)
 
@@ -552,3 +748,33 @@ def config(user):
 
     methods = {'GET': get_config, 'PUT': modify_config}
     return methods[request.method]()
+
+
+@submission_api.route('/sandbox/heartbeat', methods=['PUT'])
+@Request.json('token: str', 'load')
+def sandbox_heartbeat(token, load):
+    '''
+    sandboxes report their current load here
+    '''
+    target = sandbox.find_by_token(token or '')
+    if target is None:
+        return HTTPError('Invalid sandbox token', 401)
+    try:
+        load = float(load)
+    except (TypeError, ValueError):
+        return HTTPError('load must be a number', 400)
+    # a nan load would break the ordering of sandboxes
+    if not (math.isfinite(load) and load >= 0):
+        return HTTPError('load must be a non-negative number', 400)
+    SandboxRegistry().report(target.name, load)
+    return HTTPResponse('ok')
+
+
+@submission_api.route('/sandbox', methods=['GET'])
+@identity_verify(0)
+def sandbox_status(user):
+    '''
+    get load and connection statistics of sandboxes, requests are sent
+    by the dispatcher
+    '''
+    return HTTPResponse(data=SandboxRegistry().status())
@@ -1,9 +1,16 @@
 from . import request
 from . import response
 from . import smtp
+from . import profile
 
 from .request import *
 from .response import *
 from .smtp import *
+from .profile import *
 
-__all__ = [*request.__all__, *response.__all__, *smtp.__all__]
+__all__ = [
+    *request.__all__,
+    *response.__all__,
+    *smtp.__all__,
+    *profile.__all__,
+]
@@ -0,0 +1,78 @@
+import time
+from flask import Flask, g, request
+from mongo.metrics import Counter, Histogram, SIZE_BUCKETS
+from mongo.profiler import Profile
+
+__all__ = ('profile_requests', )
+
+REQUEST_SECONDS = Histogram(
+    'noj_http_request_duration_seconds',
+    'Time spent on each endpoint.',
+    labels=('endpoint', 'method'),
+)
+RESPONSES = Counter(
+    'noj_http_responses_total',
+    'Responses of each endpoint by status code.',
+    labels=('endpoint', 'method', 'status'),
+)
+RESPONSE_BYTES = Histogram(
+    'noj_http_response_size_bytes',
+    'Body size of non-streamed responses.',
+    labels=('endpoint', ),
+    buckets=SIZE_BUCKETS,
+)
+
+
+def profile_requests(app: Flask):
+    '''
+    count database commands of each request, the breakdown is returned in
+    headers in debug mode, and slow requests are logged. latency, status
+    code and response size are recorded per endpoint, the latency of a
+    streamed response is measured until it's closed.
+    '''
+
+    @app.before_request
+    def start_profile():
+        g.profile = Profile()
+
+    @app.after_request
+    def finish_profile(response):
+        current = g.get('profile')
+        if current is None:
+            return response
+        current.finish()
+        # unmatched urls share one label to bound the number of series
+        endpoint = request.endpoint or 'unmatched'
+        method = request.method
+
+        def observe_latency():
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - current.started,
+                endpoint=endpoint,
+                method=method,
+            )
+
+        # the body is sent after this, e.g. event streams
+        if response.is_streamed:
+            response.call_on_close(observe_latency)
+        else:
+            observe_latency()
+        RESPONSES.inc(
+            endpoint=endpoint,
+            method=request.method,
+            status=response.status_code,
+        )
+        if response.content_length is not None:
+            RESPONSE_BYTES.observe(response.content_length, endpoint=endpoint)
+        if app.debug:
+            response.headers['X-DB-Queries'] = ', '.join(
+                f'{k}={v}' for k, v in current.counts.items())
+            response.headers['X-DB-Time'] = \
+                f'{current.db_time * 1000:.1f}ms'
+            response.headers['X-DB-Slowest'] = '; '.join(
+                f'{backend} {command} {duration * 1000:.1f}ms'
+                for duration, backend, command in current.slowest)
+        if current.slow:
+            app.logger.warning(f'slow request [{request.method} '
+                               f'{request.path}] {current.breakdown()}')
+        return response
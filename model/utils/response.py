@@ -1,6 +1,8 @@
-from flask import jsonify, redirect
+import json
+from typing import Any, Callable, Iterable, Optional, Tuple
+from flask import Response, jsonify, redirect
 
-__all__ = ['HTTPResponse', 'HTTPRedirect', 'HTTPError']
+__all__ = ['HTTPResponse', 'HTTPRedirect', 'HTTPError', 'HTTPEventStream']
 
 
 class HTTPBaseResponese(tuple):
@@ -78,3 +80,43 @@ class HTTPError(HTTPResponse):
             data,
             cookies,
         )
+
+
+class HTTPEventStream(HTTPBaseResponese):
+    '''
+    server-sent events, each item of `events` is a (event, data) tuple,
+    or None to send a comment which keeps the connection alive.
+    `on_close` is called after the connection is closed.
+    '''
+
+    def __new__(
+        cls,
+        events: Iterable[Optional[Tuple[str, Any]]],
+        status_code=200,
+        on_close: Optional[Callable[[], Any]] = None,
+    ):
+
+        def generate():
+            for item in events:
+                if item is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                event, data = item
+                yield f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+        resp = Response(
+            generate(),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                # disable buffering of nginx
+                'X-Accel-Buffering': 'no',
+            },
+        )
+        if on_close is not None:
+            resp.call_on_close(on_close)
+        return super().__new__(
+            HTTPBaseResponese,
+            resp,
+            status_code,
+        )
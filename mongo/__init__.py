@@ -9,6 +9,12 @@ from . import announcement
 from . import contest
 from . import post
 from . import ip_filter
+from . import dispatch
+from . import rejudge
+from . import scoreboard
+from . import event
+from . import penalty
+from . import regrade
 
 from .course import *
 from .engine import *
@@ -21,6 +27,12 @@ from .announcement import *
 from .contest import *
 from .post import *
 from .ip_filter import *
+from .dispatch import *
+from .rejudge import *
+from .scoreboard import *
+from .event import *
+from .penalty import *
+from .regrade import *
 
 __all__ = [
     *course.__all__,
@@ -34,4 +46,10 @@ __all__ = [
     *contest.__all__,
     *post.__all__,
     *ip_filter.__all__,
+    *dispatch.__all__,
+    *rejudge.__all__,
+    *scoreboard.__all__,
+    *event.__all__,
+    *penalty.__all__,
+    *regrade.__all__,
 ]
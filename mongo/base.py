@@ -1,9 +1,113 @@
-from flask import current_app
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+from flask import current_app, has_request_context, request
 from . import engine
 from mongoengine.errors import *
 import logging
 
-__all__ = ['MongoBase']
+__all__ = ['MongoBase', 'IdentityMap', 'identity_map']
+
+
+class IdentityMap:
+    '''
+    Documents loaded by `MongoBase` in a unit of work, so that constructing
+    wrappers of the same document doesn't query it again. A request has its
+    own map bound to its WSGI environ, other workers can use
+    `identity_map()`. Loaded copies are dropped when the document is
+    updated, saved or deleted through mongoengine.
+    '''
+
+    def __init__(self):
+        self.documents: Dict[Tuple[type, Any], Any] = {}
+        # queries made by `MongoBase` and the ones saved
+        self.misses = 0
+        self.hits = 0
+
+    @staticmethod
+    def current() -> Optional['IdentityMap']:
+        ret = _identity_map.get()
+        if ret is None and has_request_context():
+            # `flask.g` may outlive a request when an app context is
+            # pushed outside, e.g. in tests
+            ret = request.environ.setdefault('noj.identity_map', IdentityMap())
+        return ret
+
+    @staticmethod
+    def key(model, pk) -> Tuple[type, Any]:
+        field = model._fields[model._meta['id_field']]
+        try:
+            pk = field.to_python(pk)
+        except Exception:
+            pass
+        return model, pk
+
+    def get(self, model, pk):
+        document = self.documents.get(self.key(model, pk))
+        if document is not None:
+            self.hits += 1
+        return document
+
+    def add(self, document):
+        self.misses += 1
+        self.documents[self.key(type(document), document.pk)] = document
+
+    def discard(self, document):
+        self.documents.pop(self.key(type(document), document.pk), None)
+
+    @classmethod
+    def on_save(cls, sender, document, **ks):
+        '''
+        drop other loaded copies of a saved document
+        '''
+        documents = cls.current()
+        if documents is None or document.pk is None:
+            return
+        loaded = documents.documents.get(cls.key(sender, document.pk))
+        if loaded is not None and loaded is not document:
+            documents.discard(loaded)
+
+    @classmethod
+    def on_delete(cls, sender, document, **ks):
+        if (documents := cls.current()) is not None:
+            documents.discard(document)
+
+    @classmethod
+    def on_update(cls, sender, queryset, **ks):
+        '''
+        drop loaded copies of documents going to be updated
+        '''
+        if (documents := cls.current()) is None:
+            return
+        pk = queryset._query.get('_id')
+        if pk is not None and not isinstance(pk, dict):
+            documents.documents.pop(cls.key(sender, pk), None)
+            return
+        # the query is not by pk, drop all of this model
+        for key in [k for k in documents.documents if k[0] is sender]:
+            del documents.documents[key]
+
+
+_identity_map: ContextVar[Optional[IdentityMap]] = ContextVar(
+    'identity_map',
+    default=None,
+)
+
+engine.signals.post_save.connect(IdentityMap.on_save)
+engine.signals.post_delete.connect(IdentityMap.on_delete)
+engine.pre_update.connect(IdentityMap.on_update)
+
+
+@contextmanager
+def identity_map():
+    '''
+    use a new identity map in this context, it can also decorate functions
+    '''
+    token = _identity_map.set(IdentityMap())
+    try:
+        yield _identity_map.get()
+    finally:
+        _identity_map.reset(token)
 
 
 class MongoBase:
@@ -17,14 +121,26 @@ class MongoBase:
         if isinstance(pk, cls):
             return pk
         new = super().__new__(cls)
-        # got a engine instance
+        # got a engine instance, check its existence later if it's not
+        # loaded from db
         if isinstance(pk, new.engine):
             new.obj = pk
+            new._exists = None if pk._created or cls.qs_filter else True
+            return new
+        new._exists = True
+        documents = IdentityMap.current()
+        if documents is not None:
+            new.obj = documents.get(new.engine, pk)
+            if new.obj is not None:
+                return new
+        try:
+            new.obj = new.engine.objects(pk=pk, **cls.qs_filter).get()
+        except engine.DoesNotExist:
+            new.obj = new.engine(id=pk)
+            new._exists = False
         else:
-            try:
-                new.obj = new.engine.objects(pk=pk).get()
-            except engine.DoesNotExist:
-                new.obj = new.engine(id=pk)
+            if documents is not None:
+                documents.add(new.obj)
         return new
 
     def __getattr__(self, name):
@@ -40,10 +156,24 @@ class MongoBase:
         return self and other is not None and self.pk == other.pk
 
     def __bool__(self):
-        try:
-            return self._qs.filter(pk=self.pk, **self.qs_filter).__bool__()
-        except ValidationError:
-            return False
+        return self.exists()
+
+    def exists(self, refresh: bool = False) -> bool:
+        '''
+        whether the document exists, it's known when the document is loaded
+        unless `refresh` is set
+        '''
+        exists = self.__dict__.get('_exists')
+        if refresh or exists is None:
+            try:
+                exists = self._qs.filter(
+                    pk=self.pk,
+                    **self.qs_filter,
+                ).__bool__()
+            except ValidationError:
+                exists = False
+            self._exists = exists
+        return exists
 
     def __str__(self):
         return f'{self.__class__.__name__.lower()} [{self.pk}]'
@@ -51,8 +181,26 @@ class MongoBase:
     def __repr__(self):
         return self.obj.to_json() if self else '{}'
 
+    def update(self, **ks):
+        # the loaded copy is dropped by `pre_update`
+        ret = self.obj.update(**ks)
+        # it may not match the filter anymore
+        if self.qs_filter:
+            self._exists = None
+        return ret
+
+    def save(self, *args, **ks):
+        ret = self.obj.save(*args, **ks)
+        self._exists = None if self.qs_filter else True
+        return ret
+
+    def delete(self, *args, **ks):
+        ret = self.obj.delete(*args, **ks)
+        self._exists = False
+        return ret
+
     def reload(self, *fields):
-        if self:
+        if self.exists(refresh=True):
             self.obj.reload(*fields)
         return self
 
@@ -61,4 +209,4 @@ class MongoBase:
         try:
             return current_app.logger
         except RuntimeError:
-            return logging.getLogger('gunicorn.error')
\ No newline at end of file
+            return logging.getLogger('gunicorn.error')
@@ -4,6 +4,7 @@ from .utils import *
 import re
 from typing import Dict, List, Optional
 from .base import MongoBase
+from .scoreboard import Scoreboard
 from datetime import datetime
 
 __all__ = [
@@ -105,81 +106,50 @@ class Course(MongoBase, engine=engine.Course):
         start: Optional[float] = None,
         end: Optional[float] = None,
     ) -> List[Dict]:
-        scoreboard = []
-        usernames = [User(u).id for u in self.student_nicknames.keys()]
-        matching = {
-            "user": {
-                "$in": usernames
-            },
-            "problem": {
-                "$in": problem_ids
-            },
-            "timestamp": {},
-        }
+        usernames = [*self.student_nicknames.keys()]
         if start:
-            matching['timestamp']['$gte'] = datetime.fromtimestamp(start)
+            start = datetime.fromtimestamp(start)
         if end:
-            matching['timestamp']['$lte'] = datetime.fromtimestamp(end)
-        if not matching["timestamp"]:
-            del matching["timestamp"]
-        pipeline = [
-            {
-                "$match": matching
-            },
-            {
-                "$group": {
-                    "_id": {
-                        "user": "$user",
-                        "problem": "$problem",
-                    },
-                    "count": {
-                        "$sum": 1
-                    },
-                    "max": {
-                        "$max": "$score"
-                    },
-                    "min": {
-                        "$min": "$score"
-                    },
-                    "avg": {
-                        "$avg": "$score"
-                    },
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$_id.user",
-                    "scores": {
-                        "$push": {
-                            "pid": "$_id.problem",
-                            "count": "$count",
-                            "max": "$max",
-                            "min": "$min",
-                            "avg": "$avg",
-                        },
-                    },
-                }
-            },
-        ]
-        cursor = engine.Submission.objects().aggregate(pipeline)
-        unrecorded_users = set(usernames)
-        for item in cursor:
-            sum_of_score = sum(s['max'] for s in item['scores'])
+            end = datetime.fromtimestamp(end)
+        scores = Scoreboard.query(
+            usernames,
+            problem_ids,
+            start or None,
+            end or None,
+        )
+        users = engine.User.objects(username__in=usernames).only(
+            'username',
+            'profile.displayed_name',
+            'md5',
+            'role',
+        )
+        infos = {u.username: u.info for u in users}
+        scoreboard = []
+        for username in usernames:
+            user_scores = scores.get(username)
+            if not user_scores:
+                scoreboard.append({
+                    'user': infos.get(username),
+                    'sum': 0,
+                    'avg': 0,
+                })
+                continue
+            sum_of_score = sum(s['max'] for s in user_scores.values())
             scoreboard.append({
-                'user': User(item['_id']).info,
+                'user': infos.get(username),
                 'sum': sum_of_score,
                 'avg': sum_of_score / len(problem_ids),
-                **{f'{score["pid"]}': score
-                   for score in item['scores']},
+                **{
+                    f'{pid}': {
+                        'pid': pid,
+                        'count': s['count'],
+                        'max': s['max'],
+                        'min': s['min'],
+                        'avg': s['total'] / s['count'],
+                    }
+                    for pid, s in user_scores.items()
+                },
             })
-            unrecorded_users.remove(item['_id'])
-        for u in unrecorded_users:
-            scoreboard.append({
-                'user': User(u).info,
-                'sum': 0,
-                'avg': 0,
-            })
-
         return scoreboard
 
     @classmethod
@@ -0,0 +1,530 @@
+import os
+import time
+import secrets
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+from redis.exceptions import WatchError
+from .base import identity_map
+from .metrics import Gauge
+from .utils import RedisCache
+from .sandbox import SandboxRegistry
+
+__all__ = (
+    'DispatchQueue',
+    'QueuedJob',
+    'Dispatcher',
+)
+
+
+class DispatchQueue:
+    '''
+    A redis-backed queue holding submissions waiting to be sent to sandbox.
+
+    Submission ids are pushed into `QUEUE_KEY`, and the dispatcher moves
+    them into `PROCESSING_KEY` while sending, so that a crashed worker
+    won't lose any submission. Submissions which should be retried later
+    are kept in a sorted set `DELAYED_KEY` scored by their ready time.
+    '''
+    QUEUE_KEY = 'JUDGE_QUEUE'
+    PROCESSING_KEY = 'JUDGE_QUEUE_PROCESSING'
+    DELAYED_KEY = 'JUDGE_QUEUE_DELAYED'
+    # dispatch states
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    RETRYING = 'retrying'
+    SENT = 'sent'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    # keep the state of a finished submission for a while
+    STATE_TTL = int(os.getenv('DISPATCH_STATE_TTL', str(24 * 60 * 60)))
+
+    def __init__(self, cache: Optional[RedisCache] = None):
+        self.client = (cache or RedisCache()).client
+
+    @staticmethod
+    def state_key(submission_id: str) -> str:
+        return f'JUDGE_DISPATCH_{submission_id}'
+
+    @staticmethod
+    def job_key(job_id: str) -> str:
+        return f'JUDGE_JOB_{job_id}'
+
+    def __len__(self):
+        return self.client.llen(self.QUEUE_KEY) + self.client.zcard(
+            self.DELAYED_KEY)
+
+    def depth(self) -> Dict[str, int]:
+        '''
+        number of submissions in each part of the queue
+        '''
+        pipe = self.client.pipeline(transaction=False)
+        pipe.llen(self.QUEUE_KEY)
+        pipe.llen(self.PROCESSING_KEY)
+        pipe.zcard(self.DELAYED_KEY)
+        return dict(
+            zip((self.QUEUED, self.SENDING, self.RETRYING), pipe.execute()))
+
+    def _set_state(self, submission_id: str, state: str, **ks):
+        self.client.hset(
+            self.state_key(submission_id),
+            mapping={
+                'state': state,
+                'updated': time.time(),
+                **ks,
+            },
+        )
+
+    def state(self, submission_id: str) -> Optional[Dict[str, Any]]:
+        '''
+        get the dispatch state of a submission, return None if it
+        has never been queued
+        '''
+        raw = self.client.hgetall(self.state_key(submission_id))
+        if not raw:
+            return None
+        ret = {k.decode(): v.decode() for k, v in raw.items()}
+        ret['attempts'] = int(ret.get('attempts', 0))
+        for k in ('queued', 'updated'):
+            if k in ret:
+                ret[k] = float(ret[k])
+        return ret
+
+    def push(self, submission_id: str, job: Optional[str] = None):
+        self.push_many([submission_id], job)
+
+    def push_many(
+        self,
+        submission_ids: Iterable[str],
+        job: Optional[str] = None,
+    ):
+        '''
+        push submissions into queue in one round trip
+
+        Args:
+            submission_ids: ids of submissions
+            job: the job id these submissions belong to, the job's
+                counters will be updated when they are dispatched
+        '''
+        now = time.time()
+        state = {
+            'state': self.QUEUED,
+            'attempts': 0,
+            'queued': now,
+            'updated': now,
+        }
+        if job is not None:
+            state['job'] = job
+        pipe = self.client.pipeline()
+        for submission_id in map(str, submission_ids):
+            pipe.zrem(self.DELAYED_KEY, submission_id)
+            pipe.lpush(self.QUEUE_KEY, submission_id)
+            pipe.delete(self.state_key(submission_id))
+            pipe.hset(self.state_key(submission_id), mapping=state)
+        pipe.execute()
+
+    def _finish(self, submission_id: str, state: str, **ks):
+        self.client.lrem(self.PROCESSING_KEY, 0, submission_id)
+        self._set_state(submission_id, state, **ks)
+        job = self.client.hget(self.state_key(submission_id), 'job')
+        # don't recreate an expired job without TTL
+        if job is not None and self.client.exists(self.job_key(job.decode())):
+            self.client.hincrby(self.job_key(job.decode()), state, 1)
+        self.client.expire(self.state_key(submission_id), self.STATE_TTL)
+
+    def promote(self) -> int:
+        '''
+        move submissions whose backoff is over back to the queue
+        '''
+        now = time.time()
+        ready = self.client.zrangebyscore(self.DELAYED_KEY, '-inf', now)
+        cnt = 0
+        for submission_id in ready:
+            # other worker may have taken it
+            if self.client.zrem(self.DELAYED_KEY, submission_id):
+                self.client.lpush(self.QUEUE_KEY, submission_id)
+                cnt += 1
+        return cnt
+
+    def pop(self, count: int = 1) -> List[str]:
+        '''
+        take at most `count` submissions from the queue and mark
+        them as sending
+        '''
+        self.promote()
+        ret = []
+        for _ in range(count):
+            submission_id = self.client.rpoplpush(
+                self.QUEUE_KEY,
+                self.PROCESSING_KEY,
+            )
+            if submission_id is None:
+                break
+            submission_id = submission_id.decode()
+            # a submission pushed twice is only sent once
+            state = self.client.hget(self.state_key(submission_id), 'state')
+            if state not in (self.QUEUED.encode(), self.RETRYING.encode()):
+                self.client.lrem(self.PROCESSING_KEY, 1, submission_id)
+                continue
+            self._set_state(submission_id, self.SENDING)
+            ret.append(submission_id)
+        return ret
+
+    def ack(self, submission_id: str):
+        '''
+        the submission is accepted by sandbox
+        '''
+        self._finish(submission_id, self.SENT)
+
+    def retry(self, submission_id: str, delay: float, reason: str = ''):
+        '''
+        put the submission back to queue after `delay` seconds
+        '''
+        pipe = self.client.pipeline()
+        pipe.lrem(self.PROCESSING_KEY, 0, submission_id)
+        pipe.zadd(self.DELAYED_KEY, {submission_id: time.time() + delay})
+        pipe.hincrby(self.state_key(submission_id), 'attempts', 1)
+        pipe.execute()
+        self._set_state(submission_id, self.RETRYING, reason=reason)
+
+    def fail(self, submission_id: str, reason: str = ''):
+        '''
+        give up sending this submission
+        '''
+        self._finish(submission_id, self.FAILED, reason=reason)
+
+    def cancel(self, submission_id: str):
+        '''
+        drop this submission because its job is cancelled
+        '''
+        self._finish(submission_id, self.CANCELLED)
+
+    def mark_reset(self, submission_id: str):
+        '''
+        the submission is going to be reset by its rejudge job
+        '''
+        self.client.hset(self.state_key(submission_id), 'reset', 1)
+
+    def is_cancelled(self, submission_id: str) -> bool:
+        job = self.client.hget(self.state_key(submission_id), 'job')
+        if job is None:
+            return False
+        state = self.client.hget(self.job_key(job.decode()), 'state')
+        return state == self.CANCELLED.encode()
+
+    def recover(self) -> int:
+        '''
+        move submissions left in processing list (e.g. the worker
+        was killed while sending) back to the queue
+        '''
+        cnt = 0
+        while (submission_id := self.client.rpoplpush(
+                self.PROCESSING_KEY,
+                self.QUEUE_KEY,
+        )) is not None:
+            self._set_state(submission_id.decode(), self.QUEUED)
+            cnt += 1
+        return cnt
+
+
+QUEUE_DEPTH = Gauge(
+    'noj_judge_queue_depth',
+    'Submissions waiting to be sent to sandbox.',
+    labels=('state', ),
+    collect=lambda: [({
+        'state': state
+    }, depth) for state, depth in DispatchQueue().depth().items()],
+)
+
+
+class QueuedJob(ABC):
+    '''
+    A background job run by the dispatcher worker instead of the web
+    workers. Job ids are queued in `QUEUE_KEY` and moved to
+    `PROCESSING_KEY` while running, so jobs of a killed worker are run
+    again after it restarts. Subclasses keep their info in `key`.
+    '''
+    QUEUE_KEY: str
+    PROCESSING_KEY: str
+
+    def __init__(self, job_id: str):
+        self.id = job_id
+        self.client = RedisCache().client
+
+    @property
+    @abstractmethod
+    def key(self) -> str:
+        ...
+
+    def __bool__(self):
+        return bool(self.client.exists(self.key))
+
+    def enqueue(self):
+        self.client.lpush(self.QUEUE_KEY, self.id)
+
+    @classmethod
+    def take(cls) -> Optional['QueuedJob']:
+        '''
+        take a queued job to run, expired ones are skipped
+        '''
+        client = RedisCache().client
+        while (job_id := client.rpoplpush(
+                cls.QUEUE_KEY,
+                cls.PROCESSING_KEY,
+        )) is not None:
+            job = cls(job_id.decode())
+            if job:
+                return job
+            job.done()
+        return None
+
+    def done(self):
+        '''
+        remove this job from the processing list
+        '''
+        self.client.lrem(self.PROCESSING_KEY, 0, self.id)
+
+    @classmethod
+    def recover(cls) -> int:
+        '''
+        queue jobs left in processing list (e.g. the worker was killed
+        while running them) again
+        '''
+        client = RedisCache().client
+        cnt = 0
+        while client.rpoplpush(cls.PROCESSING_KEY, cls.QUEUE_KEY) is not None:
+            cnt += 1
+        return cnt
+
+    @abstractmethod
+    def run(self):
+        ...
+
+
+class Dispatcher:
+    '''
+    Worker that sends queued submissions to sandboxes, only one of them
+    can run at a time
+    '''
+    LOCK_KEY = 'JUDGE_DISPATCHER_LOCK'
+    LOCK_TTL = float(os.getenv('DISPATCHER_LOCK_TTL', '30'))
+
+    def __init__(
+        self,
+        queue: Optional[DispatchQueue] = None,
+        batch_size: int = 16,
+        max_attempts: int = 10,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        refresh_interval: float = 5.0,
+        concurrency: int = 1,
+    ):
+        self.queue = queue or DispatchQueue()
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.refresh_interval = refresh_interval
+        # send submissions of a batch in parallel
+        self.pool = ThreadPoolExecutor(
+            max_workers=concurrency) if concurrency > 1 else None
+        self.logger = logging.getLogger('dispatcher')
+
+    def backoff_delay(self, attempts: int) -> float:
+        return min(self.backoff * 2**attempts, self.max_backoff)
+
+    def _retry(self, submission_id: str, reason: str):
+        state = self.queue.state(submission_id) or {}
+        attempts = state.get('attempts', 0)
+        if attempts + 1 >= self.max_attempts:
+            self.logger.error(
+                f'give up sending submission [{submission_id}] '
+                f'after {attempts + 1} attempts [reason={reason}]', )
+            self.queue.fail(submission_id, reason)
+            return
+        self.queue.retry(
+            submission_id,
+            self.backoff_delay(attempts),
+            reason,
+        )
+
+    @identity_map()
+    def dispatch(self, submission_id: str) -> str:
+        '''
+        send one submission and update its dispatch state
+
+        Returns:
+            the new dispatch state
+        '''
+        from .submission import (
+            Submission,
+            JudgeQueueFullError,
+            TestCaseNotFound,
+        )
+        state = self.queue.state(submission_id) or {}
+        # a reset submission has lost its results, it's sent even if its
+        # job is cancelled after that
+        if 'reset' not in state and self.queue.is_cancelled(submission_id):
+            self.queue.cancel(submission_id)
+            return DispatchQueue.CANCELLED
+        submission = Submission(submission_id)
+        if not submission:
+            self.queue.fail(submission_id, 'submission not found')
+            return DispatchQueue.FAILED
+        try:
+            # submissions of a rejudge job are reset right before being
+            # sent, so those dropped by cancellation keep their results
+            if state.get('job') is not None and 'reset' not in state:
+                self.queue.mark_reset(submission_id)
+                submission.reset()
+            success = submission.send()
+        except JudgeQueueFullError:
+            self._retry(submission_id, 'judge queue is full')
+        except (ValueError, TestCaseNotFound) as e:
+            self.queue.fail(submission_id, str(e))
+        except Exception as e:
+            self.logger.warning(
+                f'error occurred when sending {submission} '
+                f'[err={type(e).__name__}: {e}]', )
+            self._retry(submission_id, f'{type(e).__name__}: {e}')
+        else:
+            if success:
+                self.queue.ack(submission_id)
+            else:
+                self._retry(submission_id, 'no available sandbox')
+        return self.queue.state(submission_id)['state']
+
+    def run_once(self) -> int:
+        '''
+        dispatch one batch of submissions
+
+        Returns:
+            how many submissions are taken from queue
+        '''
+        submission_ids = self.queue.pop(self.batch_size)
+        if self.pool is None:
+            for submission_id in submission_ids:
+                self.dispatch(submission_id)
+        else:
+            # wait for the whole batch
+            [*self.pool.map(self.dispatch, submission_ids)]
+        return len(submission_ids)
+
+    @staticmethod
+    def job_types() -> List[type]:
+        from .rejudge import RejudgeJob
+        from .regrade import RegradeJob
+        return [RejudgeJob, RegradeJob]
+
+    def run_jobs(self) -> int:
+        '''
+        run queued rejudge and regrade jobs
+
+        Returns:
+            how many jobs are run
+        '''
+        cnt = 0
+        for job_type in self.job_types():
+            while (job := job_type.take()) is not None:
+                try:
+                    job.run()
+                except Exception:
+                    # the job has marked itself and logged the error
+                    pass
+                finally:
+                    job.done()
+                cnt += 1
+        return cnt
+
+    def refresh_sandboxes(self):
+        '''
+        update the sandbox load table, so the request threads can
+        select sandbox without polling them
+        '''
+        try:
+            SandboxRegistry().refresh()
+        except Exception as e:
+            self.logger.error(f'fail to refresh sandbox loads [err={e}]')
+
+    def acquire_lock(self, token: str) -> bool:
+        return bool(
+            self.queue.client.set(
+                self.LOCK_KEY,
+                token,
+                nx=True,
+                px=int(self.LOCK_TTL * 1000),
+            ))
+
+    def _owned_lock(self, token: str, action) -> bool:
+        with self.queue.client.pipeline() as pipe:
+            try:
+                pipe.watch(self.LOCK_KEY)
+                if pipe.get(self.LOCK_KEY) != token.encode():
+                    return False
+                pipe.multi()
+                action(pipe)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    def refresh_lock(self, token: str) -> bool:
+        return self._owned_lock(
+            token,
+            lambda pipe: pipe.pexpire(
+                self.LOCK_KEY,
+                int(self.LOCK_TTL * 1000),
+            ),
+        )
+
+    def release_lock(self, token: str) -> bool:
+        return self._owned_lock(
+            token,
+            lambda pipe: pipe.delete(self.LOCK_KEY),
+        )
+
+    def _keep_lock(self, token: str, lost: threading.Event):
+        while not lost.wait(self.LOCK_TTL / 3):
+            if not self.refresh_lock(token):
+                self.logger.error('dispatcher lock is lost')
+                lost.set()
+
+    def run(self, interval: float = 0.5):
+        # `recover` takes back every submission being sent, so another
+        # running dispatcher would send them twice
+        token = secrets.token_hex(16)
+        while not self.acquire_lock(token):
+            self.logger.info('another dispatcher is running, waiting')
+            time.sleep(self.LOCK_TTL / 3)
+        # refreshed in background, jobs may run longer than the ttl
+        lost = threading.Event()
+        threading.Thread(
+            target=self._keep_lock,
+            args=(token, lost),
+            daemon=True,
+        ).start()
+        try:
+            self._run(interval, lost)
+        finally:
+            lost.set()
+            self.release_lock(token)
+        raise RuntimeError('dispatcher lock is lost')
+
+    def _run(self, interval: float, lost: threading.Event):
+        recovered = self.queue.recover()
+        if recovered:
+            self.logger.info(f'recover {recovered} submissions')
+        for job_type in self.job_types():
+            recovered = job_type.recover()
+            if recovered:
+                self.logger.info(f'recover {recovered} {job_type.__name__}')
+        last_refresh = 0
+        while not lost.is_set():
+            if time.time() - last_refresh >= self.refresh_interval:
+                self.refresh_sandboxes()
+                last_refresh = time.time()
+            self.run_jobs()
+            if self.run_once() == 0:
+                time.sleep(interval)
@@ -1,17 +1,39 @@
 from mongoengine import *
 from mongoengine import signals
+from pymongo import monitoring
 import mongoengine
 import os
 import html
 from enum import IntEnum
 from datetime import datetime
 from zipfile import ZipFile, BadZipFile
+from .profiler import CommandListener
 
 __all__ = [*mongoengine.__all__]
 
 MONGO_HOST = os.environ.get('MONGO_HOST', 'mongomock://localhost')
+# listeners must be registered before the client is created
+monitoring.register(CommandListener())
 connect('normal-oj', host=MONGO_HOST)
 
+# sent before a queryset updates documents, e.g. `Document.update`, since
+# mongoengine only has signals for saving and deleting
+pre_update = signals._signals.signal('pre_update')
+
+
+class SignalQuerySet(QuerySet):
+    '''
+    A queryset sends `pre_update` with itself before updating documents
+    '''
+
+    def update(self, *args, **ks):
+        pre_update.send(self._document, queryset=self)
+        return super().update(*args, **ks)
+
+    def modify(self, *args, **ks):
+        pre_update.send(self._document, queryset=self)
+        return super().modify(*args, **ks)
+
 
 def handler(event):
     '''
@@ -61,6 +83,13 @@ class ZipField(FileField):
                 f'{size} bytes exceed the max size limit ({self.max_size} bytes)'
             )
 
+    def prepare_query_value(self, op, value):
+        value = super().prepare_query_value(op, value)
+        # allow to update a document with a file which is already stored
+        if isinstance(value, GridFSProxy):
+            return value.grid_id
+        return value
+
 
 class IntEnumField(IntField):
 
@@ -164,7 +193,9 @@ class User(Document):
 
 @escape_markdown.apply
 class Homework(Document):
-
+    # student status used to be embedded in `studentStatus`, ignore it
+    # until it's migrated, see `migrate_homework_status.py`
+    meta = {'strict': False}
     homework_name = StringField(
         max_length=64,
         required=True,
@@ -180,10 +211,60 @@ class Homework(Document):
     course_id = StringField(required=True, db_field='courseId')
     duration = EmbeddedDocumentField(Duration, default=Duration)
     problem_ids = ListField(IntField(), db_field='problemIds')
-    student_status = DictField(db_field='studentStatus')
     ip_filters = ListField(StringField(max_length=64), default=list)
     penalty = StringField(max_length=10000, default='score = 0')
 
+    @property
+    def student_status(self):
+        '''
+        status of all students, {username: {problem id: status}}
+        '''
+        ret = {}
+        for status in HomeworkStatus.objects(homework=self.id):
+            ret.setdefault(status.user, {})[str(status.problem)] = status.info
+        return ret
+
+
+class HomeworkStatus(Document):
+    '''
+    a student's status of a problem in a homework
+    '''
+    meta = {
+        'indexes': [
+            {
+                'fields': ('homework', 'user', 'problem'),
+                'unique': True,
+            },
+            # statuses of a student in all homeworks of a course
+            ('user', 'homework'),
+        ],
+    }
+    homework = ReferenceField(Homework, required=True)
+    user = StringField(required=True)
+    problem = IntField(required=True)
+    score = IntField(default=0)
+    problem_status = IntField(default=None,
+                              null=True,
+                              db_field='problemStatus')
+    # highest score before penalty, set after first judgement
+    raw_score = IntField(db_field='rawScore')
+    submission_ids = ListField(
+        StringField(),
+        default=list,
+        db_field='submissionIds',
+    )
+
+    @property
+    def info(self):
+        ret = {
+            'score': self.score,
+            'problemStatus': self.problem_status,
+            'submissionIds': self.submission_ids,
+        }
+        if self.raw_score is not None:
+            ret['rawScore'] = self.raw_score
+        return ret
+
 
 class Contest(Document):
     name = StringField(max_length=64, required=True, db_field='contestName')
@@ -359,11 +440,18 @@ class CaseResult(EmbeddedDocument):
     status = IntField(required=True)
     exec_time = IntField(required=True, db_field='execTime')
     memory_usage = IntField(required=True, db_field='memoryUsage')
+    # None if the output is packed in submission or stored inline
     output = ZipField(
-        required=True,
+        default=None,
         null=True,
         max_size=11**9,
     )
+    # small output compressed by zlib
+    inline_output = BinaryField(
+        default=None,
+        null=True,
+        db_field='inlineOutput',
+    )
 
 
 class TaskResult(EmbeddedDocument):
@@ -376,17 +464,24 @@ class TaskResult(EmbeddedDocument):
 
 class Submission(Document):
     meta = {
+        # don't block the collection while building indexes,
+        # see `create_indexes.py`
+        'index_background':
+        True,
         'indexes': [
-            (
-                'id',
-                'user',
-                'score',
-                'status',
-                'problem',
-                'language',
-                'timestamp',
-            ),
-        ]
+            # submission list sorted by upload time, the id breaks ties
+            ('-timestamp', '-id'),
+            # submission list of problems or a course, rejudge
+            ('problem', '-timestamp', '-id'),
+            # submission list of a user
+            ('user', '-timestamp', '-id'),
+            # highest score of a user in a problem
+            ('user', 'problem', '-score'),
+            # course scoreboard, score is included to cover the grouping
+            ('user', 'problem', 'timestamp', 'score'),
+            # count of users who solved a problem
+            ('problem', 'status', 'user'),
+        ],
     }
     problem = ReferenceField(Problem, required=True)
     user = ReferenceField(User, required=True)
@@ -405,6 +500,53 @@ class Submission(Document):
     code = ZipField(required=True, null=True, max_size=10**7)
     last_send = DateTimeField(db_field='lastSend', default=datetime.now)
     comment = FileField(default=None, null=True)
+    # stdout/stderr of all cases packed in one zip, the output of
+    # task i case j is stored in directory '{i}/{j}/'
+    output = ZipField(default=None, null=True, max_size=11**9)
+
+
+class ProblemStats(Document):
+    '''
+    submission statistics of a problem, maintained incrementally
+    '''
+    problem_id = IntField(primary_key=True)
+    # number of submissions in each status, keyed by str(status)
+    status_count = MapField(IntField(), default=dict, db_field='statusCount')
+    # number of submissions / AC submissions of each user
+    tried_users = MapField(IntField(), default=dict, db_field='triedUsers')
+    ac_users = MapField(IntField(), default=dict, db_field='acUsers')
+    high_scores = MapField(IntField(), default=dict, db_field='highScores')
+    # AC submissions with least run time / memory usage, each item is
+    # {'submission': ObjectId, 'value': int}
+    top_run_time = ListField(DictField(), default=list, db_field='topRunTime')
+    top_memory_usage = ListField(
+        DictField(),
+        default=list,
+        db_field='topMemoryUsage',
+    )
+
+
+class ScoreboardBucket(Document):
+    '''
+    scores of submissions a user made to a problem in one day
+    '''
+    meta = {
+        'indexes': [
+            {
+                'fields': ('problem', 'user', 'day'),
+                'unique': True,
+            },
+        ],
+    }
+    problem = IntField(required=True)
+    user = StringField(required=True)
+    # local midnight of the day
+    day = DateTimeField(required=True)
+    count = IntField(default=0)
+    # sum of scores, used to compute average
+    total = IntField(default=0)
+    max = IntField()
+    min = IntField()
 
 
 @escape_markdown.apply
@@ -465,10 +607,17 @@ class Sandbox(EmbeddedDocument):
     name = StringField(required=True)
     url = StringField(required=True)
     token = StringField(required=True)
+    # used by weighted round-robin
+    weight = IntField(default=1, min_value=1)
 
 
 class SubmissionConfig(Config):
     rate_limit = IntField(default=0, db_field='rateLimit')
+    sandbox_strategy = StringField(
+        default='least-loaded',
+        choices=['least-loaded', 'round-robin', 'power-of-two'],
+        db_field='sandboxStrategy',
+    )
     sandbox_instances = EmbeddedDocumentListField(
         Sandbox,
         default=[
@@ -480,3 +629,14 @@ class SubmissionConfig(Config):
         ],
         db_field='sandboxInstances',
     )
+
+
+def _documents(cls=Document):
+    for document in cls.__subclasses__():
+        if document.__module__ == __name__:
+            yield document
+        yield from _documents(document)
+
+
+for document in _documents():
+    document._meta['queryset_class'] = SignalQuerySet
@@ -0,0 +1,119 @@
+import os
+import json
+import math
+import time
+import secrets
+import threading
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+)
+from .utils import RedisCache
+
+__all__ = ('EventChannel', )
+
+
+class EventChannel:
+    '''
+    Notify clients through redis pub/sub. Only subscribers listening at
+    that time receive an event, nothing is stored.
+    '''
+    # all submissions
+    SUBMISSION = 'EVENT_SUBMISSION'
+    # send a comment line if there is no event for a while, so proxies
+    # won't close the connection
+    HEARTBEAT = int(os.getenv('EVENT_HEARTBEAT', '15'))
+    # close the stream after this, clients reconnect automatically
+    STREAM_TIMEOUT = int(os.getenv('EVENT_STREAM_TIMEOUT', '300'))
+    # a stream holds a worker thread until it's closed, so open streams of
+    # a process are limited to keep threads for other requests, see
+    # `gunicorn.conf.py`
+    MAX_STREAMS = int(os.getenv('EVENT_MAX_STREAMS', '16'))
+    # open streams of a user in all processes
+    MAX_USER_STREAMS = int(os.getenv('EVENT_MAX_USER_STREAMS', '3'))
+    _open_streams = 0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def problem(problem_id: int) -> str:
+        return f'EVENT_PROBLEM_{problem_id}'
+
+    @staticmethod
+    def user(username: str) -> str:
+        return f'EVENT_USER_{username}'
+
+    @staticmethod
+    def user_streams_key(username: str) -> str:
+        return f'EVENT_STREAMS_{username}'
+
+    @classmethod
+    def open_stream(cls, username: str) -> Optional[str]:
+        '''
+        reserve a stream for the user, return its id, or None if the user
+        or this process has too many open streams. the stream must be
+        released by `close_stream`.
+        '''
+        with cls._lock:
+            if cls._open_streams >= cls.MAX_STREAMS:
+                return None
+            cls._open_streams += 1
+        stream_id = secrets.token_hex(8)
+        key = cls.user_streams_key(username)
+        now = time.time()
+        ttl = cls.STREAM_TIMEOUT + cls.HEARTBEAT
+        pipe = RedisCache().client.pipeline()
+        # streams of crashed processes are dropped after they time out
+        pipe.zremrangebyscore(key, '-inf', now)
+        pipe.zadd(key, {stream_id: now + ttl})
+        pipe.zcard(key)
+        pipe.expire(key, math.ceil(ttl))
+        if pipe.execute()[2] > cls.MAX_USER_STREAMS:
+            cls.close_stream(username, stream_id)
+            return None
+        return stream_id
+
+    @classmethod
+    def close_stream(cls, username: str, stream_id: str):
+        RedisCache().client.zrem(cls.user_streams_key(username), stream_id)
+        with cls._lock:
+            cls._open_streams -= 1
+
+    @staticmethod
+    def publish(channels: Iterable[str], event: str, data: Dict[str, Any]):
+        message = json.dumps({'event': event, 'data': data})
+        pipe = RedisCache().client.pipeline(transaction=False)
+        for channel in channels:
+            pipe.publish(channel, message)
+        pipe.execute()
+
+    @classmethod
+    def listen(
+        cls,
+        channels: Iterable[str],
+        timeout: Optional[float] = None,
+    ) -> Iterator[Optional[Tuple[str, Dict[str, Any]]]]:
+        '''
+        yield (event, data) published to channels, None is yielded when
+        nothing is received in `HEARTBEAT` seconds. the channels are
+        subscribed before the first value is yielded.
+        '''
+        if timeout is None:
+            timeout = cls.STREAM_TIMEOUT
+        pubsub = RedisCache().client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(*channels)
+        try:
+            yield None
+            deadline = time.monotonic() + timeout
+            while (rest := deadline - time.monotonic()) > 0:
+                message = pubsub.get_message(timeout=min(cls.HEARTBEAT, rest))
+                if message is None:
+                    yield None
+                    continue
+                message = json.loads(message['data'])
+                yield message['event'], message['data']
+        finally:
+            pubsub.close()
@@ -1,4 +1,5 @@
-from typing import List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from pymongo import ReplaceOne, UpdateOne
 from . import engine
 from .user import User
 from .base import MongoBase
@@ -6,6 +7,7 @@ from .course import Course
 from .utils import perm, doc_required
 from .problem.problem import Problem
 from .ip_filter import IPFilter
+from .penalty import Penalty, PenaltyError
 from datetime import datetime
 
 __all__ = ['Homework']
@@ -19,23 +21,14 @@ class Error():
 def check_penalty(penalty: Optional[str]) -> int:
     if penalty is None:
         return 0
-    allowed_chars = ["+", "-", "*", "/", "=", ".", "(", ")", ":", ">", "<"]
-    allowed_words = ["score", "overtime", "if", "else"]
-    checkstring = ""
-    for i in penalty:
-        checkstring += (" " if i in allowed_chars else i)
-    for i in checkstring.split():
-        if i not in allowed_words:
-            try:
-                int(i)
-            except:
-                return 1
     try:
-        score = 0
-        overtime = 0
-        exec(penalty)
-    except:
-        return 2
+        penalty = Penalty.compile(penalty)
+    except PenaltyError:
+        return Error.Illegal_penalty
+    try:
+        penalty(score=0, overtime=0)
+    except PenaltyError:
+        return Error.Invalid_penalty
     return 0
 
 
@@ -77,7 +70,7 @@ class Homework(MongoBase, engine=engine.Homework):
         penalty_stat = check_penalty(penalty)
         if penalty_stat == Error.Illegal_penalty:
             raise ValueError("Illegal penalty")
-        elif penalty_stat == Error.Illegal_penalty:
+        elif penalty_stat == Error.Invalid_penalty:
             raise ValueError("Invalid penalty")
 
         problems = [*map(Problem, problem_ids)]
@@ -97,16 +90,13 @@ class Homework(MongoBase, engine=engine.Homework):
         if end:
             homework.duration.end = datetime.fromtimestamp(end)
         homework.save()
-        # init student status
-        user_problems = {}
         for problem in problems:
-            problem_id = str(problem.problem_id)
-            user_problems[problem_id] = cls.default_problem_status()
             problem.update(push__homeworks=homework)
-        homework.update(student_status={
-            s: user_problems
-            for s in course.student_nicknames
-        })
+        # init student status
+        cls(homework).init_student_status(
+            course.student_nicknames.keys(),
+            problem_ids,
+        )
         # add homework to course
         course.update(push__homeworks=homework.id)
         return homework
@@ -135,7 +125,7 @@ class Homework(MongoBase, engine=engine.Homework):
             penalty_stat = check_penalty(penalty)
             if penalty_stat == Error.Illegal_penalty:
                 raise ValueError("Illegal penalty")
-            elif penalty_stat == Error.Illegal_penalty:
+            elif penalty_stat == Error.Invalid_penalty:
                 raise ValueError("Invalid penalty")
             else:
                 homework.penalty = penalty
@@ -160,26 +150,32 @@ class Homework(MongoBase, engine=engine.Homework):
         homework.save()
         drop_ids = set(homework.problem_ids) - set(problem_ids)
         new_ids = set(problem_ids) - set(homework.problem_ids)
-        student_status = homework.student_status
         # add
+        added = []
         for pid in new_ids:
             problem = Problem(pid).obj
             if problem is None:
                 continue
             homework.update(push__problem_ids=pid)
             problem.update(push__homeworks=homework)
-            for key in course.student_nicknames:
-                student_status[key][str(pid)] = cls.default_problem_status()
+            added.append(pid)
+        cls(homework).init_student_status(
+            course.student_nicknames.keys(),
+            added,
+        )
         # delete
+        dropped = []
         for pid in drop_ids:
             problem = Problem(pid).obj
             if problem is None:
                 continue
             homework.update(pull__problem_ids=pid)
             problem.update(pull__homeworks=homework)
-            for status in student_status.values():
-                del status[str(pid)]
-        homework.update(student_status=student_status)
+            dropped.append(pid)
+        engine.HomeworkStatus.objects(
+            homework=homework,
+            problem__in=dropped,
+        ).delete()
         return homework
 
     # delete problems/paticipants in hw
@@ -197,6 +193,7 @@ class Homework(MongoBase, engine=engine.Homework):
             if problem is None:
                 continue
             problem.update(pull__homeworks=self.obj)
+        engine.HomeworkStatus.objects(homework=self.obj).delete()
         self.delete()
         return self
 
@@ -234,34 +231,355 @@ class Homework(MongoBase, engine=engine.Homework):
             'submissionIds': [],
         }
 
+    def init_student_status(
+        self,
+        usernames: Iterable[str],
+        problem_ids: Iterable[int],
+    ):
+        '''
+        create default status of problems for students
+        '''
+        statuses = [
+            engine.HomeworkStatus(
+                homework=self.obj,
+                user=username,
+                problem=pid,
+            ).to_mongo() for username in usernames for pid in problem_ids
+        ]
+        if statuses:
+            engine.HomeworkStatus._get_collection().insert_many(statuses)
+
+    def get_student_status(self, username: str) -> Optional[Dict[str, Any]]:
+        '''
+        status of a student, {problem id: status}, None if the user is not
+        a student of this homework
+        '''
+        return self.get_student_statuses([self.obj], username)[str(self.id)]
+
+    @classmethod
+    def get_student_statuses(
+        cls,
+        homeworks: List[engine.Homework],
+        username: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        '''
+        load status of multiple homeworks in one query, only the status of
+        `username` is loaded if it's given
+
+        Returns:
+            a dict maps homework id to {username: {problem id: status}},
+            or to {problem id: status} if `username` is given
+        '''
+        statuses = engine.HomeworkStatus.objects(
+            homework__in=[hw.id for hw in homeworks])
+        if username is not None:
+            statuses = statuses.filter(user=username)
+        ret = {str(hw.id): {} for hw in homeworks}
+        for status in statuses.no_dereference():
+            user_status = ret[str(status.homework.id)]
+            if username is None:
+                user_status = user_status.setdefault(status.user, {})
+            user_status[str(status.problem)] = status.info
+        if username is not None:
+            ret = {k: v or None for k, v in ret.items()}
+        return ret
+
     def add_student(self, students: List[User]):
-        if any(u.username in self.student_status for u in students):
+        usernames = [u.username for u in students]
+        if engine.HomeworkStatus.objects(
+                homework=self.obj,
+                user__in=usernames,
+        ).count():
             raise ValueError('Student already in homework')
-        user_status = {
-            str(pid): self.default_problem_status()
-            for pid in self.problem_ids
-        }
-        for student in students:
-            self.student_status[student.username] = user_status
-        self.save()
+        self.init_student_status(usernames, self.problem_ids)
 
     def remove_student(self, students: List[User]):
-        if any(u.username not in self.student_status for u in students):
+        usernames = {u.username for u in students}
+        found = engine.HomeworkStatus.objects(
+            homework=self.obj,
+            user__in=[*usernames],
+        ).distinct('user')
+        if len(found) != len(usernames):
             raise ValueError('Student not in homework')
-        for student in students:
-            del self.student_status[student.username]
-        self.save()
+        engine.HomeworkStatus.objects(
+            homework=self.obj,
+            user__in=[*usernames],
+        ).delete()
+
+    def migrate_student_status(self) -> bool:
+        '''
+        move student status embedded in homework document into its own
+        collection
+
+        Returns:
+            whether there is embedded status
+        '''
+        collection = self.engine._get_collection()
+        doc = collection.find_one(
+            {
+                '_id': self.id,
+                'studentStatus': {
+                    '$exists': True
+                },
+            },
+            {'studentStatus': 1},
+        )
+        if doc is None:
+            return False
+        requests = []
+        for username, problems in doc['studentStatus'].items():
+            for pid, status in problems.items():
+                status = engine.HomeworkStatus(
+                    homework=self.obj,
+                    user=username,
+                    problem=int(pid),
+                    score=status.get('score', 0),
+                    problem_status=status.get('problemStatus'),
+                    raw_score=status.get('rawScore'),
+                    submission_ids=[
+                        *map(str, status.get('submissionIds', []))
+                    ],
+                ).to_mongo()
+                key = {k: status[k] for k in ('homework', 'user', 'problem')}
+                requests.append(ReplaceOne(key, status, upsert=True))
+        if requests:
+            engine.HomeworkStatus._get_collection().bulk_write(
+                requests,
+                ordered=False,
+            )
+        collection.update_one(
+            {'_id': self.id},
+            {'$unset': {
+                'studentStatus': ''
+            }},
+        )
+        return True
+
+    def add_submission(self, submission):
+        '''
+        update a student's status of a problem with a judged submission.
+        only fields of that status are updated in place, so concurrent
+        judgements won't overwrite each other
+        '''
+        collection = engine.HomeworkStatus._get_collection()
+        query = {
+            'homework': self.id,
+            'user': submission.username,
+            'problem': submission.problem_id,
+        }
+        # the penalty depends on current status, retry if it has been
+        # changed by others
+        if submission.timestamp > self.duration.end and \
+                self.penalty is not None:
+            while True:
+                stat = collection.find_one(query)
+                if stat is None:
+                    return
+                expected = {
+                    'score': stat['score'],
+                    'rawScore': stat.get('rawScore'),
+                }
+                if stat.get('rawScore') is None:
+                    stat['rawScore'] = 0
+                # the submission may be shared by other wrappers, don't
+                # overwrite its score
+                score, stat['rawScore'] = self.do_penalty(submission, stat)
+                result = collection.update_one(
+                    {
+                        **query,
+                        **expected
+                    },
+                    {
+                        '$set': {
+                            'score': score,
+                            'rawScore': stat['rawScore'],
+                            'problemStatus': submission.status,
+                        },
+                        '$push': {
+                            'submissionIds': submission.id,
+                        },
+                    },
+                )
+                if result.matched_count:
+                    return
+        collection.update_one(
+            query,
+            {
+                '$max': {
+                    'rawScore': submission.score
+                },
+                '$push': {
+                    'submissionIds': submission.id
+                },
+            },
+        )
+        # update high score
+        collection.update_one(
+            {
+                **query,
+                'score': {
+                    '$lte': submission.score
+                },
+            },
+            {
+                '$set': {
+                    'score': submission.score,
+                    'problemStatus': submission.status,
+                }
+            },
+        )
+
+    def regrade_status(
+        self,
+        submissions: Iterable[Dict[str, Any]],
+        penalty: Optional[Penalty],
+    ) -> Dict[str, Any]:
+        '''
+        compute a status from judged submissions sorted by timestamp, the
+        same way `add_submission` updates it one by one. late submissions
+        are graded as in-time ones if there is no `penalty`
+        '''
+        stat = {
+            **self.default_problem_status(),
+            'rawScore': None,
+        }
+        for submission in submissions:
+            stat['submissionIds'].append(str(submission['_id']))
+            score = submission.get('score', 0)
+            if penalty is not None and \
+                    submission['timestamp'] > self.duration.end:
+                raw_score = stat['rawScore'] or 0
+                if score > raw_score:
+                    stat['score'] += int(
+                        penalty(
+                            score=score - raw_score,
+                            overtime=self.overtime(submission['timestamp']),
+                        ))
+                    raw_score = score
+                stat['rawScore'] = raw_score
+                stat['problemStatus'] = submission['status']
+                continue
+            stat['rawScore'] = max(stat['rawScore'] or score, score)
+            if stat['score'] <= score:
+                stat['score'] = score
+                stat['problemStatus'] = submission['status']
+        return stat
+
+    def regrade(
+        self,
+        dry_run: bool = False,
+        on_progress: Optional[Callable[[int, int], Any]] = None,
+        batch_size: int = 1000,
+    ) -> List[Dict[str, Any]]:
+        '''
+        recompute the status of all students with current penalty and
+        deadline. submissions are streamed in timestamp order and statuses
+        are computed in memory, then changed ones are written back in one
+        bulk write. handwritten problems are graded by teacher and skipped.
+
+        Args:
+            dry_run: only compute the changes
+            on_progress: called with the number of processed and total
+                submissions every `batch_size` submissions
+
+        Returns:
+            changed statuses, each has the `user`, `problem` and its `old`
+            and `new` status
+        '''
+        problem_ids = [
+            *engine.Problem.objects(
+                problem_id__in=self.problem_ids,
+                problem_type__ne=2,
+            ).scalar('problem_id')
+        ]
+        collection = engine.HomeworkStatus._get_collection()
+        rows = {(row['user'], row['problem']): row
+                for row in collection.find({
+                    'homework': self.id,
+                    'problem': {
+                        '$in': problem_ids
+                    },
+                })}
+        submissions = engine.Submission.objects(
+            problem__in=problem_ids,
+            user__in=list({user
+                           for user, _ in rows}),
+            status__gte=0,
+            language__ne=3,
+        ).only('id', 'problem', 'user', 'timestamp', 'status', 'score')
+        submissions = submissions.order_by('timestamp').no_cache().batch_size(
+            batch_size).as_pymongo()
+        total = submissions.count()
+        grouped = {key: [] for key in rows}
+        for i, submission in enumerate(submissions, 1):
+            key = (submission['user'], submission['problem'])
+            if key in grouped:
+                grouped[key].append(submission)
+            if on_progress is not None and i % batch_size == 0:
+                on_progress(i, total)
+        if on_progress is not None:
+            on_progress(total, total)
+        penalty = None if self.penalty is None else self.compiled_penalty
+        changes, requests = [], []
+        for key, row in rows.items():
+            old = {
+                'score': row.get('score', 0),
+                'problemStatus': row.get('problemStatus'),
+                'submissionIds': row.get('submissionIds', []),
+                'rawScore': row.get('rawScore'),
+            }
+            new = self.regrade_status(grouped[key], penalty)
+            # ids are pushed in judging order, which may differ
+            if {**old, 'submissionIds': sorted(old['submissionIds'])} == \
+                    {**new, 'submissionIds': sorted(new['submissionIds'])}:
+                continue
+            changes.append({
+                'user': key[0],
+                'problem': key[1],
+                'old': old,
+                'new': new,
+            })
+            update = {
+                '$set': {k: v
+                         for k, v in new.items() if k != 'rawScore'}
+            }
+            if new['rawScore'] is None:
+                update['$unset'] = {'rawScore': ''}
+            else:
+                update['$set']['rawScore'] = new['rawScore']
+            # skip it if a submission is judged during regrading, the
+            # new judgement has been applied on it
+            requests.append(
+                UpdateOne(
+                    {
+                        '_id': row['_id'],
+                        'submissionIds': old['submissionIds'],
+                    },
+                    update,
+                ))
+        if requests and not dry_run:
+            collection.bulk_write(requests, ordered=False)
+        return changes
+
+    @property
+    def compiled_penalty(self) -> Penalty:
+        return Penalty.compile(self.penalty)
+
+    def overtime(self, timestamp: datetime) -> int:
+        '''
+        days passed since the end of homework
+        '''
+        return int(
+            (timestamp.timestamp() - self.duration.end.timestamp()) / 86400)
 
     def do_penalty(self, submission, stat):
-        d = {}
-
-        d['score'] = submission.score - stat['rawScore']
-        if d['score'] > 0:
-            d['overtime'] = int((submission.timestamp.timestamp() -
-                                 self.duration.end.timestamp()) / 86400)
-            exec(self.penalty, d)
-            d['score'] = int(d['score'])
-            stat['score'] += d['score']
+        score = submission.score - stat['rawScore']
+        if score > 0:
+            score = self.compiled_penalty(
+                score=score,
+                overtime=self.overtime(submission.timestamp),
+            )
+            stat['score'] += int(score)
             stat['rawScore'] = submission.score
 
         return [stat['score'], stat['rawScore']]
@@ -0,0 +1,249 @@
+import os
+import time
+import atexit
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+__all__ = (
+    'Registry',
+    'Counter',
+    'Histogram',
+    'Gauge',
+    'REGISTRY',
+)
+
+# seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# label values escaped as prometheus text format requires
+LABEL_ESCAPES = str.maketrans({'\\': r'\\', '"': r'\"', '\n': r'\n'})
+
+Samples = Iterable[Tuple[Dict[str, str], float]]
+
+
+def _format(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).translate(LABEL_ESCAPES)
+
+
+class Registry:
+    '''
+    Metrics of all processes (e.g. gunicorn workers) are summed in redis,
+    one hash per metric. Each process buffers its own observations and
+    adds them periodically, so recording never waits for redis.
+    '''
+
+    def __init__(
+        self,
+        prefix: str = 'METRICS_',
+        flush_interval: Optional[float] = None,
+    ):
+        self.prefix = prefix
+        self.flush_interval = float(
+            os.getenv('METRICS_FLUSH_INTERVAL',
+                      '1')) if flush_interval is None else flush_interval
+        self.metrics: Dict[str, 'Metric'] = {}
+        self._pending: Dict[Tuple[str, str], float] = defaultdict(float)
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        from .utils import RedisCache
+        return RedisCache().client
+
+    def register(self, metric: 'Metric'):
+        if metric.name in self.metrics:
+            raise ValueError(f'duplicated metric {metric.name}')
+        self.metrics[metric.name] = metric
+
+    def add(self, key: str, fields: Dict[str, float]):
+        with self._lock:
+            for field, value in fields.items():
+                self._pending[key, field] += value
+
+    def maybe_flush(self):
+        '''
+        flush if the last one is older than `flush_interval`
+        '''
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        '''
+        add observations of this process to redis
+        '''
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for (key, field), value in pending.items():
+            pipe.hincrbyfloat(key, field, value)
+        pipe.execute()
+
+    def clear(self):
+        '''
+        drop observations not flushed yet
+        '''
+        with self._lock:
+            self._pending.clear()
+
+    def render(self) -> str:
+        '''
+        all metrics in prometheus text format
+        '''
+        self.flush()
+        pipe = self.client.pipeline(transaction=False)
+        for metric in self.metrics.values():
+            pipe.hgetall(metric.key)
+        lines = []
+        for metric, raw in zip(self.metrics.values(), pipe.execute()):
+            raw = {k.decode(): float(v) for k, v in raw.items()}
+            lines += [
+                f'# HELP {metric.name} {metric.help}',
+                f'# TYPE {metric.name} {metric.TYPE}',
+                *metric.expose(raw),
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+# observations not flushed yet would be lost with the process, gunicorn
+# workers also flush in `worker_exit`, see `gunicorn.conf.py`
+atexit.register(REGISTRY.flush)
+
+
+class Metric(ABC):
+    TYPE = 'untyped'
+
+    def __init__(
+            self,
+            name: str,
+            help: str,
+            labels: Sequence[str] = (),
+            registry: Optional[Registry] = None,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    @property
+    def key(self) -> str:
+        return f'{self.registry.prefix}{self.name}'
+
+    def _series(self, labels: Dict[str, str]) -> str:
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name} expects labels {self.labels}, '
+                             f'got {tuple(labels)}')
+        return ','.join(f'{k}="{_escape(labels[k])}"' for k in self.labels)
+
+    def _line(self, name: str, series: str, value: float) -> str:
+        if series:
+            name = f'{name}{{{series}}}'
+        return f'{name} {_format(value)}'
+
+    @abstractmethod
+    def expose(self, raw: Dict[str, float]) -> List[str]:
+        '''
+        render values read from redis as lines of the text format
+        '''
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        self.registry.add(self.key, {self._series(labels): amount})
+
+    def expose(self, raw: Dict[str, float]) -> List[str]:
+        return [
+            self._line(self.name, series, value)
+            for series, value in sorted(raw.items())
+        ]
+
+
+class Histogram(Metric):
+    '''
+    Bucket counts are stored cumulatively, as prometheus exposes them.
+    '''
+    TYPE = 'histogram'
+
+    def __init__(self,
+                 *args,
+                 buckets: Sequence[float] = LATENCY_BUCKETS,
+                 **ks):
+        super().__init__(*args, **ks)
+        self.buckets = (*sorted(buckets), float('inf'))
+
+    def observe(self, value: float, **labels):
+        series = self._series(labels)
+        fields = {
+            f'{series}|{_format(le)}': 1
+            for le in self.buckets if value <= le
+        }
+        fields[f'{series}|sum'] = value
+        fields[f'{series}|count'] = 1
+        self.registry.add(self.key, fields)
+
+    def expose(self, raw: Dict[str, float]) -> List[str]:
+        ret = []
+        for series in sorted({k.rsplit('|', 1)[0] for k in raw}):
+            for le in self.buckets:
+                le = _format(le)
+                bucket = f'{series},le="{le}"' if series else f'le="{le}"'
+                ret.append(
+                    self._line(
+                        f'{self.name}_bucket',
+                        bucket,
+                        raw.get(f'{series}|{le}', 0),
+                    ))
+            ret += [
+                self._line(f'{self.name}_sum', series, raw[f'{series}|sum']),
+                self._line(
+                    f'{self.name}_count',
+                    series,
+                    raw[f'{series}|count'],
+                ),
+            ]
+        return ret
+
+
+class Gauge(Metric):
+    '''
+    A value read when scraped, e.g. the length of a queue. `collect`
+    returns (labels, value) pairs.
+    '''
+    TYPE = 'gauge'
+
+    def __init__(self, *args, collect: Callable[[], Samples], **ks):
+        super().__init__(*args, **ks)
+        self.collect = collect
+
+    def expose(self, raw: Dict[str, float]) -> List[str]:
+        return [
+            self._line(self.name, self._series(labels), value)
+            for labels, value in self.collect()
+        ]
@@ -0,0 +1,170 @@
+import ast
+import hashlib
+import operator
+from typing import (
+    Callable,
+    Dict,
+    List,
+)
+
+__all__ = ('Penalty', 'PenaltyError')
+
+# variables a penalty can read and assign
+VARIABLES = ('score', 'overtime')
+BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Pow: operator.pow,
+}
+UNARY_OPS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+COMPARE_OPS = {
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Eq: operator.eq,
+}
+# integer powers above this are computed in float, so formulas like
+# `score ** 99999999` overflow instead of blocking the judgement
+MAX_EXPONENT = 100
+
+Env = Dict[str, float]
+
+
+class PenaltyError(ValueError):
+    pass
+
+
+def _pow(base, exponent):
+    if abs(exponent) > MAX_EXPONENT:
+        base = float(base)
+    return operator.pow(base, exponent)
+
+
+class Penalty:
+    '''
+    A penalty formula, e.g. `score = score * (0.8 ** overtime)`, parsed
+    once into python closures. Only assignments and `if` statements over
+    `score` and `overtime`, with arithmetic, comparisons and conditional
+    expressions, are allowed.
+    '''
+    # compiled formulas keyed by content hash
+    _cache: Dict[str, 'Penalty'] = {}
+    CACHE_SIZE = 256
+
+    def __init__(self, source: str):
+        self.source = source
+        try:
+            tree = ast.parse(source, mode='exec')
+        except SyntaxError as e:
+            raise PenaltyError(f'invalid syntax: {e.msg}') from e
+        self._run = self._block(tree.body)
+
+    @classmethod
+    def digest(cls, source: str) -> str:
+        return hashlib.sha256(source.encode()).hexdigest()
+
+    @classmethod
+    def compile(cls, source: str) -> 'Penalty':
+        '''
+        get the compiled penalty, formulas are cached by content hash
+        '''
+        key = cls.digest(source)
+        penalty = cls._cache.get(key)
+        if penalty is None:
+            penalty = cls(source)
+            # drop the oldest one
+            if len(cls._cache) >= cls.CACHE_SIZE:
+                cls._cache.pop(next(iter(cls._cache)), None)
+            cls._cache[key] = penalty
+        return penalty
+
+    def __call__(self, score: float, overtime: int) -> float:
+        '''
+        evaluate the penalized score
+        '''
+        env = {'score': score, 'overtime': overtime}
+        try:
+            self._run(env)
+        except PenaltyError:
+            raise
+        except (ArithmeticError, TypeError) as e:
+            raise PenaltyError(str(e)) from e
+        return env['score']
+
+    def _block(self, body: List[ast.stmt]) -> Callable[[Env], None]:
+        stmts = [*map(self._stmt, body)]
+
+        def run(env: Env):
+            for stmt in stmts:
+                stmt(env)
+
+        return run
+
+    def _stmt(self, node: ast.stmt) -> Callable[[Env], None]:
+        if isinstance(node, ast.Assign):
+            if len(node.targets) != 1 or \
+                    not isinstance(node.targets[0], ast.Name) or \
+                    node.targets[0].id not in VARIABLES:
+                raise PenaltyError('only score and overtime can be assigned')
+            name, value = node.targets[0].id, self._expr(node.value)
+
+            def assign(env: Env):
+                env[name] = value(env)
+
+            return assign
+        if isinstance(node, ast.If):
+            test = self._expr(node.test)
+            body = self._block(node.body)
+            orelse = self._block(node.orelse)
+
+            def branch(env: Env):
+                if test(env):
+                    body(env)
+                else:
+                    orelse(env)
+
+            return branch
+        raise PenaltyError(f'{type(node).__name__} is not allowed')
+
+    def _expr(self, node: ast.expr) -> Callable[[Env], float]:
+        if isinstance(node, ast.Constant):
+            value = node.value
+            if type(value) not in (int, float):
+                raise PenaltyError('only numbers are allowed')
+            return lambda _: value
+        if isinstance(node, ast.Name):
+            name = node.id
+            if name not in VARIABLES:
+                raise PenaltyError(f'unknown variable {name}')
+            return lambda env: env[name]
+        if isinstance(node, ast.BinOp) and type(node.op) in BIN_OPS:
+            op = _pow if isinstance(node.op, ast.Pow) else \
+                BIN_OPS[type(node.op)]
+            left, right = self._expr(node.left), self._expr(node.right)
+            return lambda env: op(left(env), right(env))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPS:
+            op, operand = UNARY_OPS[type(node.op)], self._expr(node.operand)
+            return lambda env: op(operand(env))
+        if isinstance(node, ast.Compare) and all(
+                type(op) in COMPARE_OPS for op in node.ops):
+            ops = [COMPARE_OPS[type(op)] for op in node.ops]
+            operands = [*map(self._expr, [node.left, *node.comparators])]
+
+            def compare(env: Env):
+                values = [operand(env) for operand in operands]
+                return all(
+                    op(a, b) for op, a, b in zip(ops, values, values[1:]))
+
+            return compare
+        if isinstance(node, ast.IfExp):
+            test = self._expr(node.test)
+            body, orelse = self._expr(node.body), self._expr(node.orelse)
+            return lambda env: body(env) if test(env) else orelse(env)
+        raise PenaltyError(f'{type(node).__name__} is not allowed')
@@ -1,7 +1,9 @@
 from .problem import Problem
+from .stats import ProblemStats
 from .exception import BadTestCase
 
 __all__ = (
     'Problem',
+    'ProblemStats',
     'BadTestCase',
 )
@@ -0,0 +1,291 @@
+import math
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+)
+from .. import engine
+from ..base import MongoBase
+
+__all__ = ('ProblemStats', )
+
+
+class ProblemStats(MongoBase, engine=engine.ProblemStats):
+    '''
+    Submission statistics of a problem. The document is built from
+    submissions at the first read, after that it's updated by every
+    status change of submissions instead of scanning them again.
+    '''
+    # length of the least run time / memory usage lists
+    TOP_K = 10
+    # top list -> submission field
+    TOP_FIELDS = {
+        'top_run_time': 'exec_time',
+        'top_memory_usage': 'memory_usage',
+    }
+    # percentiles and width of histogram bins of score distribution
+    PERCENTILES = (25, 50, 75, 90)
+    HISTOGRAM_BIN = 10
+    # usernames are keys of maps, which are paths in updates
+    KEY_ESCAPES = str.maketrans({'%': '%25', '.': '%2E', '$': '%24'})
+
+    @classmethod
+    def get(cls, problem_id: int) -> 'ProblemStats':
+        '''
+        get statistics of a problem, build it if it doesn't exist
+        '''
+        stats = engine.ProblemStats.objects(pk=problem_id).first()
+        if stats is None:
+            return cls.build(problem_id)
+        stats = cls(stats)
+        # some submissions in top lists have been removed
+        ac_count = stats.status_count.get('0', 0)
+        if any(
+                len(stats.obj[field]) < min(cls.TOP_K, ac_count)
+                for field in cls.TOP_FIELDS):
+            stats.obj.update(**cls._top_lists(problem_id))
+            stats.reload()
+        return stats
+
+    @classmethod
+    def build(cls, problem_id: int) -> 'ProblemStats':
+        '''
+        compute statistics from all submissions of a problem
+        '''
+        submissions = engine.Submission.objects(problem=problem_id)
+        status_count = {
+            str(item['_id']): item['count']
+            for item in submissions.aggregate([{
+                '$group': {
+                    '_id': '$status',
+                    'count': {
+                        '$sum': 1
+                    },
+                }
+            }])
+        }
+        users = list(
+            submissions.aggregate([{
+                '$group': {
+                    '_id': '$user',
+                    'count': {
+                        '$sum': 1
+                    },
+                    'ac': {
+                        '$sum': {
+                            '$cond': [{
+                                '$eq': ['$status', 0]
+                            }, 1, 0]
+                        },
+                    },
+                    'high': {
+                        '$max': '$score'
+                    },
+                }
+            }]))
+        stats = engine.ProblemStats(
+            problem_id=problem_id,
+            status_count=status_count,
+            tried_users={cls._key(u['_id']): u['count']
+                         for u in users},
+            ac_users={cls._key(u['_id']): u['ac']
+                      for u in users if u['ac']},
+            high_scores={cls._key(u['_id']): max(u['high'], 0)
+                         for u in users},
+        )
+        for field, value in cls._top_lists(problem_id).items():
+            setattr(stats, field, value)
+        stats.save()
+        return cls(stats)
+
+    @classmethod
+    def _top_lists(cls, problem_id: int) -> Dict[str, List[Dict[str, Any]]]:
+        ret = {}
+        for top_field, field in cls.TOP_FIELDS.items():
+            submissions = engine.Submission.objects(
+                problem=problem_id,
+                status=0,
+            ).only(field).order_by(field, 'id').limit(cls.TOP_K)
+            ret[top_field] = [{
+                'submission': s.id,
+                'value': s[field],
+            } for s in submissions]
+        return ret
+
+    @classmethod
+    def _key(cls, username: str) -> str:
+        '''
+        escape a username to be a key of the maps, '.' and '$' in it would
+        be parsed as a path or an operator
+        '''
+        return username.translate(cls.KEY_ESCAPES)
+
+    @classmethod
+    def _db_field(cls, field: str) -> str:
+        return cls.engine._fields[field].db_field
+
+    @classmethod
+    def apply(
+        cls,
+        old: Optional[Dict[str, Any]],
+        new: Optional[Dict[str, Any]],
+    ):
+        '''
+        apply the change of a submission to its problem's statistics
+
+        Args:
+            old: snapshot before change, None if it's a new submission
+            new: snapshot after change, None if it's deleted
+
+            see `Submission.snapshot`
+        '''
+        if old == new:
+            return
+        base = old or new
+        problem_id, username = base['problem'], cls._key(base['user'])
+        inc = {}
+        pull = {}
+        push = {}
+
+        def add(key, value):
+            inc[key] = inc.get(key, 0) + value
+
+        if old is not None:
+            add(f'statusCount.{old["status"]}', -1)
+            add(f'triedUsers.{username}', -1)
+            if old['status'] == 0:
+                add(f'acUsers.{username}', -1)
+                for top_field in cls.TOP_FIELDS:
+                    pull[cls._db_field(top_field)] = {
+                        'submission': old['id'],
+                    }
+        if new is not None:
+            add(f'statusCount.{new["status"]}', 1)
+            add(f'triedUsers.{username}', 1)
+            if new['status'] == 0:
+                add(f'acUsers.{username}', 1)
+                for top_field, field in cls.TOP_FIELDS.items():
+                    push[cls._db_field(top_field)] = {
+                        '$each': [{
+                            'submission': new['id'],
+                            'value': new[field],
+                        }],
+                        '$sort': {
+                            'value': 1,
+                            'submission': 1,
+                        },
+                        '$slice': cls.TOP_K,
+                    }
+        collection = engine.ProblemStats._get_collection()
+        # only update existing statistics, missing ones are built from
+        # submissions on read
+        if pull:
+            # an array can't be pulled and pushed in one update
+            collection.update_one({'_id': problem_id}, {'$pull': pull})
+        update = {'$inc': {k: v for k, v in inc.items() if v != 0}}
+        if push:
+            update['$push'] = push
+        if new is not None:
+            update['$max'] = {f'highScores.{username}': max(new['score'], 0)}
+        update = {k: v for k, v in update.items() if v}
+        result = collection.update_one({'_id': problem_id}, update)
+        if result.matched_count == 0:
+            return
+        # the high score might be lowered, find it again
+        if old is not None and old['score'] > 0 and (
+                new is None or new['score'] < old['score']):
+            high = engine.Submission.objects(
+                problem=problem_id,
+                user=base['user'],
+            ).only('score').order_by('-score').first()
+            collection.update_one(
+                {'_id': problem_id},
+                {
+                    '$set': {
+                        f'highScores.{username}':
+                        0 if high is None else max(high.score, 0)
+                    }
+                },
+            )
+
+    def high_score(self, username: str) -> int:
+        return self.high_scores.get(self._key(username), 0)
+
+    def score_distribution(self, usernames: List[str]) -> Dict[str, Any]:
+        '''
+        summarize high scores of given users, `scores` keeps the order of
+        `usernames`, other values are computed from one sorted copy
+        '''
+        high_scores = [self.high_score(u) for u in usernames]
+        scores = sorted(high_scores)
+        n = len(scores)
+        # the last bin only contains full score
+        histogram = [0] * (100 // self.HISTOGRAM_BIN + 1)
+        for score in scores:
+            histogram[min(score, 100) // self.HISTOGRAM_BIN] += 1
+        ret = {
+            'scores': high_scores,
+            'average': None,
+            'std': None,
+            'percentiles': {},
+            'histogram': histogram,
+        }
+        if n == 0:
+            return ret
+        average = math.fsum(scores) / n
+        ret['average'] = average
+        if n > 1:
+            ret['std'] = math.sqrt(
+                math.fsum((s - average)**2 for s in scores) / n)
+        # linear interpolation between closest ranks
+        for p in self.PERCENTILES:
+            pos = (n - 1) * p / 100
+            lo, hi = math.floor(pos), math.ceil(pos)
+            ret['percentiles'][str(p)] = \
+                scores[lo] + (scores[hi] - scores[lo]) * (pos - lo)
+        return ret
+
+    @property
+    def ac_user_count(self) -> int:
+        return sum(v > 0 for v in self.ac_users.values())
+
+    @property
+    def tried_user_count(self) -> int:
+        return sum(v > 0 for v in self.tried_users.values())
+
+    def get_status_count(self) -> Dict[str, int]:
+        return {k: v for k, v in self.status_count.items() if v > 0}
+
+    def top_submission_ids(self, field: str) -> List[Any]:
+        '''
+        ids of top submissions, `field` is 'runTime' or 'memoryUsage'
+        '''
+        field = {
+            'runTime': 'top_run_time',
+            'memoryUsage': 'top_memory_usage',
+        }[field]
+        return [item['submission'] for item in self.obj[field]]
+
+    def discard_top_submissions(self, ids: Iterable[Any]):
+        '''
+        remove submissions which no longer exist from top lists, they are
+        refilled at next read
+        '''
+        ids = [*ids]
+        if not ids:
+            return
+        engine.ProblemStats._get_collection().update_one(
+            {'_id': self.problem_id},
+            {
+                '$pull': {
+                    self._db_field(field): {
+                        'submission': {
+                            '$in': ids
+                        }
+                    }
+                    for field in self.TOP_FIELDS
+                }
+            },
+        )
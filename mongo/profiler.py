@@ -0,0 +1,202 @@
+import os
+import time
+import heapq
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+from flask import g, has_request_context
+from pymongo import monitoring
+from .metrics import Counter, REGISTRY
+
+__all__ = (
+    'Profile',
+    'CommandListener',
+    'profile',
+    'instrument_redis',
+)
+
+BACKENDS = ('mongo', 'redis')
+REQUESTS = Counter('noj_requests_total', 'Requests profiled.')
+SLOW_REQUESTS = Counter(
+    'noj_slow_requests_total',
+    'Requests exceeding thresholds.',
+)
+DB_COMMANDS = Counter(
+    'noj_db_commands_total',
+    'Database commands issued.',
+    labels=('backend', ),
+)
+DB_SECONDS = Counter(
+    'noj_db_seconds_total',
+    'Time spent on database commands.',
+    labels=('backend', ),
+)
+
+
+class Profile:
+    '''
+    Database commands issued in a unit of work. A request has its own
+    profile bound to `flask.g`, other workers can use `profile()`.
+    '''
+    # commands kept for the breakdown of a slow request
+    SLOWEST = 5
+    # a request is logged if it exceeds one of these
+    SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '1000'))
+    SLOW_REQUEST_QUERIES = int(os.getenv('SLOW_REQUEST_QUERIES', '50'))
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.counts = {backend: 0 for backend in BACKENDS}
+        self.durations = {backend: 0.0 for backend in BACKENDS}
+        self._slowest: List[Tuple[float, str, str]] = []
+
+    @staticmethod
+    def current() -> Optional['Profile']:
+        ret = _profile.get()
+        if ret is None and has_request_context():
+            ret = g.get('profile')
+        return ret
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts.values())
+
+    @property
+    def db_time(self) -> float:
+        return sum(self.durations.values())
+
+    @property
+    def slowest(self) -> List[Tuple[float, str, str]]:
+        '''
+        (duration, backend, command) of the slowest commands
+        '''
+        return sorted(self._slowest, reverse=True)
+
+    @property
+    def slow(self) -> bool:
+        return self.elapsed * 1000 > self.SLOW_REQUEST_MS or \
+            self.count > self.SLOW_REQUEST_QUERIES
+
+    def record(self, backend: str, command: str, duration: float):
+        if self.finished is not None:
+            return
+        self.counts[backend] += 1
+        self.durations[backend] += duration
+        item = (duration, backend, command)
+        if len(self._slowest) < self.SLOWEST:
+            heapq.heappush(self._slowest, item)
+        else:
+            heapq.heappushpop(self._slowest, item)
+
+    def finish(self):
+        '''
+        stop recording and add this profile to the totals
+        '''
+        if self.finished is not None:
+            return
+        self.finished = time.perf_counter()
+        REQUESTS.inc()
+        SLOW_REQUESTS.inc(int(self.slow))
+        for backend in BACKENDS:
+            DB_COMMANDS.inc(self.counts[backend], backend=backend)
+            DB_SECONDS.inc(self.durations[backend], backend=backend)
+        REGISTRY.maybe_flush()
+
+    def breakdown(self) -> str:
+        counts = ', '.join(f'{k}={v}' for k, v in self.counts.items())
+        slowest = '; '.join(f'{backend} {command} {duration * 1000:.1f}ms'
+                            for duration, backend, command in self.slowest)
+        return (f'time={self.elapsed * 1000:.1f}ms '
+                f'db_time={self.db_time * 1000:.1f}ms '
+                f'queries=[{counts}] slowest=[{slowest}]')
+
+
+_profile: ContextVar[Optional[Profile]] = ContextVar('profile', default=None)
+
+
+@contextmanager
+def profile():
+    '''
+    profile commands in this context, it can also decorate functions
+    '''
+    token = _profile.set(Profile())
+    try:
+        yield _profile.get()
+    finally:
+        _profile.get().finish()
+        _profile.reset(token)
+
+
+class CommandListener(monitoring.CommandListener):
+    '''
+    Record mongo commands into the current profile
+    '''
+
+    def __init__(self):
+        self._commands: Dict[Tuple[Any, int], str] = {}
+
+    def started(self, event):
+        if Profile.current() is None:
+            return
+        name = event.command_name
+        target = event.command.get(name)
+        if isinstance(target, str):
+            name = f'{name} {target}'
+        self._commands[event.connection_id, event.request_id] = name
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        name = self._commands.pop((event.connection_id, event.request_id),
+                                  None)
+        if name is None:
+            return
+        if (current := Profile.current()) is not None:
+            current.record('mongo', name, event.duration_micros / 1e6)
+
+
+def instrument_redis(client):
+    '''
+    record commands and pipelines sent by a redis client into the current
+    profile
+    '''
+
+    def timed(func, command):
+
+        def wrapper(*args, **ks):
+            if (current := Profile.current()) is None:
+                return func(*args, **ks)
+            name = command(*args)
+            start = time.perf_counter()
+            try:
+                return func(*args, **ks)
+            finally:
+                current.record('redis', name, time.perf_counter() - start)
+
+        return wrapper
+
+    client.execute_command = timed(
+        client.execute_command,
+        lambda name, *_: str(name),
+    )
+    pipeline = client.pipeline
+
+    def instrumented_pipeline(*args, **ks):
+        pipe = pipeline(*args, **ks)
+        pipe.execute = timed(
+            pipe.execute,
+            lambda *_: f'pipeline ({len(pipe.command_stack)})',
+        )
+        return pipe
+
+    client.pipeline = instrumented_pipeline
+    return client
@@ -0,0 +1,112 @@
+import json
+import time
+import logging
+import secrets
+from typing import Any, Dict
+from .base import identity_map
+from .dispatch import QueuedJob
+from .homework import Homework
+
+__all__ = ('RegradeJob', )
+
+
+class RegradeJob(QueuedJob):
+    '''
+    Recompute student status of a homework after its penalty or deadline
+    is changed. Jobs are queued and run by the dispatcher worker, the
+    progress, and changes of a dry run, are kept in redis.
+    '''
+    # job ids waiting for the dispatcher, and those being run
+    QUEUE_KEY = 'REGRADE_JOB_QUEUE'
+    PROCESSING_KEY = 'REGRADE_JOB_PROCESSING'
+    # keep job info for a day
+    EXPIRE = 24 * 60 * 60
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __str__(self):
+        return f'regrade job [{self.id}]'
+
+    @property
+    def key(self):
+        return f'REGRADE_JOB_{self.id}'
+
+    @classmethod
+    def create(
+        cls,
+        creator: str,
+        homework_id: str,
+        dry_run: bool = False,
+    ) -> 'RegradeJob':
+        job = cls(secrets.token_hex(12))
+        job.client.hset(
+            job.key,
+            mapping={
+                'state': cls.PENDING,
+                'creator': creator,
+                'created': time.time(),
+                'homework': homework_id,
+                'dryRun': int(dry_run),
+                'total': 0,
+                'processed': 0,
+                'changed': 0,
+            },
+        )
+        job.client.expire(job.key, cls.EXPIRE)
+        job.enqueue()
+        return job
+
+    @property
+    def creator(self) -> str:
+        return self.client.hget(self.key, 'creator').decode()
+
+    @property
+    def homework(self) -> Homework:
+        return Homework(self.client.hget(self.key, 'homework').decode())
+
+    def _set(self, **ks):
+        self.client.hset(self.key, mapping=ks)
+
+    @identity_map()
+    def run(self):
+        logger = logging.getLogger('gunicorn.error')
+        homework = self.homework
+        dry_run = self.client.hget(self.key, 'dryRun') == b'1'
+        # run again from the start if the worker was restarted
+        self._set(state=self.RUNNING, started=time.time(), processed=0)
+        try:
+            changes = homework.regrade(
+                dry_run=dry_run,
+                on_progress=lambda n, total: self._set(processed=n,
+                                                       total=total),
+            )
+        except Exception as e:
+            logger.error(f'{self} is stopped by error [err={e}]')
+            self._set(state=self.FAILED)
+            raise
+        mapping = {'state': self.DONE, 'changed': len(changes)}
+        if dry_run:
+            mapping['changes'] = json.dumps(changes)
+        self._set(**mapping)
+        logger.info(f'{self} regraded {len(changes)} status of {homework}')
+
+    def progress(self) -> Dict[str, Any]:
+        raw = {
+            k.decode(): v.decode()
+            for k, v in self.client.hgetall(self.key).items()
+        }
+        ret = {
+            'state': raw['state'],
+            'creator': raw['creator'],
+            'created': float(raw['created']),
+            'homeworkId': raw['homework'],
+            'dryRun': raw['dryRun'] == '1',
+            'started': float(raw['started']) if 'started' in raw else None,
+        }
+        for k in ('total', 'processed', 'changed'):
+            ret[k] = int(raw[k])
+        if 'changes' in raw:
+            ret['changes'] = json.loads(raw['changes'])
+        return ret
@@ -0,0 +1,173 @@
+import json
+import time
+import logging
+import secrets
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from . import engine
+from .base import identity_map
+from .dispatch import DispatchQueue, QueuedJob
+
+__all__ = ('RejudgeJob', )
+
+
+class RejudgeJob(QueuedJob):
+    '''
+    Rejudge all submissions matched by a filter. Jobs are queued and run
+    by the dispatcher worker, which selects submissions by one cursor and
+    pushes them into the dispatch queue in batches with this job's id.
+    Each submission is reset right before it is sent, so the dispatcher
+    can update progress of this job and drop the rest after cancellation.
+    '''
+    # job ids waiting for the dispatcher, and those being run
+    QUEUE_KEY = 'REJUDGE_JOB_QUEUE'
+    PROCESSING_KEY = 'REJUDGE_JOB_PROCESSING'
+    BATCH_SIZE = 500
+    # keep job info for a week
+    EXPIRE = 7 * 24 * 60 * 60
+    PENDING = 'pending'
+    SELECTING = 'selecting'
+    DISPATCHING = 'dispatching'
+    DONE = 'done'
+    CANCELLED = DispatchQueue.CANCELLED
+
+    def __init__(self, job_id: str):
+        super().__init__(job_id)
+        self.queue = DispatchQueue()
+
+    def __str__(self):
+        return f'rejudge job [{self.id}]'
+
+    @property
+    def key(self):
+        return DispatchQueue.job_key(self.id)
+
+    @classmethod
+    def create(
+        cls,
+        creator: str,
+        problem_ids: Optional[List[int]] = None,
+        status: Optional[int] = None,
+        before: Optional[datetime] = None,
+        after: Optional[datetime] = None,
+    ) -> 'RejudgeJob':
+        if before is not None and after is not None:
+            if after > before:
+                raise ValueError('the query period is empty')
+        job = cls(secrets.token_hex(12))
+        query = {
+            'problemIds': problem_ids,
+            'status': status,
+            'before': None if before is None else before.timestamp(),
+            'after': None if after is None else after.timestamp(),
+        }
+        job.client.hset(
+            job.key,
+            mapping={
+                'state': cls.PENDING,
+                'creator': creator,
+                'created': time.time(),
+                'query': json.dumps(query),
+                'total': 0,
+            },
+        )
+        job.client.expire(job.key, cls.EXPIRE)
+        job.enqueue()
+        return job
+
+    @property
+    def creator(self) -> str:
+        return self.client.hget(self.key, 'creator').decode()
+
+    @property
+    def state(self) -> str:
+        return self.client.hget(self.key, 'state').decode()
+
+    def _set_state(self, state: str):
+        self.client.hset(self.key, 'state', state)
+
+    def query(self):
+        q = json.loads(self.client.hget(self.key, 'query'))
+        ks = {
+            'problem__in': q['problemIds'],
+            'status': q['status'],
+            'timestamp__lte': None if q['before'] is None else \
+                datetime.fromtimestamp(q['before']),
+            'timestamp__gte': None if q['after'] is None else \
+                datetime.fromtimestamp(q['after']),
+        }
+        ks = {k: v for k, v in ks.items() if v is not None}
+        # skip handwritten submissions and those haven't uploaded code
+        return engine.Submission.objects(
+            language__ne=3,
+            status__ne=-2,
+            **ks,
+        )
+
+    def _push_batch(self, submission_ids: List[str]):
+        self.client.hincrby(self.key, 'total', len(submission_ids))
+        self.queue.push_many(submission_ids, job=self.id)
+
+    @identity_map()
+    def run(self):
+        '''
+        select submissions and push them into dispatch queue
+        '''
+        logger = logging.getLogger('gunicorn.error')
+        if self.state == self.CANCELLED:
+            return
+        self._set_state(self.SELECTING)
+        # selected again from the start if the worker was restarted
+        self.client.hset(self.key, 'total', 0)
+        cursor = self.query().only('id').no_cache().batch_size(
+            self.BATCH_SIZE).as_pymongo()
+        batch = []
+        try:
+            for submission in cursor:
+                batch.append(submission['_id'])
+                if len(batch) < self.BATCH_SIZE:
+                    continue
+                if self.state == self.CANCELLED:
+                    return
+                self._push_batch(batch)
+                batch = []
+            if len(batch) and self.state != self.CANCELLED:
+                self._push_batch(batch)
+        except Exception as e:
+            logger.error(f'{self} is stopped by error [err={e}]')
+            self.cancel()
+            raise
+        if self.state != self.CANCELLED:
+            self._set_state(self.DISPATCHING)
+        logger.info(f'{self} selected {self.progress()["total"]} submissions')
+
+    def cancel(self):
+        '''
+        stop selecting submissions, and the queued ones won't be reset
+        or sent. they keep their results and can be rejudged again. ones
+        already reset (e.g. waiting for retry) are still sent.
+        '''
+        self._set_state(self.CANCELLED)
+
+    def progress(self) -> Dict[str, Any]:
+        raw = {
+            k.decode(): v.decode()
+            for k, v in self.client.hgetall(self.key).items()
+        }
+        ret = {
+            'state': raw['state'],
+            'creator': raw['creator'],
+            'created': float(raw['created']),
+            'query': json.loads(raw['query']),
+        }
+        for k in (
+                'total',
+                DispatchQueue.SENT,
+                DispatchQueue.FAILED,
+                DispatchQueue.CANCELLED,
+        ):
+            ret[k] = int(raw.get(k, 0))
+        finished = ret['sent'] + ret['failed'] + ret['cancelled']
+        if ret['state'] == self.DISPATCHING and finished >= ret['total']:
+            ret['state'] = self.DONE
+        return ret
@@ -1,13 +1,379 @@
+import os
+import time
+import random
 import secrets
-from .submission import Submission
+import logging
+import threading
+import requests as rq
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict, Optional
+from . import engine
+from .utils import RedisCache
+
+__all__ = (
+    'SandboxRegistry',
+    'SandboxClient',
+    'SandboxUnavailable',
+)
+
+
+def _config():
+    from .submission import Submission
+    return Submission.config()
 
 
 def find_by_token(token: str):
     '''
     Find sandbox by token. return None if cannot find a sandbox with that token.
     '''
-    sandboxes = Submission.config().sandbox_instances
+    sandboxes = _config().sandbox_instances
     for sandbox in sandboxes:
         if secrets.compare_digest(token, sandbox.token):
             return sandbox
     return None
+
+
+class SandboxUnavailable(rq.ConnectionError):
+    '''
+    the sandbox keeps failing and its circuit breaker is open
+    '''
+
+
+class SandboxClient:
+    '''
+    HTTP client of a sandbox. Clients are shared in the process, each keeps
+    a pool of keep-alive connections, and stops sending requests to the
+    sandbox for `COOLDOWN` seconds after `FAILURE_THRESHOLD` consecutive
+    connection failures. Statistics are kept in redis, since requests are
+    sent by the dispatcher but read by web workers.
+    '''
+    CONNECT_TIMEOUT = float(os.getenv('SANDBOX_CONNECT_TIMEOUT', '3'))
+    READ_TIMEOUT = float(os.getenv('SANDBOX_READ_TIMEOUT', '30'))
+    POOL_SIZE = int(os.getenv('SANDBOX_POOL_SIZE', '10'))
+    FAILURE_THRESHOLD = int(os.getenv('SANDBOX_FAILURE_THRESHOLD', '5'))
+    COOLDOWN = float(os.getenv('SANDBOX_COOLDOWN', '30'))
+    _clients: Dict[Any, 'SandboxClient'] = {}
+    _lock = threading.Lock()
+
+    def __new__(cls, sandbox: engine.Sandbox):
+        key = (sandbox.name, sandbox.url)
+        with cls._lock:
+            if key not in cls._clients:
+                new = super().__new__(cls)
+                new._setup(sandbox)
+                cls._clients[key] = new
+            return cls._clients[key]
+
+    def _setup(self, sandbox: engine.Sandbox):
+        self.name = sandbox.name
+        self.url = sandbox.url.rstrip('/')
+        self.session = rq.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.POOL_SIZE,
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._stat_lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+
+    @classmethod
+    def reset(cls):
+        '''
+        close all clients
+        '''
+        with cls._lock:
+            for client in cls._clients.values():
+                client.session.close()
+            cls._clients = {}
+
+    @staticmethod
+    def stats_key(name: str) -> str:
+        return f'SANDBOX_STATS_{name}'
+
+    @property
+    def is_open(self) -> bool:
+        '''
+        whether the circuit breaker is open
+        '''
+        if self.opened_at is None:
+            return False
+        # let a request pass to test the sandbox after cooldown
+        return time.time() - self.opened_at < self.COOLDOWN
+
+    def _record(self, latency: float, error: bool):
+        key = self.stats_key(self.name)
+        client = RedisCache().client
+        pipe = client.pipeline(transaction=False)
+        pipe.hincrby(key, 'requestCount', 1)
+        pipe.hincrby(key, 'errorCount', int(error))
+        pipe.hincrbyfloat(key, 'totalLatency', latency)
+        pipe.hget(key, 'maxLatency')
+        if self.opened_at is None:
+            pipe.hdel(key, 'openedAt')
+        else:
+            pipe.hset(key, 'openedAt', self.opened_at)
+        max_latency = pipe.execute()[3]
+        # requests sent at the same time may lower it a little
+        if max_latency is None or latency > float(max_latency):
+            client.hset(key, 'maxLatency', latency)
+
+    def _on_success(self, latency: float):
+        with self._stat_lock:
+            self.failures = 0
+            self.opened_at = None
+        self._record(latency, error=False)
+
+    def _on_failure(self, latency: float):
+        with self._stat_lock:
+            self.failures += 1
+            tripped = self.failures >= self.FAILURE_THRESHOLD
+            if tripped:
+                self.opened_at = time.time()
+        self._record(latency, error=True)
+        if tripped:
+            logging.getLogger('gunicorn.error').warning(
+                f'sandbox {self.name} keeps failing, stop sending '
+                f'requests for {self.COOLDOWN} seconds')
+
+    def request(self, method: str, path: str, **ks) -> rq.Response:
+        if self.is_open:
+            raise SandboxUnavailable(f'sandbox {self.name} is unavailable')
+        ks.setdefault('timeout', (self.CONNECT_TIMEOUT, self.READ_TIMEOUT))
+        start = time.perf_counter()
+        try:
+            resp = self.session.request(method, f'{self.url}{path}', **ks)
+        except (rq.ConnectionError, rq.Timeout):
+            self._on_failure(time.perf_counter() - start)
+            raise
+        self._on_success(time.perf_counter() - start)
+        return resp
+
+    def status(self) -> rq.Response:
+        return self.request('GET', '/status')
+
+    def submit(self, submission_id: str, **ks) -> rq.Response:
+        return self.request('POST', f'/submit/{submission_id}', **ks)
+
+    @classmethod
+    def stats(cls, name: str) -> Dict[str, Any]:
+        '''
+        statistics of requests sent to a sandbox by all processes
+        '''
+        raw = RedisCache().client.hgetall(cls.stats_key(name))
+        raw = {k.decode(): float(v) for k, v in raw.items()}
+        request_count = int(raw.get('requestCount', 0))
+        opened_at = raw.get('openedAt')
+        return {
+            'requestCount':
+            request_count,
+            'errorCount':
+            int(raw.get('errorCount', 0)),
+            'avgLatency':
+            raw.get('totalLatency', 0) / request_count if request_count else 0,
+            'maxLatency':
+            raw.get('maxLatency', 0),
+            'circuitOpen':
+            opened_at is not None and time.time() - opened_at < cls.COOLDOWN,
+        }
+
+
+class SandboxRegistry:
+    '''
+    A load table of sandboxes kept in redis. Loads are reported by
+    sandboxes' heartbeat or refreshed by the dispatcher in background,
+    and an entry is treated as dead if it is not updated in `LOAD_TTL`
+    seconds. Sandboxes reporting a load of `MAX_LOAD` or more are
+    saturated and won't be selected.
+    '''
+    LOAD_KEY = 'SANDBOX_LOAD'
+    HEARTBEAT_KEY = 'SANDBOX_HEARTBEAT'
+    ROUND_ROBIN_KEY = 'SANDBOX_ROUND_ROBIN'
+    LOAD_TTL = float(os.getenv('SANDBOX_LOAD_TTL', '10'))
+    MAX_LOAD = float(os.getenv('SANDBOX_MAX_LOAD', '1000'))
+    STRATEGIES = (
+        'least-loaded',
+        'round-robin',
+        'power-of-two',
+    )
+
+    def __init__(self, config: Optional[engine.SubmissionConfig] = None):
+        self.config = config or _config()
+        self.client = RedisCache().client
+        self.logger = logging.getLogger('gunicorn.error')
+
+    @property
+    def instances(self) -> Dict[str, engine.Sandbox]:
+        return {sb.name: sb for sb in self.config.sandbox_instances}
+
+    def report(self, name: str, load: float):
+        '''
+        update the load of a sandbox
+        '''
+        pipe = self.client.pipeline()
+        pipe.zadd(self.LOAD_KEY, {name: load})
+        pipe.hset(self.HEARTBEAT_KEY, name, time.time())
+        pipe.execute()
+
+    def remove(self, name: str):
+        pipe = self.client.pipeline()
+        pipe.zrem(self.LOAD_KEY, name)
+        pipe.hdel(self.HEARTBEAT_KEY, name)
+        pipe.execute()
+
+    def refresh(self) -> Dict[str, float]:
+        '''
+        poll every sandbox's status and update the load table
+
+        Returns:
+            loads of sandboxes which responded normally
+        '''
+        ret = {}
+        for sb in self.config.sandbox_instances:
+            try:
+                resp = SandboxClient(sb).status()
+            except rq.RequestException as e:
+                self.logger.warning(
+                    f'sandbox {sb.name} is unreachable [err={e}]')
+                self.remove(sb.name)
+                continue
+            if not resp.ok:
+                self.logger.warning(f'sandbox {sb.name} status exception')
+                self.logger.warning(
+                    f'status code: {resp.status_code}\n '
+                    f'body: {resp.text}', )
+                self.remove(sb.name)
+                continue
+            ret[sb.name] = resp.json()['load']
+            self.report(sb.name, ret[sb.name])
+        return ret
+
+    def loads(self) -> Dict[str, float]:
+        '''
+        get the loads of all alive sandboxes
+        '''
+        deadline = time.time() - self.LOAD_TTL
+        loads = self.client.zrange(self.LOAD_KEY, 0, -1, withscores=True)
+        heartbeats = self.client.hgetall(self.HEARTBEAT_KEY)
+        instances = self.instances
+        ret = {}
+        for name, load in loads:
+            if float(heartbeats.get(name, 0)) < deadline:
+                continue
+            name = name.decode()
+            if name in instances:
+                ret[name] = load
+        return ret
+
+    def _alive(self, name: bytes, heartbeats: Optional[Dict] = None):
+        if heartbeats is None:
+            heartbeat = self.client.hget(self.HEARTBEAT_KEY, name)
+        else:
+            heartbeat = heartbeats.get(name)
+        return heartbeat is not None and \
+            float(heartbeat) >= time.time() - self.LOAD_TTL
+
+    def _usable(self, name: str, instances: Dict[str, engine.Sandbox]):
+        '''
+        whether the sandbox is in config and not broken from this process
+        '''
+        if name not in instances:
+            return False
+        return not SandboxClient(instances[name]).is_open
+
+    def _least_loaded(self) -> Optional[str]:
+        instances = self.instances
+        # try the unsaturated sandboxes in ascending order of load,
+        # usually the first one is alive
+        offset, step = 0, 4
+        while True:
+            names = self.client.zrangebyscore(
+                self.LOAD_KEY,
+                '-inf',
+                f'({self.MAX_LOAD}',
+                start=offset,
+                num=step,
+            )
+            if len(names) == 0:
+                return None
+            heartbeats = dict(
+                zip(names, self.client.hmget(self.HEARTBEAT_KEY, names)))
+            for name in names:
+                if not self._alive(name, heartbeats):
+                    continue
+                name = name.decode()
+                if self._usable(name, instances):
+                    return name
+            offset += step
+
+    def _round_robin(self) -> Optional[str]:
+        alive = self.loads()
+        instances = self.instances
+        sandboxes = [
+            sb for sb in self.config.sandbox_instances
+            if alive.get(sb.name, self.MAX_LOAD) < self.MAX_LOAD
+            and self._usable(sb.name, instances)
+        ]
+        if len(sandboxes) == 0:
+            return None
+        total = sum(sb.weight for sb in sandboxes)
+        pos = (self.client.incr(self.ROUND_ROBIN_KEY) - 1) % total
+        for sb in sandboxes:
+            if pos < sb.weight:
+                return sb.name
+            pos -= sb.weight
+
+    def _power_of_two(self) -> Optional[str]:
+        instances = self.instances
+        names = [name for name in instances if self._usable(name, instances)]
+        candidates = random.sample(names, min(2, len(names)))
+        loads = [(self.client.zscore(self.LOAD_KEY, name), name)
+                 for name in candidates if self._alive(name)]
+        loads = [(load, name) for load, name in loads
+                 if load is not None and load < self.MAX_LOAD]
+        if len(loads) == 0:
+            # both candidates are dead or saturated, fallback to scan
+            return self._least_loaded()
+        return min(loads)[1]
+
+    def select(self,
+               strategy: Optional[str] = None) -> Optional[engine.Sandbox]:
+        '''
+        select a sandbox to judge submission
+
+        Args:
+            strategy: one of `STRATEGIES`, default to the
+                `sandbox_strategy` in submission config
+        '''
+        if strategy is None:
+            strategy = self.config.sandbox_strategy
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f'unknown strategy {strategy}')
+        select_func = {
+            'least-loaded': self._least_loaded,
+            'round-robin': self._round_robin,
+            'power-of-two': self._power_of_two,
+        }[strategy]
+        name = select_func()
+        # the load table is empty or stale, poll sandboxes directly
+        if name is None and not self.loads() and self.refresh():
+            name = select_func()
+        # every sandbox is saturated, the dispatcher will retry later
+        if name is None:
+            return None
+        return self.instances[name]
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        '''
+        get load and connection statistics of each sandbox
+        '''
+        loads = self.loads()
+        return {
+            sb.name: {
+                'load': loads.get(sb.name),
+                'alive': sb.name in loads,
+                **SandboxClient.stats(sb.name),
+            }
+            for sb in self.config.sandbox_instances
+        }
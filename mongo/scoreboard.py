@@ -0,0 +1,291 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+from pymongo import ReturnDocument
+from . import engine
+
+__all__ = ('Scoreboard', )
+
+
+class Scoreboard:
+    '''
+    Scores of submissions materialized into buckets of each user, problem
+    and day. Buckets are updated when a submission is added, judged or
+    deleted, so a scoreboard is merged from them. Submissions are only
+    aggregated for partial days at the edges of the query period.
+    '''
+    BUCKET = timedelta(days=1)
+    # submission fields affect buckets
+    TRACKED_FIELDS = ('problem', 'user', 'timestamp', 'score')
+
+    @classmethod
+    def day(cls, timestamp: datetime) -> datetime:
+        return datetime.combine(timestamp.date(), datetime.min.time())
+
+    @classmethod
+    def _key(cls, submission: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'problem': submission['problem'],
+            'user': submission['user'],
+            'day': cls.day(submission['timestamp']),
+        }
+
+    @classmethod
+    def apply(
+        cls,
+        old: Optional[Dict[str, Any]],
+        new: Optional[Dict[str, Any]],
+    ):
+        '''
+        apply the change of a submission to buckets, `old` and `new` are
+        snapshots of the submission before and after the change, see
+        `Submission.snapshot`
+        '''
+        if old is not None and new is not None and all(
+                old[k] == new[k] for k in cls.TRACKED_FIELDS):
+            return
+        collection = engine.ScoreboardBucket._get_collection()
+        if old is not None:
+            key = cls._key(old)
+            # move the score in place if it stays in the same bucket
+            if new is not None and key == cls._key(new):
+                inc, score = (0, new['score'] - old['score']), new['score']
+                new = None
+            else:
+                inc, score = (-1, -old['score']), None
+            update = {'$inc': {'count': inc[0], 'total': inc[1]}}
+            if score is not None:
+                update.update({
+                    '$max': {
+                        'max': score
+                    },
+                    '$min': {
+                        'min': score
+                    },
+                })
+            bucket = collection.find_one_and_update(
+                key,
+                update,
+                return_document=ReturnDocument.AFTER,
+            )
+            # the bucket is missing, or the old score might be the max or
+            # min, compute it again
+            if bucket is None or (old['score'] != score and old['score'] in (
+                    bucket['max'],
+                    bucket['min'],
+            )):
+                cls.refresh(**key)
+        if new is not None:
+            collection.update_one(
+                cls._key(new),
+                {
+                    '$inc': {
+                        'count': 1,
+                        'total': new['score'],
+                    },
+                    '$max': {
+                        'max': new['score']
+                    },
+                    '$min': {
+                        'min': new['score']
+                    },
+                },
+                upsert=True,
+            )
+
+    @classmethod
+    def refresh(cls, problem: int, user: str, day: datetime):
+        '''
+        recompute a bucket from submissions
+        '''
+        items = cls._aggregate(
+            [user],
+            [problem],
+            gte=day,
+            lt=day + cls.BUCKET,
+        )
+        key = {'problem': problem, 'user': user, 'day': day}
+        collection = engine.ScoreboardBucket._get_collection()
+        if not items:
+            collection.delete_one(key)
+            return
+        item = items[0]
+        collection.update_one(
+            key,
+            {'$set': {k: item[k]
+                      for k in ('count', 'total', 'max', 'min')}},
+            upsert=True,
+        )
+
+    @classmethod
+    def rebuild(cls, problem_ids: Optional[Iterable[int]] = None) -> int:
+        '''
+        rebuild buckets from submissions, all problems are rebuilt if
+        `problem_ids` is not provided
+
+        Returns:
+            the number of buckets
+        '''
+        submissions = engine.Submission.objects()
+        buckets = engine.ScoreboardBucket.objects()
+        if problem_ids is not None:
+            problem_ids = [*problem_ids]
+            submissions = submissions.filter(problem__in=problem_ids)
+            buckets = buckets.filter(problem__in=problem_ids)
+        submissions = submissions.only(*cls.TRACKED_FIELDS).as_pymongo()
+        items = {}
+        for s in submissions.no_cache():
+            key = (s['problem'], s['user'], cls.day(s['timestamp']))
+            score = s.get('score', -1)
+            if key not in items:
+                items[key] = {
+                    'count': 0,
+                    'total': 0,
+                    'max': score,
+                    'min': score,
+                }
+            item = items[key]
+            item['count'] += 1
+            item['total'] += score
+            item['max'] = max(item['max'], score)
+            item['min'] = min(item['min'], score)
+        buckets.delete()
+        if items:
+            engine.ScoreboardBucket._get_collection().insert_many([{
+                'problem': problem,
+                'user': user,
+                'day': day,
+                **item,
+            } for (problem, user, day), item in items.items()])
+        return len(items)
+
+    @classmethod
+    def _aggregate(
+        cls,
+        usernames: List[str],
+        problem_ids: List[int],
+        gte: Optional[datetime] = None,
+        lt: Optional[datetime] = None,
+        lte: Optional[datetime] = None,
+    ) -> List[Dict[str, Any]]:
+        '''
+        aggregate scores of submissions in a period directly
+        '''
+        matching = {
+            'user': {
+                '$in': usernames
+            },
+            'problem': {
+                '$in': problem_ids
+            },
+            'timestamp': {
+                k: v
+                for k, v in (('$gte', gte), ('$lt', lt), ('$lte', lte))
+                if v is not None
+            },
+        }
+        if not matching['timestamp']:
+            del matching['timestamp']
+        pipeline = [
+            {
+                '$match': matching
+            },
+            {
+                '$group': {
+                    '_id': {
+                        'user': '$user',
+                        'problem': '$problem',
+                    },
+                    'count': {
+                        '$sum': 1
+                    },
+                    'total': {
+                        '$sum': '$score'
+                    },
+                    'max': {
+                        '$max': '$score'
+                    },
+                    'min': {
+                        '$min': '$score'
+                    },
+                }
+            },
+        ]
+        return [{
+            **item['_id'],
+            **item,
+        } for item in engine.Submission.objects().aggregate(pipeline)]
+
+    @classmethod
+    def query(
+        cls,
+        usernames: List[str],
+        problem_ids: List[int],
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> Dict[str, Dict[int, Dict[str, Any]]]:
+        '''
+        get score statistics of submissions in [start, end]
+
+        Returns:
+            a dict maps username to {problem id: {count, total, max, min}}
+        '''
+        # buckets between `first` and `last` are fully covered
+        first = last = None
+        if start is not None:
+            first = cls.day(start)
+            if first != start:
+                first += cls.BUCKET
+        if end is not None:
+            last = cls.day(end)
+        parts = []
+        if first is not None and last is not None and first >= last:
+            parts += cls._aggregate(usernames, problem_ids, gte=start, lte=end)
+        else:
+            matching = {
+                'user': {
+                    '$in': usernames
+                },
+                'problem': {
+                    '$in': problem_ids
+                },
+                'day': {},
+            }
+            if first is not None:
+                matching['day']['$gte'] = first
+                if start < first:
+                    parts += cls._aggregate(
+                        usernames,
+                        problem_ids,
+                        gte=start,
+                        lt=first,
+                    )
+            if last is not None:
+                matching['day']['$lt'] = last
+                parts += cls._aggregate(
+                    usernames,
+                    problem_ids,
+                    gte=last,
+                    lte=end,
+                )
+            if not matching['day']:
+                del matching['day']
+            collection = engine.ScoreboardBucket._get_collection()
+            parts += collection.find(matching, {'_id': 0})
+        ret = defaultdict(dict)
+        for part in parts:
+            if part['count'] <= 0:
+                continue
+            scores = ret[part['user']]
+            item = scores.get(part['problem'])
+            if item is None:
+                scores[part['problem']] = {
+                    k: part[k]
+                    for k in ('count', 'total', 'max', 'min')
+                }
+                continue
+            item['count'] += part['count']
+            item['total'] += part['total']
+            item['max'] = max(item['max'], part['max'])
+            item['min'] = min(item['min'], part['min'])
+        return ret
@@ -1,31 +1,51 @@
 from __future__ import annotations
 import os
 import pathlib
+import io
+import json
+import base64
+import hashlib
+import zlib
+import struct
 import secrets
 import logging
 from typing import (
+    IO,
     Any,
     Dict,
+    Iterable,
     Optional,
+    Tuple,
     Union,
     List,
 )
 import tempfile
-import requests as rq
 import itertools
+from bson import DBRef, ObjectId
+from bson.errors import InvalidId
 from bson.son import SON
-from flask import current_app
-from tempfile import NamedTemporaryFile
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
 from datetime import date, datetime
-from zipfile import ZipFile, is_zipfile
+from zipfile import ZipFile, is_zipfile, ZIP_STORED, ZIP_DEFLATED
 
 from . import engine
 from .base import MongoBase
 from .user import User
-from .problem import Problem
+from .problem import Problem, ProblemStats
 from .homework import Homework
 from .course import Course
-from .utils import (RedisCache, perm)
+from .dispatch import DispatchQueue
+from .scoreboard import Scoreboard
+from .event import EventChannel
+from .metrics import Histogram
+from .sandbox import SandboxRegistry, SandboxClient
+from .utils import (
+    RedisCache,
+    perm,
+    delete_grid_files,
+    read_grid_files,
+)
 
 __all__ = [
     'SubmissionConfig',
@@ -34,6 +54,12 @@ __all__ = [
     'TestCaseNotFound',
 ]
 
+JUDGE_SECONDS = Histogram(
+    'noj_judge_duration_seconds',
+    'Time from sending a submission to judge until its result is stored.',
+    buckets=(0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+
 # TODO: modular token function
 
 
@@ -71,6 +97,33 @@ class SubmissionConfig(MongoBase, engine=engine.SubmissionConfig):
             'SUBMISSION_TMP_DIR',
             tempfile.TemporaryDirectory(suffix='noj-submisisons').name,
         ), )
+    # outputs are encoded in memory until they exceed this size
+    OUTPUT_SPOOL_SIZE = int(
+        os.getenv('SUBMISSION_OUTPUT_SPOOL_SIZE', str(2**22)))
+    # outputs smaller than this are stored without compression
+    OUTPUT_COMPRESS_SIZE = int(
+        os.getenv('SUBMISSION_OUTPUT_COMPRESS_SIZE', '1024'))
+    # pack outputs of all cases into one file, set to 0 to store
+    # one file per case
+    PACK_OUTPUT = os.getenv('SUBMISSION_PACK_OUTPUT', '1') != '0'
+    # outputs smaller than this are compressed and stored in submission
+    # document instead of GridFS, set to 0 to disable
+    INLINE_OUTPUT_SIZE = int(os.getenv('SUBMISSION_INLINE_OUTPUT_SIZE',
+                                       '2048'))
+    # threads used to decode output files
+    OUTPUT_DECODE_WORKERS = int(
+        os.getenv('SUBMISSION_OUTPUT_DECODE_WORKERS', '4'))
+    # seconds to cache the detailed result of a judged submission
+    DETAIL_CACHE_TTL = int(os.getenv('SUBMISSION_DETAIL_CACHE_TTL', '600'))
+    # seconds to cache the count of a submission query
+    COUNT_CACHE_TTL = int(os.getenv('SUBMISSION_COUNT_CACHE_TTL', '30'))
+    # bytes of each output included in the detailed result
+    OUTPUT_PREVIEW_SIZE = int(
+        os.getenv('SUBMISSION_OUTPUT_PREVIEW_SIZE', '4096'))
+    # output files larger than this are streamed instead of being loaded
+    # with other files in batch
+    OUTPUT_BATCH_READ_SIZE = int(
+        os.getenv('SUBMISSION_OUTPUT_BATCH_READ_SIZE', str(2**20)))
 
     def __init__(self, name: str):
         self.name = name
@@ -78,6 +131,30 @@ class SubmissionConfig(MongoBase, engine=engine.SubmissionConfig):
 
 class Submission(MongoBase, engine=engine.Submission):
     _config = None
+    _output_pool = None
+    # fields needed by `to_list_dict`
+    LIST_FIELDS = (
+        'id',
+        'problem',
+        'user',
+        'language',
+        'timestamp',
+        'status',
+        'score',
+        'exec_time',
+        'memory_usage',
+        'last_send',
+    )
+    # fields tracked by problem statistics and scoreboard
+    TRACKED_FIELDS = (
+        'problem',
+        'user',
+        'timestamp',
+        'status',
+        'score',
+        'exec_time',
+        'memory_usage',
+    )
 
     def __init__(self, submission_id):
         self.submission_id = str(submission_id)
@@ -147,25 +224,88 @@ class Submission(MongoBase, engine=engine.Submission):
 
     @classmethod
     def config(cls):
-        if not cls._config:
+        if cls._config is None or not cls._config.exists(refresh=True):
             cls._config = SubmissionConfig('submission')
         if not cls._config:
             cls._config.save()
         return cls._config.reload()
 
-    def get_single_output(self, task_no, case_no, text=True):
+    @staticmethod
+    def output_prefix(task_no: int, case_no: int) -> str:
+        return f'{task_no}/{case_no}/'
+
+    def _open_case_output(
+        self,
+        task_no: int,
+        case_no: int,
+        case: engine.CaseResult,
+        archive: Optional[ZipFile] = None,
+        files: Optional[Dict[Any, bytes]] = None,
+    ) -> Optional[Dict[str, Tuple[IO[bytes], int]]]:
+        '''
+        open stdout/stderr of a case without reading them
+
+        Args:
+            archive: the opened packed outputs
+            files: the GridFS files already loaded
+
+        Returns:
+            a dict maps 'stdout'/'stderr' to a file object and its
+            size, None if the output has not been stored
+        '''
+        if case.inline_output is not None:
+            output = self._decode_inline_output(case.inline_output)
+            return {k: (io.BytesIO(v), len(v)) for k, v in output.items()}
+        if case.output:
+            data = (files or {}).get(case.output.grid_id)
+            zf = ZipFile(case.output if data is None else io.BytesIO(data))
+            prefix = ''
+        elif self.obj.output:
+            zf = archive or ZipFile(self.obj.output)
+            prefix = self.output_prefix(task_no, case_no)
+        else:
+            return None
+        try:
+            return {
+                fd: (
+                    zf.open(f'{prefix}{fd}'),
+                    zf.getinfo(f'{prefix}{fd}').file_size,
+                )
+                for fd in ('stdout', 'stderr')
+            }
+        finally:
+            # opened members can still be read after the zip is closed
+            if zf is not archive:
+                zf.close()
+
+    def open_output(
+        self,
+        task_no: int,
+        case_no: int,
+        fd: str,
+    ) -> Tuple[IO[bytes], int]:
+        '''
+        open stdout or stderr of a case as a file object streaming from
+        GridFS, and get its size
+        '''
+        if fd not in ('stdout', 'stderr'):
+            raise ValueError(f'unknown output {fd}')
         try:
             case = self.tasks[task_no].cases[case_no]
         except IndexError:
             raise FileNotFoundError('task not exist')
-        ret = {}
-        try:
-            with ZipFile(case.output) as zf:
-                ret = {k: zf.read(k) for k in ('stdout', 'stderr')}
-                if text:
-                    ret = {k: v.decode('utf-8') for k, v in ret.items()}
-        except AttributeError as e:
+        output = self._open_case_output(task_no, case_no, case)
+        if output is None:
             raise AttributeError('The submission is still in pending')
+        return output[fd]
+
+    def get_single_output(self, task_no, case_no, text=True):
+        ret = {}
+        for fd in ('stdout', 'stderr'):
+            with self.open_output(task_no, case_no, fd)[0] as f:
+                ret[fd] = f.read()
+        if text:
+            ret = {k: v.decode('utf-8') for k, v in ret.items()}
         return ret
 
     def delete_output(self, *args):
@@ -175,9 +315,19 @@ class Submission(MongoBase, engine=engine.Submission):
         Args:
             args: ignored value, don't mind
         '''
-        for task in self.tasks:
-            for case in task.cases:
-                case.output.delete()
+        delete_grid_files(self.output_file_ids())
+
+    def output_file_ids(self) -> List[Any]:
+        '''
+        get GridFS ids of all stdout/stderr files
+        '''
+        ret = [
+            case.output.grid_id for task in self.tasks for case in task.cases
+            if case.output is not None and case.output.grid_id is not None
+        ]
+        if self.obj.output:
+            ret.append(self.obj.output.grid_id)
+        return ret
 
     def delete(self, *keeps):
         '''
@@ -199,7 +349,107 @@ class Submission(MongoBase, engine=engine.Submission):
 
         for d in drops:
             del_funcs.get(d, default_del_func)(d)
-        self.obj.delete()
+        super().delete()
+        self.apply_change(self.snapshot(self.obj), None)
+
+    def update(self, **ks):
+        '''
+        update this submission, the change is also applied to statistics
+        and scoreboard if any field tracked by them is updated
+        '''
+        tracked = [k for k in self.TRACKED_FIELDS if k in ks]
+        if not tracked:
+            return super().update(**ks)
+        old = self.snapshot(self.obj)
+        ret = super().update(**ks)
+        # keep loaded document consistent with db
+        for k in tracked:
+            self.obj[k] = ks[k]
+        self.apply_change(old, self.snapshot(self.obj))
+        return ret
+
+    @classmethod
+    def snapshot(cls, document: engine.Submission) -> Dict[str, Any]:
+        '''
+        extract fields tracked by statistics and scoreboard, references
+        are read without dereferencing
+        '''
+
+        def ref_id(name):
+            ref = document._data.get(name)
+            if isinstance(ref, DBRef):
+                return ref.id
+            return getattr(ref, 'pk', None)
+
+        return {
+            'id': document.id,
+            'problem': ref_id('problem'),
+            'user': ref_id('user'),
+            **{
+                k: document[k]
+                for k in cls.TRACKED_FIELDS if k not in ('problem', 'user')
+            },
+        }
+
+    @staticmethod
+    def apply_change(
+        old: Optional[Dict[str, Any]],
+        new: Optional[Dict[str, Any]],
+    ):
+        '''
+        apply the change of a submission to materialized data, `old` is
+        None for new submission, `new` is None for deleted one
+        '''
+        ProblemStats.apply(old, new)
+        Scoreboard.apply(old, new)
+        Submission.publish_change(old, new)
+
+    @staticmethod
+    def publish_change(
+        old: Optional[Dict[str, Any]],
+        new: Optional[Dict[str, Any]],
+    ):
+        '''
+        notify subscribers of verdict and scoreboard changes, submissions
+        without code (-2) or waiting for judgement (-1) have no verdict
+        '''
+        base = new or old
+        problem_channel = EventChannel.problem(base['problem'])
+        judged_fields = ('status', 'score', 'exec_time', 'memory_usage')
+        if new is not None and new['status'] >= 0 and (old is None or any(
+                old[k] != new[k] for k in judged_fields)):
+            EventChannel.publish(
+                [
+                    EventChannel.SUBMISSION,
+                    EventChannel.user(new['user']),
+                    problem_channel,
+                ],
+                'verdict',
+                {
+                    'submissionId': str(new['id']),
+                    'problemId': new['problem'],
+                    'username': new['user'],
+                    'timestamp': new['timestamp'].timestamp(),
+                    'status': new['status'],
+                    'score': new['score'],
+                    'runTime': new['exec_time'],
+                    'memoryUsage': new['memory_usage'],
+                },
+            )
+        if old is None or new is None or old['score'] != new['score']:
+            EventChannel.publish(
+                [problem_channel],
+                'scoreboard',
+                {
+                    'submissionId': str(base['id']),
+                    'problemId': base['problem'],
+                    'username': base['user'],
+                    'timestamp': base['timestamp'].timestamp(),
+                    # None if the submission is new or deleted
+                    'oldScore': old and old['score'],
+                    'score': new and new['score'],
+                },
+            )
 
     def sandbox_resp_handler(self, resp):
         # judge queue is currently full
@@ -231,21 +481,7 @@ class Submission(MongoBase, engine=engine.Submission):
             return False
 
     def target_sandbox(self):
-        load = 10**3  # current min load
-        tar = None  # target
-        for sb in self.config().sandbox_instances:
-            resp = rq.get(f'{sb.url}/status')
-            if not resp.ok:
-                self.logger.warning(f'sandbox {sb.name} status exception')
-                self.logger.warning(
-                    f'status code: {resp.status_code}\n '
-                    f'body: {resp.text}', )
-                continue
-            resp = resp.json()
-            if resp['load'] < load:
-                load = resp['load']
-                tar = sb
-        return tar
+        return SandboxRegistry(self.config()).select()
 
     def get_comment(self) -> bytes:
         '''
@@ -276,9 +512,9 @@ class Submission(MongoBase, engine=engine.Submission):
         file.seek(0)
         return True
 
-    def rejudge(self) -> bool:
+    def reset(self):
         '''
-        rejudge this submission
+        drop the result of last judgement
         '''
         # delete output file
         self.delete_output()
@@ -287,10 +523,15 @@ class Submission(MongoBase, engine=engine.Submission):
             status=-1,
             last_send=datetime.now(),
             tasks=[],
+            output=None,
         )
-        if current_app.config['TESTING']:
-            return True
-        return self.send()
+
+    def rejudge(self) -> bool:
+        '''
+        rejudge this submission
+        '''
+        self.reset()
+        return self.enqueue()
 
     def submit(self, code_file) -> bool:
         '''
@@ -320,18 +561,41 @@ class Submission(MongoBase, engine=engine.Submission):
             }
             for submission in engine.Submission.objects(**q):
                 if submission != self.obj:
-                    for homework in self.problem.homeworks:
-                        stat = homework.student_status[self.user.username][str(
-                            self.problem_id)]
-                        stat['score'] = 0
-                        stat['problemStatus'] = -1
-                        stat['submissionIds'] = []
-                        homework.save()
+                    engine.HomeworkStatus.objects(
+                        homework__in=self.problem.homeworks,
+                        user=self.username,
+                        problem=self.problem_id,
+                    ).update(
+                        score=0,
+                        problem_status=-1,
+                        submission_ids=[],
+                    )
                     submission.delete()
-        # we no need to actually send code to sandbox during testing
-        if current_app.config['TESTING'] or self.handwritten:
+                    self.apply_change(self.snapshot(submission), None)
+        # handwritten submission is judged by teacher
+        if self.handwritten:
             return True
-        return self.send()
+        return self.enqueue()
+
+    def enqueue(self) -> bool:
+        '''
+        push this submission into dispatch queue, the dispatcher
+        worker will send it to sandbox later
+        '''
+        if self.handwritten:
+            logging.warning(f'try to enqueue a handwritten {self}')
+            return False
+        if self.problem.test_case.case_zip is None:
+            raise TestCaseNotFound(self.problem.problem_id)
+        DispatchQueue().push(self.id)
+        self.logger.debug(f'{self} is queued')
+        return True
+
+    def dispatch_state(self) -> Optional[Dict[str, Any]]:
+        '''
+        get current dispatch state of this submission
+        '''
+        return DispatchQueue().state(self.id)
 
     def send(self) -> bool:
         '''
@@ -360,11 +624,10 @@ class Submission(MongoBase, engine=engine.Submission):
             'problem_id': self.problem_id,
             'language': self.language,
         }
-        judge_url = f'{tar.url}/submit/{self.id}'
         # send submission to snadbox for judgement
         self.logger.info(f'send {self} to {tar.name}')
-        resp = rq.post(
-            judge_url,
+        resp = SandboxClient(tar).submit(
+            self.id,
             data=post_data,
             files=files,
         )
@@ -394,28 +657,20 @@ class Submission(MongoBase, engine=engine.Submission):
                 del case['exitCode']
                 # convert status into integer
                 case['status'] = self.status2code.get(case['status'], -3)
+        # store stdout/stderr
+        outputs, archive = self._store_outputs(
+            [[{fd: case.pop(fd, None)
+               for fd in ('stdout', 'stderr')} for case in cases]
+             for cases in tasks])
         # process task
         for i, cases in enumerate(tasks):
-            # save stdout/stderr
-            fds = ['stdout', 'stderr']
             for j, case in enumerate(cases):
-                tf = NamedTemporaryFile(delete=False)
-                with ZipFile(tf, 'w') as zf:
-                    for fd in fds:
-                        content = case.pop(fd)
-                        if content is None:
-                            self.logger.error(
-                                f'key {fd} not in case result {self} {i:02d}{j:02d}'
-                            )
-                        zf.writestr(fd, content)
-                tf.seek(0)
-                case['output'] = tf
                 # convert dict to document
                 cases[j] = engine.CaseResult(
                     status=case['status'],
                     exec_time=case['execTime'],
                     memory_usage=case['memoryUsage'],
-                    output=case['output'],
+                    **outputs[i][j],
                 )
             status = max(c.status for c in cases)
             exec_time = max(c.exec_time for c in cases)
@@ -431,45 +686,214 @@ class Submission(MongoBase, engine=engine.Submission):
         status = max(t.status for t in tasks)
         exec_time = max(t.exec_time for t in tasks)
         memory_usage = max(t.memory_usage for t in tasks)
+        # remove outputs of last judgement
+        self.delete_output()
         self.update(
             score=sum(task.score for task in tasks),
             status=status,
             tasks=tasks,
             exec_time=exec_time,
             memory_usage=memory_usage,
+            output=archive,
         )
         self.reload()
+        # `last_send` is set right after `add` and again by rejudges, so
+        # old submissions being rejudged are not counted as days waiting
+        JUDGE_SECONDS.observe(
+            (datetime.now() - self.last_send).total_seconds())
         self.finish_judging()
         return True
 
+    def _store_outputs(self, outputs: List[List[Dict[str, Any]]]):
+        '''
+        encode stdout/stderr of cases. small outputs are compressed and
+        kept inline, others are zipped into one GridFS file per case or
+        packed into one file of this submission.
+
+        Args:
+            outputs: a 2-dim list of dict with keys 'stdout' and 'stderr'
+
+        Returns:
+            fields of each case result, and the packed file (None if
+            nothing is packed)
+        '''
+        config = self.config()
+        archive = SpooledTemporaryFile(max_size=config.OUTPUT_SPOOL_SIZE)
+        archive_zf = ZipFile(archive, 'w')
+        packed = False
+        ret = []
+        for i, cases in enumerate(outputs):
+            ret.append([])
+            for j, case in enumerate(cases):
+                prefix = self.output_prefix(i, j)
+                case = self._output_bytes(case, prefix)
+                fields = {'output': None, 'inline_output': None}
+                if sum(map(len, case.values())) < config.INLINE_OUTPUT_SIZE:
+                    fields['inline_output'] = self._encode_inline_output(case)
+                elif config.PACK_OUTPUT:
+                    self._write_output(archive_zf, prefix, case)
+                    packed = True
+                else:
+                    output = SpooledTemporaryFile(
+                        max_size=config.OUTPUT_SPOOL_SIZE)
+                    with ZipFile(output, 'w') as zf:
+                        self._write_output(zf, '', case)
+                    output.seek(0)
+                    fields['output'] = output
+                ret[-1].append(fields)
+        archive_zf.close()
+        if not packed:
+            archive.close()
+            return ret, None
+        # outputs of all cases cost only one GridFS write
+        archive.seek(0)
+        proxy = engine.Submission.output.get_proxy_obj(
+            key='output',
+            instance=self.obj,
+        )
+        proxy.put(archive)
+        archive.close()
+        return ret, proxy
+
+    def _output_bytes(self, case: Dict[str, Any], prefix: str):
+        ret = {}
+        for fd in ('stdout', 'stderr'):
+            content = case.get(fd)
+            if content is None:
+                self.logger.error(
+                    f'key {fd} not in case result {self} {prefix}')
+                content = ''
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+            ret[fd] = content
+        return ret
+
+    def _write_output(self, zf: ZipFile, prefix: str, case: Dict[str, bytes]):
+        '''
+        write stdout/stderr of a case result into zip file
+        '''
+        for fd, content in case.items():
+            # compressing small outputs costs more than it saves
+            if len(content) < self.config().OUTPUT_COMPRESS_SIZE:
+                compress_type = ZIP_STORED
+            else:
+                compress_type = ZIP_DEFLATED
+            zf.writestr(f'{prefix}{fd}', content, compress_type)
+
+    @staticmethod
+    def _encode_inline_output(case: Dict[str, bytes]) -> bytes:
+        stdout, stderr = case['stdout'], case['stderr']
+        return zlib.compress(struct.pack('<I', len(stdout)) + stdout + stderr)
+
+    @staticmethod
+    def _decode_inline_output(data: bytes) -> Dict[str, bytes]:
+        data = zlib.decompress(data)
+        size, = struct.unpack_from('<I', data)
+        return {
+            'stdout': data[4:4 + size],
+            'stderr': data[4 + size:],
+        }
+
+    @classmethod
+    def _decode_pool(cls) -> ThreadPoolExecutor:
+        if cls._output_pool is None:
+            cls._output_pool = ThreadPoolExecutor(
+                max_workers=cls.config().OUTPUT_DECODE_WORKERS)
+        return cls._output_pool
+
+    def _read_outputs(
+        self,
+        limit: Optional[int] = None,
+    ) -> List[List[Optional[Dict[str, Tuple[bytes, int]]]]]:
+        '''
+        read stdout/stderr of all cases. small output files are fetched
+        by one query, large ones are streamed from GridFS, and they are
+        decoded concurrently.
+
+        Args:
+            limit: read at most `limit` bytes of each output
+
+        Returns:
+            a 2-dim list of dict maps 'stdout'/'stderr' to the content
+            and its full size, the output of a case is None if it has
+            not been stored
+        '''
+        grid_ids = self.output_file_ids()
+        files = read_grid_files(
+            grid_ids,
+            max_size=self.config().OUTPUT_BATCH_READ_SIZE,
+        )
+        archive = None
+        if self.obj.output:
+            data = files.get(self.obj.output.grid_id)
+            archive = ZipFile(
+                self.obj.output if data is None else io.BytesIO(data))
+
+        def decode(args):
+            i, j, case = args
+            output = self._open_case_output(i, j, case, archive, files)
+            if output is None:
+                return None
+            ret = {}
+            for fd, (f, size) in output.items():
+                with f:
+                    ret[fd] = (f.read(-1 if limit is None else limit), size)
+            return ret
+
+        cases = [(i, j, case) for i, task in enumerate(self.tasks)
+                 for j, case in enumerate(task.cases)]
+        if len(grid_ids) > 1 and len(cases) > 1:
+            outputs = [*self._decode_pool().map(decode, cases)]
+        else:
+            outputs = [*map(decode, cases)]
+        if archive is not None:
+            archive.close()
+        ret = [[] for _ in self.tasks]
+        for (i, _, _), output in zip(cases, outputs):
+            ret[i].append(output)
+        return ret
+
+    def inline_outputs(self) -> bool:
+        '''
+        move small outputs stored in GridFS into submission document
+
+        Returns:
+            whether any output is moved
+        '''
+        limit = self.config().INLINE_OUTPUT_SIZE
+        outputs = self._read_outputs()
+        movable = any(
+            output is not None and case.inline_output is None and sum(
+                size for _, size in output.values()) < limit
+            for task, cases in zip(self.tasks, outputs)
+            for case, output in zip(task.cases, cases))
+        if not movable:
+            return False
+        grid_ids = self.output_file_ids()
+        fields, archive = self._store_outputs(
+            [[{fd: data
+               for fd, (data, _) in (output or {}).items()}
+              for output in cases] for cases in outputs])
+        for i, task in enumerate(self.tasks):
+            for j, case in enumerate(task.cases):
+                task.cases[j] = engine.CaseResult(
+                    status=case.status,
+                    exec_time=case.exec_time,
+                    memory_usage=case.memory_usage,
+                    **fields[i][j],
+                )
+        self.update(tasks=self.tasks, output=archive)
+        delete_grid_files(grid_ids)
+        self.reload()
+        return True
+
     def finish_judging(self):
         # update user's submission
         User(self.username).add_submission(self)
-        # update homework data
-        for homework in self.problem.homeworks:
-
-            stat = homework.student_status[self.username][str(self.problem_id)]
-            if self.handwritten:
-                continue
-            if 'rawScore' not in stat:
-                stat['rawScore'] = 0
-            stat['submissionIds'].append(self.id)
-            # handwritten problem will only keep the last submission
-            if self.handwritten:
-                stat['submissionIds'] = stat['submissionIds'][-1:]
-            # if the homework is overdue, do the penalty
-            if self.timestamp > homework.duration.end and not self.handwritten and homework.penalty is not None:
-                self.score, stat['rawScore'] = Homework(homework).do_penalty(
-                    self, stat)
-            else:
-                if self.score > stat['rawScore']:
-                    stat['rawScore'] = self.score
-            # update high score / handwritten problem is judged by teacher
-            if self.score >= stat['score'] or self.handwritten:
-                stat['score'] = self.score
-                stat['problemStatus'] = self.status
-
-            homework.save()
+        # update homework data, handwritten problem is judged by teacher
+        if not self.handwritten:
+            for homework in self.problem.homeworks:
+                Homework(homework).add_submission(self)
         key = Problem(self.problem).high_score_key(user=self.user)
         RedisCache().delete(key)
 
@@ -515,7 +939,18 @@ class Submission(MongoBase, engine=engine.Submission):
         after: Optional[datetime] = None,
         sort_by: Optional[str] = None,
         with_count: bool = False,
+        only: Optional[Iterable[str]] = None,
+        cursor: Optional[str] = None,
     ):
+        '''
+        query submissions
+
+        Args:
+            only: only load these fields, e.g. `LIST_FIELDS`
+            cursor: get the page next to the submission in cursor
+                instead of skipping `offset` submissions, see
+                `encode_cursor`
+        '''
         if before is not None and after is not None:
             if after > before:
                 raise ValueError('the query period is empty')
@@ -525,6 +960,12 @@ class Submission(MongoBase, engine=engine.Submission):
             raise ValueError(f'count must >=-1!')
         if sort_by is not None and sort_by not in ['runTime', 'memoryUsage']:
             raise ValueError(f'can only sort by runTime or memoryUsage')
+        if cursor is not None:
+            if sort_by is not None:
+                raise ValueError('cursor can only be used with default order')
+            if offset != 0:
+                raise ValueError('cannot use both offset and cursor')
+            cursor = cls.decode_cursor(cursor)
         wont_have_results = False
         if isinstance(problem, int):
             problem = Problem(problem).obj
@@ -570,20 +1011,135 @@ class Submission(MongoBase, engine=engine.Submission):
             'timestamp__gte': after,
         }
         q = {k: v for k, v in q.items() if v is not None}
-        # sort by upload time
-        submissions = engine.Submission.objects(
-            **q).order_by(sort_by if sort_by is not None else '-timestamp')
-        submission_count = submissions.count()
+        submissions = engine.Submission.objects(**q)
+        if only is not None:
+            submissions = submissions.only(*only)
+        if with_count:
+            submission_count = cls._count(submissions)
+        if sort_by is not None:
+            submissions = submissions.order_by(sort_by)
+        # sort by upload time, the id breaks ties
+        elif cursor is None:
+            submissions = submissions.order_by('-timestamp', '-id')
+        else:
+            # the position is found by index instead of skipping
+            timestamp, _id, direction = cursor
+            op, order = ('lt', '-') if direction == 'next' else ('gt', '')
+            submissions = submissions.filter(
+                engine.Q(**{f'timestamp__{op}': timestamp})
+                | engine.Q(timestamp=timestamp, **{f'id__{op}': _id}))
+            submissions = submissions.order_by(
+                f'{order}timestamp',
+                f'{order}id',
+            )
         # truncate
         if count == -1:
             submissions = submissions[offset:]
         else:
             submissions = submissions[offset:offset + count]
         submissions = list(cls(s) for s in submissions)
+        # keep the newest first
+        if cursor is not None and cursor[2] == 'prev':
+            submissions.reverse()
         if with_count:
             return submissions, submission_count
         return submissions
 
+    @classmethod
+    def _count(cls, submissions) -> int:
+        '''
+        count the query result, the value is cached for a while since
+        counting a large collection is slow
+        '''
+        query = json.dumps(submissions._query, sort_keys=True, default=str)
+        key = f'SUBMISSION_COUNT_{hashlib.sha1(query.encode()).hexdigest()}'
+        cache = RedisCache()
+        if (v := cache.get(key)) is not None:
+            return int(v)
+        ret = submissions.count()
+        cache.set(key, ret, cls.config().COUNT_CACHE_TTL)
+        return ret
+
+    @staticmethod
+    def encode_cursor(submission: Submission, direction: str = 'next') -> str:
+        '''
+        make an opaque cursor pointing to a submission
+
+        Args:
+            direction: 'next' to get older submissions, or 'prev' to
+                get newer ones
+        '''
+        payload = json.dumps({
+            'timestamp': submission.timestamp.isoformat(),
+            'id': submission.id,
+            'direction': direction,
+        })
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId, str]:
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            timestamp = datetime.fromisoformat(payload['timestamp'])
+            _id = ObjectId(payload['id'])
+            direction = payload['direction']
+        except (ValueError, TypeError, KeyError, InvalidId):
+            raise ValueError('invalid cursor')
+        if direction not in ('next', 'prev'):
+            raise ValueError('invalid cursor')
+        return timestamp, _id, direction
+
+    @classmethod
+    def filter_page(
+        cls,
+        count: int = -1,
+        cursor: Optional[str] = None,
+        with_count: bool = False,
+        **ks,
+    ) -> Tuple[List[Submission], Optional[int], Optional[str], Optional[str]]:
+        '''
+        get a page of submissions and cursors of its adjacent pages
+
+        Returns:
+            submissions, the total count (None unless `with_count` is
+            set), cursors of next and previous page (None if there is no
+            such page, or the page is not in default order)
+        '''
+        if count < -1:
+            raise ValueError(f'count must >=-1!')
+        direction = cls.decode_cursor(cursor)[2] if cursor else 'next'
+        # take one more to know whether there is a next page
+        submissions = cls.filter(
+            count=count if count == -1 else count + 1,
+            cursor=cursor,
+            with_count=with_count,
+            **ks,
+        )
+        total = None
+        if with_count:
+            submissions, total = submissions
+        has_more = count != -1 and len(submissions) > count
+        if has_more and direction == 'next':
+            submissions = submissions[:-1]
+        elif has_more:
+            submissions = submissions[1:]
+        # cursors only encode positions in the default order
+        if len(submissions) == 0 or ks.get('sort_by') is not None:
+            return submissions, total, None, None
+        at_start = cursor is None and ks.get('offset', 0) == 0
+        if direction == 'next':
+            next_cursor = has_more
+            prev_cursor = not at_start
+        else:
+            next_cursor = True
+            prev_cursor = has_more
+        return (
+            submissions,
+            total,
+            cls.encode_cursor(submissions[-1]) if next_cursor else None,
+            cls.encode_cursor(submissions[0], 'prev') if prev_cursor else None,
+        )
+
     @classmethod
     def add(
         cls,
@@ -617,6 +1173,7 @@ class Submission(MongoBase, engine=engine.Submission):
             timestamp=timestamp,
         )
         submission.save()
+        cls.apply_change(None, cls.snapshot(submission))
         return cls(submission.id)
 
     @classmethod
@@ -648,6 +1205,54 @@ class Submission(MongoBase, engine=engine.Submission):
         ret = ret.to_dict()
         return ret
 
+    def to_list_dict(
+        self,
+        user_info: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        '''
+        serialize a submission loaded with `LIST_FIELDS` for list page
+
+        Args:
+            user_info: the submitter's info if it has been loaded
+        '''
+        ret = self.to_mongo()
+        return {
+            'user': self.user.info if user_info is None else user_info,
+            'languageType': ret['languageType'],
+            'timestamp': self.timestamp.timestamp(),
+            'status': ret['status'],
+            'score': ret['score'],
+            'runTime': ret['runTime'],
+            'memoryUsage': ret['memoryUsage'],
+            'lastSend': self.last_send.timestamp(),
+            'problemId': ret['problem'],
+            'submissionId': self.id,
+        }
+
+    @classmethod
+    def to_list_dicts(
+        cls,
+        submissions: List[Submission],
+    ) -> List[Dict[str, Any]]:
+        '''
+        serialize submissions for list page, submitters are loaded
+        by one query instead of one for each submission
+        '''
+        # the references are stored as username, read them without
+        # dereferencing
+        usernames = [s.to_mongo()['user'] for s in submissions]
+        users = engine.User.objects(username__in=[*{*usernames}]).only(
+            'username',
+            'profile.displayed_name',
+            'md5',
+            'role',
+        )
+        infos = {u.username: u.info for u in users}
+        return [
+            s.to_list_dict(user_info=infos.get(username))
+            for s, username in zip(submissions, usernames)
+        ]
+
     def _to_dict(self) -> SON:
         ret = self.to_mongo()
         _ret = {
@@ -663,6 +1268,7 @@ class Submission(MongoBase, engine=engine.Submission):
             'code',
             'comment',
             'tasks',
+            'output',
         ]
         # delete old keys
         for o in old:
@@ -678,24 +1284,48 @@ class Submission(MongoBase, engine=engine.Submission):
         tasks = [task.to_mongo() for task in self.tasks]
         for task in tasks:
             for case in task['cases']:
-                del case['output']
+                case.pop('output', None)
+                case.pop('inlineOutput', None)
         return [task.to_dict() for task in tasks]
 
+    @staticmethod
+    def _decode_preview(data: bytes, size: int) -> str:
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError as e:
+            # only drop the last character cut by the preview size, a
+            # utf-8 character has at most 4 bytes
+            if len(data) < size and e.start >= len(data) - 3:
+                return data[:e.start].decode('utf-8')
+            raise
+
     def get_detailed_result(self) -> List[Dict[str, Any]]:
         '''
         Get all results (including stdout/stderr) of this submission
         '''
+        # the result won't change until next judgement
+        key = f'SUBMISSION_DETAIL_{self.id}_{self.last_send.timestamp()}'
+        judged = self.status >= 0
+        cache = RedisCache()
+        if judged and (v := cache.get(key)) is not None:
+            return json.loads(v)
         tasks = [task.to_mongo() for task in self.tasks]
-        for task in tasks:
-            for case in task.cases:
-                # extract zip file
-                output = case.pop('output', None)
-                if output is not None:
-                    output = engine.GridFSProxy(output)
-                    with ZipFile(output) as zf:
-                        case['stdout'] = zf.read('stdout').decode('utf-8')
-                        case['stderr'] = zf.read('stderr').decode('utf-8')
-        return [task.to_dict() for task in tasks]
+        # only the beginning of outputs are returned, the rest can be
+        # fetched by `open_output`
+        outputs = self._read_outputs(limit=self.config().OUTPUT_PREVIEW_SIZE)
+        for task, task_outputs in zip(tasks, outputs):
+            for case, output in zip(task['cases'], task_outputs):
+                case.pop('output', None)
+                case.pop('inlineOutput', None)
+                if output is None:
+                    continue
+                for fd, (data, size) in output.items():
+                    case[fd] = self._decode_preview(data, size)
+                    case[f'{fd}Size'] = size
+        ret = [task.to_dict() for task in tasks]
+        if judged:
+            cache.set(key, json.dumps(ret), self.config().DETAIL_CACHE_TTL)
+        return ret
 
     def get_code(self, path: str, binary=False) -> Union[str, bytes]:
         # read file
@@ -1,4 +1,5 @@
 from __future__ import annotations
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from hmac import compare_digest
 from typing import Any, Dict, List, TYPE_CHECKING, Optional
@@ -8,9 +9,12 @@ from .utils import *
 from .base import *
 
 import hashlib
+import json
 import jwt
 import os
 import re
+import threading
+import time
 
 if TYPE_CHECKING:
     from .course import Course
@@ -23,6 +27,114 @@ JWT_SECRET = os.environ.get('JWT_SECRET', 'SuperSecretString')
 
 
 class User(MongoBase, engine=engine.User):
+    # fields needed to verify a logged in user, they are cached so that
+    # authentication doesn't read the database
+    SNAPSHOT_FIELDS = ('username', 'user_id', 'role', 'active')
+    # redis keeps snapshots shared by processes, and each process keeps
+    # recent ones in memory for a shorter time, since they can only be
+    # invalidated in the process that changes the user
+    SNAPSHOT_TTL = int(os.getenv('USER_SNAPSHOT_TTL', '60'))
+    LOCAL_SNAPSHOT_TTL = int(os.getenv('USER_LOCAL_SNAPSHOT_TTL', '5'))
+    # least recently used ones are dropped first
+    LOCAL_SNAPSHOT_SIZE = int(os.getenv('USER_LOCAL_SNAPSHOT_SIZE', '1024'))
+    _snapshots: OrderedDict[str, Any] = OrderedDict()
+    _snapshots_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        snapshot = self.__dict__.get('_snapshot')
+        # load the document when a field not in snapshot is accessed
+        if snapshot is not None and 'obj' not in self.__dict__:
+            if name == 'obj':
+                self.obj = self.engine.objects(pk=snapshot['username']).first() \
+                    or self.engine(username=snapshot['username'])
+                return self.obj
+            if name == 'pk':
+                return snapshot['username']
+            if name in snapshot:
+                return snapshot[name]
+        return super().__getattr__(name)
+
+    def __bool__(self):
+        # a snapshot is only taken from an existing user
+        if '_snapshot' in self.__dict__ and 'obj' not in self.__dict__:
+            return True
+        return super().__bool__()
+
+    @classmethod
+    def snapshot_key(cls, username: str) -> str:
+        return f'USER_SNAPSHOT_{username}'
+
+    @classmethod
+    def get_cached(cls, username: str) -> User:
+        '''
+        get a user whose snapshot fields are served from cache, other fields
+        are loaded from database when they are accessed
+        '''
+        now = time.monotonic()
+        with cls._snapshots_lock:
+            cached = cls._snapshots.get(username)
+            if cached is not None:
+                cls._snapshots.move_to_end(username)
+        if cached is not None and cached[0] > now:
+            snapshot = cached[1]
+        elif cls.SNAPSHOT_TTL <= 0:
+            return cls(username)
+        else:
+            key = cls.snapshot_key(username)
+            cache = RedisCache()
+            snapshot = cache.get(key)
+            if snapshot is not None:
+                snapshot = json.loads(snapshot)
+            else:
+                user = cls(username)
+                if not user:
+                    return user
+                snapshot = {k: getattr(user, k) for k in cls.SNAPSHOT_FIELDS}
+                cache.set(key, json.dumps(snapshot), ex=cls.SNAPSHOT_TTL)
+            with cls._snapshots_lock:
+                cls._snapshots[username] = (
+                    now + cls.LOCAL_SNAPSHOT_TTL,
+                    snapshot,
+                )
+                cls._snapshots.move_to_end(username)
+                while len(cls._snapshots) > cls.LOCAL_SNAPSHOT_SIZE:
+                    cls._snapshots.popitem(last=False)
+        user = object.__new__(cls)
+        user._snapshot = snapshot
+        return user
+
+    @classmethod
+    def invalidate_snapshot(cls, username: str):
+        with cls._snapshots_lock:
+            cls._snapshots.pop(username, None)
+        RedisCache().delete(cls.snapshot_key(username))
+
+    @classmethod
+    def on_change(cls, sender, document, **ks):
+        '''
+        drop the snapshot of a saved or deleted user
+        '''
+        cls.invalidate_snapshot(document.pk)
+
+    @classmethod
+    def on_update(cls, sender, queryset, **ks):
+        '''
+        drop snapshots of users going to be updated
+        '''
+        pk = queryset._query.get('_id')
+        if pk is not None and not isinstance(pk, dict):
+            usernames = [pk]
+        else:
+            usernames = queryset.clone().scalar('username')
+        for username in usernames:
+            cls.invalidate_snapshot(username)
+
+    def update(self, **ks):
+        ret = super().update(**ks)
+        # it's dropped before updating, but a read in between may have
+        # cached the old one again
+        self.invalidate_snapshot(self.username)
+        return ret
 
     @classmethod
     def signup(cls, username, password, email):
@@ -222,6 +334,11 @@ class User(MongoBase, engine=engine.User):
         self.save()
 
 
+engine.signals.post_save.connect(User.on_change, sender=engine.User)
+engine.signals.post_delete.connect(User.on_change, sender=engine.User)
+engine.pre_update.connect(User.on_update, sender=engine.User)
+
+
 def jwt_decode(token):
     try:
         json = jwt.decode(
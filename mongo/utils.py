@@ -5,6 +5,7 @@ import redis
 from functools import wraps
 from typing import Dict, Optional, Any, TYPE_CHECKING
 from . import engine
+from .profiler import instrument_redis
 
 if TYPE_CHECKING:
     from .user import User
@@ -15,6 +16,9 @@ __all__ = (
     'perm',
     'RedisCache',
     'doc_required',
+    'delete_grid_files',
+    'read_grid_files',
+    'sync_indexes',
 )
 
 
@@ -66,6 +70,8 @@ class Cache(abc.ABC):
 
 class RedisCache(Cache):
     POOL = None
+    # shared in-memory server used when no redis is configured
+    FAKE_SERVER = None
 
     def __new__(cls) -> Any:
         if cls.POOL is None:
@@ -87,9 +93,13 @@ class RedisCache(Cache):
         if self._client is None:
             if self.PORT is None:
                 import fakeredis
-                self._client = fakeredis.FakeStrictRedis()
+                if RedisCache.FAKE_SERVER is None:
+                    RedisCache.FAKE_SERVER = fakeredis.FakeServer()
+                self._client = fakeredis.FakeStrictRedis(
+                    server=RedisCache.FAKE_SERVER)
             else:
                 self._client = redis.Redis(connection_pool=self.POOL)
+            instrument_redis(self._client)
         return self._client
 
     def exists(self, key: str) -> bool:
@@ -166,3 +176,65 @@ def doc_required(
 
 def drop_none(d: Dict):
     return {k: v for k, v in d.items() if v is not None}
+
+
+def delete_grid_files(grid_ids, collection: str = 'fs'):
+    '''
+    delete GridFS files and their chunks in batch
+    '''
+    grid_ids = [*grid_ids]
+    if len(grid_ids) == 0:
+        return
+    db = engine.get_db()
+    db[f'{collection}.files'].delete_many({'_id': {'$in': grid_ids}})
+    db[f'{collection}.chunks'].delete_many({'files_id': {'$in': grid_ids}})
+
+
+def read_grid_files(
+    grid_ids,
+    collection: str = 'fs',
+    max_size: Optional[int] = None,
+) -> Dict[Any, bytes]:
+    '''
+    read GridFS files with one query of files and one of chunks, files
+    which don't exist or are larger than `max_size` are not included in
+    the result
+    '''
+    grid_ids = [*grid_ids]
+    if len(grid_ids) == 0:
+        return {}
+    db = engine.get_db()
+    query = {'_id': {'$in': grid_ids}}
+    if max_size is not None:
+        query['length'] = {'$lte': max_size}
+    files = db[f'{collection}.files'].find(query, {'_id': 1})
+    ret = {f['_id']: [] for f in files}
+    if len(ret) == 0:
+        return {}
+    query = {'files_id': {'$in': [*ret]}}
+    projection = {'files_id': 1, 'data': 1}
+    chunks = db[f'{collection}.chunks'].find(query, projection)
+    chunks = chunks.sort([('files_id', 1), ('n', 1)])
+    for chunk in chunks:
+        ret[chunk['files_id']].append(chunk['data'])
+    return {k: b''.join(v) for k, v in ret.items()}
+
+
+def sync_indexes(document, drop_unused: bool = False) -> Dict[str, Any]:
+    '''
+    build indexes defined in the document's meta in background, and
+    drop the indexes which are no longer defined if `drop_unused`
+
+    Returns:
+        the missing and extra indexes before syncing
+    '''
+    diff = document.compare_indexes()
+    # the default index is created with the collection
+    diff['missing'] = [i for i in diff['missing'] if i != [('_id', 1)]]
+    document.ensure_indexes()
+    if drop_unused:
+        collection = document._get_collection()
+        for name, info in collection.index_information().items():
+            if [*map(tuple, info['key'])] in diff['extra']:
+                collection.drop_index(name)
+    return diff
@@ -2,6 +2,8 @@ from typing import Dict, List
 from flask import Flask
 from mongo import *
 from mongo import engine
+from mongo.metrics import REGISTRY
+from mongo.utils import RedisCache
 import mongomock.gridfs
 
 import pytest
@@ -15,6 +17,30 @@ from tests.test_problem import get_file
 from tests import utils
 
 
+@pytest.fixture(autouse=True)
+def flush_redis():
+    # the fake redis server is shared by the whole process
+    RedisCache().client.flushall()
+    User._snapshots.clear()
+    REGISTRY.clear()
+
+
+@pytest.fixture
+def db_reads(monkeypatch):
+    '''
+    names of collections read by `find`, in order
+    '''
+    reads = []
+    find = mongomock.Collection.find
+
+    def counted_find(collection, *args, **ks):
+        reads.append(collection.name)
+        return find(collection, *args, **ks)
+
+    monkeypatch.setattr(mongomock.Collection, 'find', counted_find)
+    return reads
+
+
 @pytest.fixture
 def app(tmp_path):
     from app import app as flask_app
@@ -6,6 +6,7 @@ import pytest
 import secrets
 from mongo import *
 from mongo import engine
+from tests import utils
 
 
 class TestSignup:
@@ -456,3 +457,71 @@ class TestBatchSignup:
         )
         assert rv.status_code == 400, rv.get_json()
         assert 'input' in rv.get_json()['message']
+
+
+class TestUserSnapshot:
+
+    def test_authenticate_without_reading_db(self, app, db_reads):
+        client = app.test_client()
+        user = utils.user.create_user()
+        client.set_cookie('test.test', 'piann', user.secret)
+        rv = client.get('/test/')
+        assert rv.status_code == 200, rv.get_json()
+        db_reads.clear()
+        for _ in range(3):
+            rv = client.get('/test/')
+            assert rv.status_code == 200, rv.get_json()
+        assert 'user' not in db_reads
+
+    def test_fields_not_in_snapshot_are_loaded(self, app):
+        user = utils.user.create_user()
+        cached = User.get_cached(user.username)
+        assert cached.role == user.role
+        assert cached.email == user.email
+        assert cached == user
+
+    def test_change_password_invalidates_snapshot(self, app):
+        client = app.test_client()
+        user = utils.user.create_user()
+        client.set_cookie('test.test', 'piann', user.secret)
+        assert client.get('/test/').status_code == 200
+        user.change_password(secrets.token_hex())
+        rv = client.get('/test/')
+        assert rv.status_code == 403
+        assert rv.get_json()['message'] == 'Authorization Expired'
+
+    def test_role_change_invalidates_snapshot(self, app):
+        client = app.test_client()
+        user = utils.user.create_user(role=2)
+        client.set_cookie('test.test', 'piann', user.secret)
+        assert client.get('/test/role').status_code == 403
+        user.update(role=1)
+        assert client.get('/test/role').status_code == 200
+
+    @pytest.mark.parametrize('write', [
+        lambda user: user.obj.update(role=1),
+        lambda user: engine.User.objects(role=2).update(role=1),
+        lambda user: engine.User.objects(pk=user.username).update_one(role=1),
+        lambda user: setattr(user.obj, 'role', 1) or user.obj.save(),
+    ])
+    def test_writes_invalidate_snapshot(self, app, write):
+        user = utils.user.create_user(role=2)
+        assert User.get_cached(user.username).role == 2
+        write(user)
+        assert User.get_cached(user.username).role == 1
+
+    def test_delete_invalidates_snapshot(self, app):
+        user = utils.user.create_user()
+        assert User.get_cached(user.username)
+        user.obj.delete()
+        assert not User.get_cached(user.username)
+
+    def test_local_snapshots_are_bounded(self, app, monkeypatch):
+        monkeypatch.setattr(User, 'LOCAL_SNAPSHOT_SIZE', 2)
+        users = [utils.user.create_user() for _ in range(3)]
+        for user in users[:2]:
+            User.get_cached(user.username)
+        # the first one is used recently, the second one is dropped
+        User.get_cached(users[0].username)
+        User.get_cached(users[2].username)
+        assert [*User._snapshots] == [users[0].username, users[2].username]
@@ -0,0 +1,141 @@
+import pytest
+from mongo import (
+    Submission,
+    DispatchQueue,
+    Dispatcher,
+    JudgeQueueFullError,
+)
+from mongo.sandbox import SandboxRegistry
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def submission(app):
+    with app.app_context():
+        user = utils.user.create_user()
+        problem = utils.problem.create_problem()
+        yield utils.submission.create_submission(
+            user=user,
+            problem=problem,
+        )
+
+
+def test_submit_will_enqueue(submission: Submission):
+    state = submission.dispatch_state()
+    assert state['state'] == DispatchQueue.QUEUED
+    assert state['attempts'] == 0
+    assert len(DispatchQueue()) == 1
+
+
+def test_rejudge_will_enqueue_again(submission: Submission):
+    queue = DispatchQueue()
+    assert queue.pop() == [submission.id]
+    queue.ack(submission.id)
+    assert submission.rejudge()
+    assert submission.dispatch_state()['state'] == DispatchQueue.QUEUED
+    assert queue.pop() == [submission.id]
+
+
+def test_dispatch_success(submission: Submission, monkeypatch):
+    monkeypatch.setattr(Submission, 'send', lambda self: True)
+    assert Dispatcher().run_once() == 1
+    assert submission.dispatch_state()['state'] == DispatchQueue.SENT
+    assert len(DispatchQueue()) == 0
+
+
+def test_finished_state_expires(submission: Submission, monkeypatch):
+    queue = DispatchQueue()
+    key = queue.state_key(submission.id)
+    # kept while it's waiting
+    assert queue.client.ttl(key) == -1
+    monkeypatch.setattr(Submission, 'send', lambda self: True)
+    Dispatcher().run_once()
+    assert 0 < queue.client.ttl(key) <= DispatchQueue.STATE_TTL
+    # queued again by rejudge
+    queue.push(submission.id)
+    assert queue.client.ttl(key) == -1
+
+
+def test_dispatch_retry_when_judge_queue_full(
+    submission: Submission,
+    monkeypatch,
+):
+
+    def send(self):
+        raise JudgeQueueFullError
+
+    monkeypatch.setattr(Submission, 'send', send)
+    dispatcher = Dispatcher(backoff=0, max_attempts=3)
+    assert dispatcher.run_once() == 1
+    state = submission.dispatch_state()
+    assert state['state'] == DispatchQueue.RETRYING
+    assert state['attempts'] == 1
+    # retry until reach the max attempts
+    assert dispatcher.run_once() == 1
+    assert dispatcher.run_once() == 1
+    assert submission.dispatch_state()['state'] == DispatchQueue.FAILED
+    assert dispatcher.run_once() == 0
+
+
+def test_dispatch_retry_when_sandboxes_are_saturated(submission: Submission):
+    registry = SandboxRegistry()
+    for name in registry.instances:
+        registry.report(name, SandboxRegistry.MAX_LOAD)
+    assert Dispatcher(backoff=0).run_once() == 1
+    state = submission.dispatch_state()
+    assert state['state'] == DispatchQueue.RETRYING
+    assert state['reason'] == 'no available sandbox'
+
+
+def test_dispatch_fail_on_invalid_request(
+    submission: Submission,
+    monkeypatch,
+):
+
+    def send(self):
+        raise ValueError('invalid token')
+
+    monkeypatch.setattr(Submission, 'send', send)
+    Dispatcher().run_once()
+    state = submission.dispatch_state()
+    assert state['state'] == DispatchQueue.FAILED
+    assert state['reason'] == 'invalid token'
+
+
+def test_recover_processing_submissions(submission: Submission):
+    queue = DispatchQueue()
+    assert queue.pop() == [submission.id]
+    assert len(queue) == 0
+    # the worker crashed before ack
+    assert queue.recover() == 1
+    assert queue.pop() == [submission.id]
+
+
+def test_only_one_dispatcher_holds_the_lock():
+    first, second = Dispatcher(), Dispatcher()
+    assert first.acquire_lock('first')
+    assert not second.acquire_lock('second')
+    # only the owner can refresh or release it
+    assert not second.refresh_lock('second')
+    assert not second.release_lock('second')
+    assert first.refresh_lock('first')
+    assert first.release_lock('first')
+    assert second.acquire_lock('second')
+
+
+def test_lost_lock_stops_dispatcher(monkeypatch):
+    dispatcher = Dispatcher()
+    monkeypatch.setattr(Dispatcher, 'LOCK_TTL', 0.03)
+    monkeypatch.setattr(Dispatcher, 'refresh_sandboxes', lambda self: None)
+    # someone else takes over the lock
+    monkeypatch.setattr(Dispatcher, 'refresh_lock', lambda self, token: False)
+    with pytest.raises(RuntimeError):
+        dispatcher.run(interval=0.01)
@@ -0,0 +1,170 @@
+import json
+import pytest
+from mongo import EventChannel
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture(autouse=True)
+def short_heartbeat(monkeypatch):
+    monkeypatch.setattr(EventChannel, 'HEARTBEAT', 0.1)
+    monkeypatch.setattr(EventChannel, 'STREAM_TIMEOUT', 1)
+    # streams not closed by tests are released
+    monkeypatch.setattr(EventChannel, '_open_streams', 0)
+
+
+@pytest.fixture
+def context(app):
+    with app.app_context():
+        student = utils.user.create_user(role=2)
+        course = utils.course.create_course(students=[student])
+        problem = utils.problem.create_problem(
+            course=course,
+            owner=course.teacher,
+        )
+        yield {
+            'student': student,
+            'course': course,
+            'problem': problem,
+        }
+
+
+def open_stream(client, url):
+    rv = client.get(url, buffered=False)
+    assert rv.status_code == 200, rv.data
+    assert rv.mimetype == 'text/event-stream'
+    chunks = iter(rv.response)
+    # channels are subscribed after the first chunk
+    assert next(chunks).startswith(b':')
+    return chunks
+
+
+def read_events(chunks):
+    events = []
+    for chunk in chunks:
+        if chunk.startswith(b':'):
+            continue
+        lines = chunk.decode().strip().split('\n')
+        assert lines[0].startswith('event: ')
+        assert lines[1].startswith('data: ')
+        events.append((lines[0][7:], json.loads(lines[1][6:])))
+    return events
+
+
+def test_submission_verdicts(context, forge_client):
+    student = context['student']
+    client = forge_client(student.username)
+    chunks = open_stream(client, '/submission/events')
+    submission = utils.submission.create_submission(
+        user=student,
+        problem=context['problem'],
+        status=0,
+    )
+    events = read_events(chunks)
+    assert all(event == 'verdict' for event, _ in events)
+    # only judged, not submitted or pending
+    assert [data['status'] for _, data in events] == [0]
+    assert events[-1][1]['submissionId'] == submission.id
+    assert events[-1][1]['score'] == 100
+
+
+def test_students_only_get_own_verdicts(context, forge_client):
+    other = utils.user.create_user(role=2, course=context['course'])
+    client = forge_client(context['student'].username)
+    chunks = open_stream(
+        client,
+        f'/submission/events?username={other.username}',
+    )
+    utils.submission.create_submission(user=other, problem=context['problem'])
+    assert read_events(chunks) == []
+
+
+def test_scoreboard_deltas(context, forge_client):
+    course = context['course']
+    problem = context['problem']
+    client = forge_client(course.teacher.username)
+    chunks = open_stream(
+        client,
+        f'/course/{course.course_name}/scoreboard/events?pids={problem.id}',
+    )
+    # the teacher's submissions are not on the scoreboard
+    utils.submission.create_submission(user=course.teacher, problem=problem)
+    utils.submission.create_submission(
+        user=context['student'],
+        problem=problem,
+        score=50,
+    )
+    events = read_events(chunks)
+    assert all(event == 'scoreboard' for event, _ in events)
+    assert {data['username'] for _, data in events} == \
+        {context['student'].username}
+    assert events[-1][1]['score'] == 50
+
+
+@pytest.mark.parametrize('url', [
+    '/course/{}/scoreboard/events',
+    '/course/{}/scoreboard/events?pids=a',
+])
+def test_scoreboard_events_with_invalid_pids(context, forge_client, url):
+    course = context['course']
+    client = forge_client(course.teacher.username)
+    rv = client.get(url.format(course.course_name))
+    assert rv.status_code == 400
+
+
+def test_scoreboard_events_of_problem_not_in_course(context, forge_client):
+    course = context['course']
+    other = utils.problem.create_problem()
+    client = forge_client(course.teacher.username)
+    rv = client.get(f'/course/{course.course_name}/scoreboard/events'
+                    f'?pids={context["problem"].id},{other.id}')
+    assert rv.status_code == 400
+
+
+def test_user_streams_are_limited(context, forge_client, monkeypatch):
+    monkeypatch.setattr(EventChannel, 'MAX_USER_STREAMS', 2)
+    client = forge_client(context['student'].username)
+    streams = [
+        client.get('/submission/events', buffered=False) for _ in range(3)
+    ]
+    assert [rv.status_code for rv in streams] == [200, 200, 429]
+    # other users are not affected
+    other = utils.user.create_user(role=2, course=context['course'])
+    rv = forge_client(other.username).get(
+        '/submission/events',
+        buffered=False,
+    )
+    assert rv.status_code == 200
+    streams[0].close()
+    rv = forge_client(context['student'].username).get(
+        '/submission/events',
+        buffered=False,
+    )
+    assert rv.status_code == 200
+
+
+def test_process_streams_are_limited(context, forge_client, monkeypatch):
+    monkeypatch.setattr(EventChannel, 'MAX_STREAMS', 1)
+    client = forge_client(context['student'].username)
+    rv = client.get('/submission/events', buffered=False)
+    assert rv.status_code == 200
+    other = utils.user.create_user(role=2, course=context['course'])
+    client = forge_client(other.username)
+    assert client.get('/submission/events').status_code == 429
+    rv.close()
+    rv = client.get('/submission/events', buffered=False)
+    assert rv.status_code == 200
+
+
+def test_students_cannot_get_scoreboard_events(context, forge_client):
+    course = context['course']
+    client = forge_client(context['student'].username)
+    rv = client.get(f'/course/{course.course_name}/scoreboard/events?pids=1')
+    assert rv.status_code == 403
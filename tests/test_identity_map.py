@@ -0,0 +1,100 @@
+from mongo import *
+from mongo import engine
+from mongo.base import IdentityMap, identity_map
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+def test_fetch_once_per_request(app, db_reads):
+    user = utils.user.create_user()
+    with app.test_request_context():
+        db_reads.clear()
+        users = [User(user.username) for _ in range(3)]
+        assert db_reads.count('user') == 1
+        assert all(u.obj is users[0].obj for u in users)
+        documents = IdentityMap.current()
+        assert documents.misses == 1
+        assert documents.hits == 2
+    # a new request fetches it again
+    with app.test_request_context():
+        db_reads.clear()
+        User(user.username)
+        assert db_reads.count('user') == 1
+
+
+def test_no_map_outside_request(app, db_reads):
+    user = utils.user.create_user()
+    with app.app_context():
+        db_reads.clear()
+        User(user.username)
+        User(user.username)
+        assert db_reads.count('user') == 2
+        assert IdentityMap.current() is None
+
+
+def test_identity_map_for_workers(db_reads):
+    user = utils.user.create_user()
+    db_reads.clear()
+    with identity_map() as documents:
+        User(user.username)
+        User(user.username)
+        assert IdentityMap.current() is documents
+    assert db_reads.count('user') == 1
+    assert IdentityMap.current() is None
+
+
+def test_missing_document_is_not_kept(app):
+    with app.test_request_context():
+        assert not User('nobody')
+        user = utils.user.create_user(username='nobody')
+        assert User('nobody').email == user.email
+
+
+def test_refetch_after_update(app):
+    user = utils.user.create_user(role=2)
+    with app.test_request_context():
+        User(user.username).update(role=1)
+        assert User(user.username).role == 1
+
+
+def test_refetch_after_saving_other_copy(app):
+    user = utils.user.create_user()
+    with app.test_request_context():
+        assert User(user.username).bio == ''
+        document = engine.User.objects.get(username=user.username)
+        document.profile.bio = 'updated'
+        document.save()
+        assert User(user.username).bio == 'updated'
+
+
+def test_refetch_after_delete(app):
+    course = utils.course.create_course()
+    with app.test_request_context():
+        assert Course(course.course_name)
+        engine.Course.objects.get(course_name=course.course_name).delete()
+        assert not Course(course.course_name)
+
+
+def test_refetch_after_engine_update(app):
+    user = utils.user.create_user()
+    with app.test_request_context():
+        assert User(user.username).bio == ''
+        User(user.username).obj.update(profile__bio='by pk')
+        assert User(user.username).bio == 'by pk'
+        engine.User.objects(email=user.email).update(profile__bio='by query')
+        assert User(user.username).bio == 'by query'
+
+
+def test_map_per_request_in_app_context(app):
+    with app.app_context():
+        with app.test_request_context():
+            documents = IdentityMap.current()
+        with app.test_request_context():
+            assert IdentityMap.current() is not documents
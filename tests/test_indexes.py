@@ -0,0 +1,191 @@
+import pytest
+from datetime import datetime
+from mongo import engine
+from mongo.utils import sync_indexes
+from tests import utils
+
+
+def require_mongo(func):
+    '''
+    mongomock can't explain queries, run these against a real mongod by
+    `MONGO_HOST=mongodb://localhost pytest -m mongo`
+    '''
+    func = pytest.mark.skipif(
+        engine.MONGO_HOST.startswith('mongomock'),
+        reason='explain is not supported by mongomock',
+    )(func)
+    return pytest.mark.mongo(func)
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+def stages(plan):
+    '''
+    collect all stages in a query plan
+    '''
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for v in plan.values():
+            yield from stages(v)
+    elif isinstance(plan, list):
+        for v in plan:
+            yield from stages(v)
+
+
+def assert_use_index(plan):
+    plan_stages = {*stages(plan)}
+    assert 'COLLSCAN' not in plan_stages, plan
+    assert 'IXSCAN' in plan_stages, plan
+
+
+def find_index(document, equality, keys=()):
+    '''
+    find an index of `document` which starts with fields in `equality` (in
+    any order) followed by `keys`, the direction of `keys` can be reversed
+    as a whole
+    '''
+    keys = [*keys]
+    reverse = [(k, -d) for k, d in keys]
+    for spec in document._meta['index_specs']:
+        fields = spec['fields']
+        head = fields[:len(equality)]
+        if {k for k, _ in head} != {*equality}:
+            continue
+        tail = fields[len(equality):len(equality) + len(keys)]
+        if tail in (keys, reverse):
+            return fields
+    return None
+
+
+def test_sync_indexes():
+    collection = engine.Submission._get_collection()
+    collection.create_index([('_id', 1), ('user', 1)], name='old')
+    diff = sync_indexes(engine.Submission, drop_unused=True)
+    assert diff['extra'] == [[('_id', 1), ('user', 1)]]
+    assert 'old' not in collection.index_information()
+    assert engine.Submission.compare_indexes() == {
+        'missing': [],
+        'extra': [],
+    }
+
+
+@pytest.mark.parametrize(
+    'equality, keys',
+    [
+        # submission list
+        ((), [('timestamp', -1), ('_id', -1)]),
+        (('problem', ), [('timestamp', -1), ('_id', -1)]),
+        (('user', ), [('timestamp', -1), ('_id', -1)]),
+        # high score
+        (('user', 'problem'), [('score', -1)]),
+        # scoreboard, filter by time and group by score without documents
+        (('user', 'problem'), [('timestamp', 1), ('score', 1)]),
+        # ac user count
+        (('problem', 'status'), [('user', 1)]),
+    ])
+def test_submission_queries_have_index(equality, keys):
+    # the query plans are checked below if a real mongod is available
+    assert find_index(engine.Submission, equality, keys) is not None
+
+
+@pytest.fixture
+def submission_collection():
+    sync_indexes(engine.Submission)
+    return engine.Submission._get_collection()
+
+
+@require_mongo
+@pytest.mark.parametrize('query', [
+    {},
+    {
+        'problem': 1
+    },
+    {
+        'problem': {
+            '$in': [1, 2]
+        },
+        'timestamp': {
+            '$gte': datetime.now()
+        }
+    },
+    {
+        'user': 'student'
+    },
+    {
+        'user': 'student',
+        'status': 0
+    },
+])
+def test_submission_list_use_index(submission_collection, query):
+    plan = engine.Submission.objects(__raw__=query).order_by(
+        '-timestamp',
+        '-id',
+    ).limit(10).explain()
+    assert_use_index(plan)
+
+
+@require_mongo
+def test_high_score_use_index(submission_collection):
+    plan = engine.Submission.objects(
+        user='student',
+        problem=1,
+    ).only('score').order_by('-score').limit(1).explain()
+    assert_use_index(plan)
+
+
+@require_mongo
+def test_scoreboard_use_index(submission_collection):
+    plan = engine.get_db().command(
+        'aggregate',
+        submission_collection.name,
+        pipeline=[
+            {
+                '$match': {
+                    'user': {
+                        '$in': ['student']
+                    },
+                    'problem': {
+                        '$in': [1, 2]
+                    },
+                    'timestamp': {
+                        '$gte': datetime.now()
+                    },
+                }
+            },
+            {
+                '$group': {
+                    '_id': {
+                        'user': '$user',
+                        'problem': '$problem'
+                    },
+                    'max': {
+                        '$max': '$score'
+                    },
+                }
+            },
+        ],
+        explain=True,
+    )
+    assert_use_index(plan)
+
+
+@require_mongo
+def test_ac_user_count_use_index(submission_collection):
+    plan = engine.get_db().command({
+        'explain': {
+            'distinct': submission_collection.name,
+            'key': 'user',
+            'query': {
+                'problem': 1,
+                'status': 0
+            },
+        },
+    })
+    assert_use_index(plan)
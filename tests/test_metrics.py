@@ -0,0 +1,164 @@
+import runpy
+import pytest
+from pathlib import Path
+from datetime import datetime, timedelta
+from mongo import DispatchQueue, EventChannel
+from mongo.metrics import Counter, Gauge, Histogram, Registry, REGISTRY
+from tests import utils
+from tests.test_submission_output import fake_results
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def registry():
+    return Registry(prefix='TEST_METRICS_', flush_interval=3600)
+
+
+def scrape(client):
+    rv = client.get('/health/metrics')
+    assert rv.status_code == 200
+    return rv.get_data(as_text=True).split('\n')
+
+
+def test_counter(registry):
+    counter = Counter('hits_total',
+                      'Hits.',
+                      labels=('path', ),
+                      registry=registry)
+    counter.inc(path='/a')
+    counter.inc(2, path='/a')
+    counter.inc(path='say "hi"')
+    lines = registry.render().split('\n')
+    assert '# TYPE hits_total counter' in lines
+    assert 'hits_total{path="/a"} 3' in lines
+    assert r'hits_total{path="say \"hi\""} 1' in lines
+
+
+def test_labels_are_checked(registry):
+    counter = Counter('hits_total',
+                      'Hits.',
+                      labels=('path', ),
+                      registry=registry)
+    with pytest.raises(ValueError):
+        counter.inc(status=200)
+    with pytest.raises(ValueError):
+        Counter('hits_total', 'Hits.', registry=registry)
+
+
+def test_histogram(registry):
+    histogram = Histogram(
+        'latency_seconds',
+        'Latency.',
+        buckets=(1, 0.1),
+        registry=registry,
+    )
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+    lines = registry.render().split('\n')
+    start = lines.index('# TYPE latency_seconds histogram') + 1
+    assert lines[start:start + 5] == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        'latency_seconds_sum 5.55',
+        'latency_seconds_count 3',
+    ]
+
+
+def test_workers_are_summed(registry):
+    # each worker process has its own registry sharing the redis hashes
+    other = Registry(prefix=registry.prefix, flush_interval=3600)
+    for r in (registry, other):
+        Counter('hits_total', 'Hits.', registry=r).inc()
+    # not flushed yet
+    assert 'hits_total 1' in other.render().split('\n')
+    assert 'hits_total 2' in registry.render().split('\n')
+
+
+def test_gauge(registry):
+    Gauge(
+        'size',
+        'Size.',
+        labels=('kind', ),
+        collect=lambda: [({
+            'kind': 'a'
+        }, 3)],
+        registry=registry,
+    )
+    assert 'size{kind="a"} 3' in registry.render().split('\n')
+
+
+def test_gunicorn_worker_flushes_on_exit():
+    REGISTRY.add('TEST_METRICS_hits_total', {'': 1})
+    config = runpy.run_path(Path(__file__).parents[1] / 'gunicorn.conf.py')
+    config['worker_exit'](None, None)
+    assert REGISTRY.client.hget('TEST_METRICS_hits_total', '') == b'1'
+
+
+def test_endpoint_metrics(app):
+    client = app.test_client()
+    for _ in range(2):
+        client.get('/health/livez')
+    client.get('/no/such/page')
+    lines = scrape(client)
+    series = 'endpoint="health_api.livez",method="GET"'
+    assert f'noj_http_request_duration_seconds_count{{{series}}} 2' in lines
+    assert f'noj_http_request_duration_seconds_bucket{{{series},le="+Inf"}} 2' \
+        in lines
+    assert f'noj_http_responses_total{{{series},status="200"}} 2' in lines
+    assert 'noj_http_responses_total{endpoint="unmatched",method="GET",' \
+        'status="404"} 1' in lines
+    assert any(
+        line.startswith('noj_http_response_size_bytes_sum'
+                        '{endpoint="health_api.livez"} ') for line in lines)
+
+
+def test_streamed_response_is_timed_until_closed(app, monkeypatch):
+    monkeypatch.setattr(EventChannel, 'HEARTBEAT', 0.1)
+    monkeypatch.setattr(EventChannel, 'STREAM_TIMEOUT', 0.3)
+    with app.app_context():
+        user = utils.user.create_user()
+    client = app.test_client()
+    client.set_cookie('test.test', 'piann', user.secret)
+    rv = client.get('/submission/events', buffered=False)
+    assert rv.status_code == 200
+    series = 'endpoint="submission_api.submission_events",method="GET"'
+    count = f'noj_http_request_duration_seconds_count{{{series}}} 1'
+    assert count not in scrape(client)
+    for _ in rv.response:
+        pass
+    rv.close()
+    lines = scrape(client)
+    assert count in lines
+    duration = next(line for line in lines if line.startswith(
+        f'noj_http_request_duration_seconds_sum{{{series}}}'))
+    assert float(duration.split()[-1]) >= 0.3
+
+
+def test_judge_metrics(app):
+    with app.app_context():
+        submission = utils.submission.create_submission(
+            user=utils.user.create_user(),
+            problem=utils.problem.create_problem(
+                test_case_info=utils.problem.create_test_case_info(
+                    language=0,
+                    task_len=1,
+                    case_count_range=(1, 1),
+                )),
+        )
+        submission.update(last_send=datetime.now() - timedelta(seconds=3))
+        submission.process_result(fake_results(submission))
+    DispatchQueue().push(['a', 'b'])
+    lines = scrape(app.test_client())
+    assert 'noj_judge_duration_seconds_count 1' in lines
+    assert 'noj_judge_duration_seconds_bucket{le="2"} 0' in lines
+    assert 'noj_judge_duration_seconds_bucket{le="5"} 1' in lines
+    assert 'noj_judge_queue_depth{state="queued"} 2' in lines
+    assert 'noj_judge_queue_depth{state="sending"} 0' in lines
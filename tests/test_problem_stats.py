@@ -1,8 +1,9 @@
 import math
+import statistics
 from random import randint, shuffle
 import pytest
-from mongo import course
-from mongo import User
+from mongo import course, engine
+from mongo import Dispatcher, User, ProblemStats, RejudgeJob, Submission
 from mongo.engine import Problem
 from tests.base_tester import BaseTester
 from tests.conftest import forge_client
@@ -333,6 +334,164 @@ def test_cached_highscore(context, forge_client, app):
         assert cached_data['scoreDistribution'] == [50]
 
 
+def test_score_distribution(context, forge_client, app):
+    problem = context['problem']
+    course = context['course']
+    # not sorted, the distribution is in the order of students
+    scores = [50, 0, 100, 35, 75]
+    students = [context['student']] + [
+        utils.user.create_user(role=2, course=course)
+        for _ in range(len(scores) - 1)
+    ]
+    with app.app_context():
+        for student, score in zip(students, scores):
+            utils.submission.create_submission(
+                problem=problem,
+                user=student,
+                status=0 if score == 100 else 1,
+                score=score,
+            )
+        client = forge_client(username=context['student'].username)
+        rv = client.get(f'/problem/{problem.id}/stats')
+        assert rv.status_code == 200, rv.data
+        data = rv.get_json()['data']
+        assert data['scoreDistribution'] == scores
+        assert data['average'] == 52
+        assert math.isclose(data['std'], statistics.pstdev(scores))
+        assert data['scorePercentiles'] == {
+            '25': 35,
+            '50': 50,
+            '75': 75,
+            '90': 90,
+        }
+        assert data['scoreHistogram'] == [1, 0, 0, 1, 0, 1, 0, 1, 0, 0, 1]
+
+
+def test_deleted_top_submission_is_skipped(context, forge_client, app):
+    problem = context['problem']
+    student = context['student']
+    with app.app_context():
+        submissions = [
+            utils.submission.create_submission(
+                problem=problem,
+                user=student,
+                status=0,
+                exec_time=v,
+            ) for v in (1, 2, 3)
+        ]
+        ProblemStats.get(problem.problem_id)
+        # removed without updating statistics
+        engine.Submission._get_collection().delete_one(
+            {'_id': submissions[0].obj.id})
+        client = forge_client(username=student.username)
+        rv = client.get(f'/problem/{problem.id}/stats')
+        assert rv.status_code == 200, rv.data
+        data = rv.get_json()['data']
+        assert [s['runTime'] for s in data['top10RunTime']] == [2, 3]
+        # top lists are refilled at next read
+        stats = ProblemStats.get(problem.problem_id)
+        assert stats.top_submission_ids('runTime') == \
+            [s.obj.id for s in submissions[1:]]
+
+
+def test_username_is_escaped_in_keys(context, app):
+    problem = context['problem']
+    student = context['student']
+    username = 'legacy.user$'
+    with app.app_context():
+        submission = utils.submission.create_submission(
+            problem=problem,
+            user=student,
+            status=1,
+            score=30,
+        )
+        # usernames like this were accepted by old versions
+        engine.Submission._get_collection().update_one(
+            {'_id': submission.obj.id},
+            {'$set': {
+                'user': username
+            }},
+        )
+        # rebuilt from submissions at next read
+        engine.ProblemStats.objects(pk=problem.problem_id).delete()
+        stats = ProblemStats.get(problem.problem_id)
+        assert stats.high_score(username) == 30
+        assert stats.high_score('legacy') == 0
+        submission = engine.Submission.objects.get(id=submission.obj.id)
+        old = Submission.snapshot(submission)
+        ProblemStats.apply(old, {**old, 'status': 0, 'score': 100})
+        stats = ProblemStats.get(problem.problem_id)
+        assert stats.high_score(username) == 100
+        assert stats.ac_user_count == 1
+        assert stats.tried_user_count == 1
+
+
+def normalized_stats(stats: ProblemStats):
+    return {
+        'statusCount': stats.get_status_count(),
+        'acUserCount': stats.ac_user_count,
+        'triedUserCount': stats.tried_user_count,
+        'highScores': {k: v
+                       for k, v in stats.high_scores.items() if v},
+        'topRunTime': stats.top_submission_ids('runTime'),
+        'topMemoryUsage': stats.top_submission_ids('memoryUsage'),
+    }
+
+
+def test_stats_are_updated_incrementally(context, app, monkeypatch):
+    problem = context['problem']
+    students = [
+        utils.user.create_user(role=2, course=context['course'])
+        for _ in range(3)
+    ]
+    with app.app_context():
+        for student in students:
+            utils.submission.create_submission(problem=problem, user=student)
+        ProblemStats.get(problem.problem_id)
+
+        def build(*args):
+            assert False, 'statistics should not be rebuilt'
+
+        monkeypatch.setattr(ProblemStats, 'build', build)
+        submissions = [
+            utils.submission.create_submission(
+                problem=problem,
+                user=students[i % 3],
+                status=0 if i < 12 else None,
+            ) for i in range(16)
+        ]
+        # turn back AC submissions in top lists
+        submissions[0].rejudge()
+        submissions[1].update(status=1, score=30)
+        Submission(submissions[2].id).delete()
+        stats = normalized_stats(ProblemStats.get(problem.problem_id))
+        monkeypatch.undo()
+        engine.ProblemStats.objects(pk=problem.problem_id).delete()
+        assert stats == normalized_stats(ProblemStats.get(problem.problem_id))
+
+
+def test_rejudge_job_updates_stats(context, app, monkeypatch):
+    problem = context['problem']
+    student = context['student']
+    with app.app_context():
+        utils.submission.create_submission(
+            problem=problem,
+            user=student,
+            status=0,
+        )
+        assert ProblemStats.get(problem.problem_id).ac_user_count == 1
+        job = RejudgeJob.create(
+            context['admin'].username,
+            problem_ids=[problem.problem_id],
+        )
+        job.run()
+        monkeypatch.setattr(Submission, 'send', lambda self: True)
+        Dispatcher().run_once()
+        stats = ProblemStats.get(problem.problem_id)
+        assert stats.ac_user_count == 0
+        assert stats.get_status_count() == {'-1': 1}
+
+
 # def test_performance(context, forge_client, app):
 #     problem = context['problem']
 #     course = context['course']
@@ -0,0 +1,107 @@
+import logging
+from types import SimpleNamespace
+from mongo import User
+from mongo.profiler import CommandListener, Profile, profile
+from mongo.utils import RedisCache
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+def test_profile_redis_commands():
+    client = RedisCache().client
+    with profile() as current:
+        client.set('a', 1)
+        client.get('a')
+        pipe = client.pipeline()
+        pipe.get('a')
+        pipe.get('b')
+        pipe.execute()
+    assert current.counts == {'mongo': 0, 'redis': 3}
+    assert {command
+            for _, _, command in current.slowest} == {
+                'SET',
+                'GET',
+                'pipeline (2)',
+            }
+    # nothing is recorded after finished
+    client.get('a')
+    assert current.count == 3
+
+
+def test_profile_mongo_commands():
+    listener = CommandListener()
+    event = SimpleNamespace(
+        command_name='find',
+        command={'find': 'user'},
+        connection_id=('localhost', 27017),
+        request_id=1,
+        duration_micros=1500,
+    )
+    # commands outside a profile are ignored
+    listener.started(event)
+    listener.succeeded(event)
+    with profile() as current:
+        listener.started(event)
+        listener.succeeded(event)
+    assert current.counts['mongo'] == 1
+    assert current.slowest == [(0.0015, 'mongo', 'find user')]
+
+
+def test_slowest_commands_are_kept():
+    current = Profile()
+    for i in range(Profile.SLOWEST + 3):
+        current.record('redis', f'GET {i}', i)
+    assert [command for _, _, command in current.slowest] == \
+        [f'GET {i}' for i in range(Profile.SLOWEST + 2, 2, -1)]
+
+
+def test_debug_headers(app):
+    app.debug = True
+    client = app.test_client()
+    user = utils.user.create_user()
+    client.set_cookie('test.test', 'piann', user.secret)
+    rv = client.get('/test/')
+    assert rv.status_code == 200
+    # the user snapshot is cached into redis
+    assert 'redis=2' in rv.headers['X-DB-Queries']
+    assert rv.headers['X-DB-Time'].endswith('ms')
+    assert 'GET' in rv.headers['X-DB-Slowest']
+
+
+def test_no_headers_without_debug(app):
+    rv = app.test_client().get('/health/livez')
+    assert 'X-DB-Queries' not in rv.headers
+
+
+def test_log_slow_request(app, monkeypatch, caplog):
+    monkeypatch.setattr(Profile, 'SLOW_REQUEST_QUERIES', 0)
+    client = app.test_client()
+    user = utils.user.create_user()
+    client.set_cookie('test.test', 'piann', user.secret)
+    with caplog.at_level(logging.WARNING):
+        client.get('/test/')
+    assert any(
+        'slow request [GET /test/]' in r.message and 'redis=2' in r.message
+        for r in caplog.records)
+
+
+def test_metrics(app):
+    client = app.test_client()
+    for _ in range(2):
+        client.get('/health/livez')
+    rv = client.get('/health/metrics')
+    assert rv.status_code == 200
+    assert rv.mimetype == 'text/plain'
+    lines = rv.get_data(as_text=True).split('\n')
+    assert 'noj_requests_total 2' in lines
+    assert 'noj_db_commands_total{backend="redis"} 0' in lines
+    assert any(
+        line.startswith('noj_db_seconds_total{backend="mongo"} ')
+        for line in lines)
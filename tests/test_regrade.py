@@ -0,0 +1,192 @@
+import pytest
+from datetime import datetime
+from mongo import (
+    Dispatcher,
+    Homework,
+    RegradeJob,
+    User,
+    engine,
+)
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def context(app):
+    now = int(datetime.now().timestamp())
+    with app.app_context():
+        course = utils.course.create_course(name='Test')
+        student = utils.user.create_user(course=course, role=2)
+        problem = utils.problem.create_problem(course=course)
+        homework = utils.homework.add_homework(
+            user=User('first_admin'),
+            course='Test',
+            penalty='score = score * 0',
+            problem_ids=[problem.id],
+            start=now - 86411,
+            end=now - 86410,
+            hw_name='test',
+            markdown='',
+            scoreboard_status=0,
+        )
+        submissions = []
+        # an in-time submission, then a late one with higher score
+        for score, timestamp in ((40, now - 86410.5), (80, None)):
+            submission = utils.submission.create_submission(
+                problem=problem,
+                user=student,
+                score=score,
+                status=1,
+                timestamp=timestamp,
+            )
+            submission.finish_judging()
+            submissions.append(submission)
+        yield {
+            'course': course,
+            'student': student,
+            'problem': problem,
+            'homework': Homework(homework),
+            'submissions': submissions,
+        }
+
+
+def get_status(context):
+    homework = Homework(context['homework'].id)
+    return homework.get_student_status(context['student'].username)[str(
+        context['problem'].id)]
+
+
+def test_regrade_without_change(context):
+    assert context['homework'].regrade() == []
+
+
+def test_regrade_with_new_penalty(context):
+    assert get_status(context)['score'] == 40
+    homework = context['homework']
+    homework.obj.update(penalty='score = score * 0.5')
+    homework.reload()
+    progress = []
+    changes = homework.regrade(
+        on_progress=lambda n, total: progress.append((n, total)))
+    assert progress[-1] == (2, 2)
+    assert len(changes) == 1
+    assert changes[0]['old']['score'] == 40
+    assert changes[0]['new']['score'] == 60
+    status = get_status(context)
+    assert status['score'] == 60
+    assert status['rawScore'] == 80
+    assert status['submissionIds'] == [s.id for s in context['submissions']]
+
+
+def test_regrade_with_new_deadline(context):
+    homework = context['homework']
+    homework.obj.update(duration__end=datetime.now())
+    homework.reload()
+    homework.regrade()
+    status = get_status(context)
+    assert status['score'] == 80
+    assert status['rawScore'] == 80
+
+
+def test_regrade_without_penalty(context, monkeypatch):
+    homework = context['homework']
+    # the field falls back to its default if it's set to None
+    monkeypatch.setattr(Homework, 'penalty', None, raising=False)
+    changes = homework.regrade()
+    assert len(changes) == 1
+    # late submissions are graded as in-time ones
+    assert changes[0]['new']['score'] == 80
+    assert changes[0]['new']['rawScore'] == 80
+    status = get_status(context)
+    assert status['score'] == 80
+    assert status['rawScore'] == 80
+    # same as judging them again
+    submission = context['submissions'][1]
+    engine.HomeworkStatus.objects(user=submission.username).update(
+        score=0,
+        problem_status=None,
+        submission_ids=[],
+        unset__raw_score=True,
+    )
+    for submission in context['submissions']:
+        submission.finish_judging()
+    assert homework.regrade() == []
+
+
+def test_dry_run(context):
+    homework = context['homework']
+    homework.obj.update(penalty='score = score * 0.5')
+    homework.reload()
+    changes = homework.regrade(dry_run=True)
+    assert changes[0]['new']['score'] == 60
+    assert get_status(context)['score'] == 40
+
+
+def test_regrade_after_updating_penalty(context, forge_client):
+    homework = context['homework']
+    client = forge_client('first_admin')
+    rv = client.put(
+        f'/homework/{homework.id}',
+        json={
+            'penalty': 'score = score * 0.5',
+            'problemIds': [context['problem'].id],
+        },
+    )
+    assert rv.status_code == 200, rv.get_json()
+    job_id = rv.get_json()['data']['regradeJobId']
+    rv = client.get(f'/homework/regrade/{job_id}')
+    # jobs are run by the dispatcher
+    assert rv.get_json()['data']['state'] == RegradeJob.PENDING
+    assert get_status(context)['score'] == 40
+    assert Dispatcher().run_jobs() == 1
+    rv = client.get(f'/homework/regrade/{job_id}')
+    assert rv.status_code == 200, rv.get_json()
+    assert rv.get_json()['data']['state'] == RegradeJob.DONE
+    assert rv.get_json()['data']['changed'] == 1
+    assert get_status(context)['score'] == 60
+
+
+def test_dry_run_api(context, forge_client):
+    homework = context['homework']
+    homework.obj.update(penalty='score = score * 0.5')
+    homework.reload()
+    client = forge_client('first_admin')
+    rv = client.post(f'/homework/{homework.id}/regrade', json={'dryRun': True})
+    assert rv.status_code == 200, rv.get_json()
+    job_id = rv.get_json()['data']['jobId']
+    Dispatcher().run_jobs()
+    rv = client.get(f'/homework/regrade/{job_id}')
+    data = rv.get_json()['data']
+    assert data['dryRun']
+    assert data['processed'] == data['total'] == 2
+    assert data['changes'][0]['new']['score'] == 60
+    assert get_status(context)['score'] == 40
+
+
+def test_recover_regrade_job(context):
+    homework = context['homework']
+    homework.obj.update(penalty='score = score * 0.5')
+    job = RegradeJob.create('first_admin', str(homework.id))
+    # the worker was killed while running it
+    assert RegradeJob.take().id == job.id
+    assert RegradeJob.take() is None
+    assert RegradeJob.recover() == 1
+    assert Dispatcher().run_jobs() == 1
+    progress = job.progress()
+    assert progress['state'] == RegradeJob.DONE
+    assert progress['started'] is not None
+    assert get_status(context)['score'] == 60
+
+
+def test_students_cannot_regrade(context, forge_client):
+    homework = context['homework']
+    client = forge_client(context['student'].username)
+    rv = client.post(f'/homework/{homework.id}/regrade', json={})
+    assert rv.status_code == 403
@@ -0,0 +1,228 @@
+import io
+import pytest
+from zipfile import ZipFile
+from mongo import (
+    engine,
+    Submission,
+    DispatchQueue,
+    Dispatcher,
+    RejudgeJob,
+)
+from mongo.submission import JudgeQueueFullError
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def problem(app):
+    with app.app_context():
+        problem = utils.problem.create_problem()
+        for _ in range(3):
+            utils.submission.create_submission(
+                user=utils.user.create_user(),
+                problem=problem,
+                status=0,
+            )
+        # drop the queued submissions to simulate they were judged
+        DispatchQueue().client.flushall()
+        yield problem
+
+
+def test_rejudge_by_problem(problem, forge_client, monkeypatch):
+    admin = utils.user.create_user(role=0)
+    rv = forge_client(admin.username).post(
+        '/submission/rejudge',
+        json={'problemId': problem.problem_id},
+    )
+    assert rv.status_code == 200, rv.get_json()
+    job = RejudgeJob(rv.get_json()['data']['jobId'])
+    assert job.progress()['state'] == RejudgeJob.PENDING
+    # jobs are run by the dispatcher
+    dispatcher = Dispatcher()
+    assert dispatcher.run_jobs() == 1
+    assert job.progress()['total'] == 3
+    assert job.progress()['state'] == RejudgeJob.DISPATCHING
+    assert len(DispatchQueue()) == 3
+    for submission in engine.Submission.objects(problem=problem.obj):
+        # not reset until being sent
+        assert submission.status == 0
+        assert Submission(submission.id).dispatch_state()['job'] == job.id
+    monkeypatch.setattr(Submission, 'send', lambda self: True)
+    assert dispatcher.run_once() == 3
+    for submission in engine.Submission.objects(problem=problem.obj):
+        assert submission.status == -1
+        assert submission.tasks == []
+
+
+def test_rejudge_deletes_old_outputs(problem, monkeypatch):
+    submission = Submission(engine.Submission.objects.first().id)
+    output = io.BytesIO()
+    with ZipFile(output, 'w') as zf:
+        zf.writestr('stdout', 'output')
+        zf.writestr('stderr', '')
+    output.seek(0)
+    case = engine.CaseResult(
+        status=0,
+        exec_time=10,
+        memory_usage=10,
+        output=output,
+    )
+    submission.update(tasks=[
+        engine.TaskResult(
+            status=0,
+            exec_time=10,
+            memory_usage=10,
+            score=100,
+            cases=[case],
+        )
+    ])
+    submission.reload()
+    grid_ids = submission.output_file_ids()
+    assert len(grid_ids) != 0
+    RejudgeJob.create('admin', problem_ids=[problem.problem_id]).run()
+    monkeypatch.setattr(Submission, 'send', lambda self: True)
+    Dispatcher().run_once()
+    fs = engine.get_db()['fs.files']
+    assert fs.count_documents({'_id': {'$in': grid_ids}}) == 0
+
+
+def test_rejudge_progress(problem, monkeypatch):
+    job = RejudgeJob.create('admin', problem_ids=[problem.problem_id])
+    job.run()
+    sent = []
+
+    def send(self):
+        if len(sent) == 0:
+            sent.append(self.id)
+            return True
+        raise ValueError('invalid token')
+
+    monkeypatch.setattr(Submission, 'send', send)
+    assert Dispatcher().run_once() == 3
+    progress = job.progress()
+    assert progress['sent'] == 1
+    assert progress['failed'] == 2
+    assert progress['state'] == RejudgeJob.DONE
+
+
+def test_cancel_rejudge(problem, forge_client, monkeypatch):
+    admin = utils.user.create_user(role=0)
+    client = forge_client(admin.username)
+    job = RejudgeJob.create(admin.username, problem_ids=[problem.problem_id])
+    job.run()
+    rv = client.delete(f'/submission/rejudge/{job.id}')
+    assert rv.status_code == 200, rv.get_json()
+    assert rv.get_json()['data']['state'] == RejudgeJob.CANCELLED
+    monkeypatch.setattr(Submission, 'send', lambda self: True)
+    assert Dispatcher().run_once() == 3
+    rv = client.get(f'/submission/rejudge/{job.id}')
+    assert rv.get_json()['data']['cancelled'] == 3
+    assert rv.get_json()['data']['sent'] == 0
+    # dropped submissions keep their results
+    for submission in engine.Submission.objects(problem=problem.obj):
+        assert submission.status == 0
+
+
+def test_cancel_after_reset_is_ignored(problem, monkeypatch):
+    job = RejudgeJob.create('admin', problem_ids=[problem.problem_id])
+    job.run()
+
+    def full(self):
+        raise JudgeQueueFullError
+
+    monkeypatch.setattr(Submission, 'send', full)
+    dispatcher = Dispatcher(backoff=0)
+    assert dispatcher.run_once() == 3
+    for submission in engine.Submission.objects(problem=problem.obj):
+        assert submission.status == -1
+    job.cancel()
+    sent = []
+    monkeypatch.setattr(Submission, 'send',
+                        lambda self: sent.append(self.id) or True)
+    assert dispatcher.run_once() == 3
+    # they have been reset, so they are judged again
+    assert len(sent) == 3
+    assert job.progress()['sent'] == 3
+
+
+def test_cancelled_job_is_not_run(problem):
+    job = RejudgeJob.create('admin', problem_ids=[problem.problem_id])
+    job.cancel()
+    assert Dispatcher().run_jobs() == 1
+    assert job.progress()['state'] == RejudgeJob.CANCELLED
+    assert job.progress()['total'] == 0
+    assert len(DispatchQueue()) == 0
+
+
+def test_recover_jobs(problem):
+    job = RejudgeJob.create('admin', problem_ids=[problem.problem_id])
+    # the worker is killed while running it
+    assert RejudgeJob.take().id == job.id
+    assert RejudgeJob.take() is None
+    assert RejudgeJob.recover() == 1
+    assert RejudgeJob.take().id == job.id
+
+
+def test_expired_job_is_not_recreated(problem, monkeypatch):
+    job = RejudgeJob.create('admin', problem_ids=[problem.problem_id])
+    job.run()
+    job.client.delete(job.key)
+    monkeypatch.setattr(Submission, 'send', lambda self: True)
+    assert Dispatcher().run_once() == 3
+    assert not job
+
+
+@pytest.mark.parametrize(
+    'payload, after',
+    [
+        ({
+            'after': 0
+        }, 0),
+        ({
+            'after': -1
+        }, None),
+        ({
+            'before': 10**20
+        }, None),
+    ],
+)
+def test_rejudge_period(problem, forge_client, payload, after):
+    admin = utils.user.create_user(role=0)
+    rv = forge_client(admin.username).post(
+        '/submission/rejudge',
+        json={
+            'problemId': problem.problem_id,
+            **payload,
+        },
+    )
+    if after is None:
+        assert rv.status_code == 400, rv.get_json()
+        return
+    assert rv.status_code == 200, rv.get_json()
+    job = RejudgeJob(rv.get_json()['data']['jobId'])
+    assert job.progress()['query']['after'] == after
+
+
+def test_student_cannot_rejudge(problem, forge_client):
+    student = utils.user.create_user(role=2)
+    rv = forge_client(student.username).post(
+        '/submission/rejudge',
+        json={'problemId': problem.problem_id},
+    )
+    assert rv.status_code == 403, rv.get_json()
+
+
+def test_get_rejudge_job_of_others(problem, forge_client):
+    teacher = utils.user.create_user(role=1)
+    job = RejudgeJob.create('someone-else', problem_ids=[problem.problem_id])
+    rv = forge_client(teacher.username).get(f'/submission/rejudge/{job.id}')
+    assert rv.status_code == 403, rv.get_json()
+    rv = forge_client(teacher.username).get('/submission/rejudge/not-exist')
+    assert rv.status_code == 404, rv.get_json()
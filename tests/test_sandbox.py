@@ -0,0 +1,247 @@
+import time
+import pytest
+from collections import Counter
+from mongo import engine, Submission
+from mongo import sandbox
+from mongo.sandbox import SandboxRegistry, SandboxClient, SandboxUnavailable
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+    SandboxClient.reset()
+
+
+def teardown_function(_):
+    utils.drop_db()
+    SandboxClient.reset()
+
+
+@pytest.fixture
+def config():
+    return engine.SubmissionConfig(
+        name='submission',
+        sandbox_instances=[
+            engine.Sandbox(
+                name=f'sandbox-{i}',
+                url=f'http://sandbox-{i}:1450',
+                token=f'token-{i}',
+                weight=i + 1,
+            ) for i in range(3)
+        ],
+    )
+
+
+def test_least_loaded(config):
+    registry = SandboxRegistry(config)
+    for i, load in enumerate((0.5, 0.1, 0.9)):
+        registry.report(f'sandbox-{i}', load)
+    assert registry.select('least-loaded').name == 'sandbox-1'
+    registry.report('sandbox-1', 1.0)
+    assert registry.select('least-loaded').name == 'sandbox-0'
+
+
+def test_stale_load_is_ignored(config, monkeypatch):
+    registry = SandboxRegistry(config)
+    registry.report('sandbox-0', 0.9)
+    registry.report('sandbox-1', 0.1)
+    monkeypatch.setattr(SandboxRegistry, 'LOAD_TTL', 60)
+    registry.client.hset(
+        SandboxRegistry.HEARTBEAT_KEY,
+        'sandbox-1',
+        time.time() - 120,
+    )
+    assert registry.loads() == {'sandbox-0': 0.9}
+    assert registry.select('least-loaded').name == 'sandbox-0'
+
+
+def test_unknown_sandbox_is_ignored(config):
+    registry = SandboxRegistry(config)
+    registry.report('removed-sandbox', 0)
+    registry.report('sandbox-2', 0.5)
+    assert registry.select('least-loaded').name == 'sandbox-2'
+
+
+def test_weighted_round_robin(config):
+    registry = SandboxRegistry(config)
+    for i in range(3):
+        registry.report(f'sandbox-{i}', 0)
+    cnt = Counter(registry.select('round-robin').name for _ in range(12))
+    assert cnt == {'sandbox-0': 2, 'sandbox-1': 4, 'sandbox-2': 6}
+
+
+def test_power_of_two_choices(config):
+    registry = SandboxRegistry(config)
+    for i, load in enumerate((0.1, 0.2, 0.3)):
+        registry.report(f'sandbox-{i}', load)
+    # the most loaded one never wins
+    names = {registry.select('power-of-two').name for _ in range(32)}
+    assert 'sandbox-2' not in names
+
+
+@pytest.mark.parametrize('strategy', SandboxRegistry.STRATEGIES)
+def test_saturated_sandbox_is_skipped(config, strategy):
+    registry = SandboxRegistry(config)
+    registry.report('sandbox-0', SandboxRegistry.MAX_LOAD)
+    registry.report('sandbox-1', SandboxRegistry.MAX_LOAD + 1)
+    registry.report('sandbox-2', 0.5)
+    names = {registry.select(strategy).name for _ in range(8)}
+    assert names == {'sandbox-2'}
+    # every sandbox is saturated
+    registry.report('sandbox-2', SandboxRegistry.MAX_LOAD)
+    assert registry.select(strategy) is None
+
+
+def test_refresh_when_table_is_empty(config, monkeypatch):
+
+    class Resp:
+        ok = True
+
+        def __init__(self, url):
+            self.url = url
+
+        def json(self):
+            return {'load': 0.1 if 'sandbox-2' in self.url else 0.5}
+
+    monkeypatch.setattr(SandboxClient, 'status', lambda self: Resp(self.url))
+    registry = SandboxRegistry(config)
+    assert registry.select('least-loaded').name == 'sandbox-2'
+    assert registry.loads() == {
+        'sandbox-0': 0.5,
+        'sandbox-1': 0.5,
+        'sandbox-2': 0.1,
+    }
+
+
+def test_no_sandbox_available(config, monkeypatch):
+
+    def status(self):
+        raise sandbox.rq.ConnectionError
+
+    monkeypatch.setattr(SandboxClient, 'status', status)
+    assert SandboxRegistry(config).select() is None
+
+
+def test_client_is_shared(config):
+    sb = config.sandbox_instances[0]
+    assert SandboxClient(sb) is SandboxClient(sb)
+    assert SandboxClient(sb) is not SandboxClient(config.sandbox_instances[1])
+
+
+def test_client_default_timeout(config, monkeypatch):
+    client = SandboxClient(config.sandbox_instances[0])
+    calls = []
+
+    def request(method, url, **ks):
+        calls.append((method, url, ks))
+        return 'resp'
+
+    monkeypatch.setattr(client.session, 'request', request)
+    assert client.status() == 'resp'
+    assert calls == [(
+        'GET',
+        'http://sandbox-0:1450/status',
+        {
+            'timeout': (
+                SandboxClient.CONNECT_TIMEOUT,
+                SandboxClient.READ_TIMEOUT,
+            ),
+        },
+    )]
+    assert SandboxClient.stats(client.name)['requestCount'] == 1
+
+
+def test_circuit_breaker(config, monkeypatch):
+    monkeypatch.setattr(SandboxClient, 'FAILURE_THRESHOLD', 2)
+    client = SandboxClient(config.sandbox_instances[0])
+
+    def request(method, url, **ks):
+        raise sandbox.rq.ConnectTimeout
+
+    monkeypatch.setattr(client.session, 'request', request)
+    for _ in range(2):
+        with pytest.raises(sandbox.rq.ConnectTimeout):
+            client.status()
+    assert client.is_open
+    with pytest.raises(SandboxUnavailable):
+        client.status()
+    stats = SandboxClient.stats(client.name)
+    assert stats['errorCount'] == 2
+    assert stats['circuitOpen']
+    # broken sandbox won't be selected
+    registry = SandboxRegistry(config)
+    registry.report('sandbox-0', 0)
+    registry.report('sandbox-1', 0.5)
+    assert registry.select('least-loaded').name == 'sandbox-1'
+    # allow retry after cooldown
+    monkeypatch.setattr(SandboxClient, 'COOLDOWN', 0)
+    assert not client.is_open
+
+
+def test_invalid_strategy(config):
+    with pytest.raises(ValueError):
+        SandboxRegistry(config).select('random')
+
+
+def test_sandbox_heartbeat(client):
+    sb = Submission.config().sandbox_instances[0]
+    rv = client.put(
+        '/submission/sandbox/heartbeat',
+        json={
+            'token': sb.token,
+            'load': 0.25,
+        },
+    )
+    assert rv.status_code == 200, rv.get_json()
+    assert SandboxRegistry().loads() == {sb.name: 0.25}
+
+
+@pytest.mark.parametrize('load', ['abc', 'nan', 'inf', -1])
+def test_sandbox_heartbeat_with_invalid_load(client, load):
+    sb = Submission.config().sandbox_instances[0]
+    rv = client.put(
+        '/submission/sandbox/heartbeat',
+        json={
+            'token': sb.token,
+            'load': load,
+        },
+    )
+    assert rv.status_code == 400, rv.get_json()
+    assert SandboxRegistry().loads() == {}
+
+
+def test_sandbox_heartbeat_with_invalid_token(client):
+    rv = client.put(
+        '/submission/sandbox/heartbeat',
+        json={
+            'token': 'invalid',
+            'load': 0.25,
+        },
+    )
+    assert rv.status_code == 401, rv.get_json()
+
+
+def test_get_sandbox_status(forge_client):
+    admin = utils.user.create_user(role=0)
+    rv = forge_client(admin.username).get('/submission/sandbox')
+    assert rv.status_code == 200, rv.get_json()
+    sb = Submission.config().sandbox_instances[0]
+    assert rv.get_json()['data'][sb.name]['alive'] == False
+
+
+def test_sandbox_stats_are_shared(forge_client, monkeypatch):
+    sb = Submission.config().sandbox_instances[0]
+    client = SandboxClient(sb)
+    monkeypatch.setattr(client.session, 'request', lambda *a, **ks: 'resp')
+    client.status()
+    client.status()
+    # another process, e.g. the web worker, has no client of it
+    SandboxClient.reset()
+    admin = utils.user.create_user(role=0)
+    rv = forge_client(admin.username).get('/submission/sandbox')
+    assert rv.status_code == 200, rv.get_json()
+    stats = rv.get_json()['data'][sb.name]
+    assert stats['requestCount'] == 2
+    assert stats['errorCount'] == 0
+    assert stats['maxLatency'] >= stats['avgLatency'] > 0
+    assert stats['circuitOpen'] == False
@@ -2,7 +2,8 @@ from pprint import pprint
 from random import randint
 from typing import Dict
 import pytest
-from mongo import User
+from datetime import datetime
+from mongo import User, Scoreboard, Submission, engine
 from tests.base_tester import BaseTester
 from tests.conftest import forge_client
 from . import utils
@@ -725,3 +726,82 @@ def test_get_error_for_providing_unparsable_pids(context, forge_client,
             f'/course/{context["course"].course_name}/scoreboard?pids={pids}')
         assert rv.status_code == 400
         assert rv.json['message'] == 'Error occurred when parsing `pids`.'
+
+
+def bucket_items():
+    return sorted(
+        engine.ScoreboardBucket.objects.exclude('id').as_pymongo(),
+        key=lambda b: (b['problem'], b['user'], b['day']),
+    )
+
+
+def test_buckets_are_updated_with_submissions(context, app):
+    course = context['course']
+    students = [context['student']] + [
+        utils.user.create_user(role=2, course=course) for _ in range(2)
+    ]
+    with app.app_context():
+        submissions = [
+            utils.submission.create_submission(
+                user=students[i % 3],
+                problem=context['problem'],
+                timestamp=t1 + i * 43200,
+            ) for i in range(12)
+        ]
+        submissions[0].update(score=200)
+        submissions[1].update(score=-1)
+        submissions[4].update(score=0, status=1)
+        Submission(submissions[5].id).delete()
+        expected = bucket_items()
+        assert len(expected) > 0
+        Scoreboard.rebuild()
+        assert bucket_items() == expected
+
+
+@pytest.mark.parametrize('start, end', [
+    (None, None),
+    (before_t1, None),
+    (None, t2),
+    (t1, t2),
+    (between_t1_t2, after_t2),
+    (after_t2, more_after_t2),
+])
+def test_query_from_buckets(context, app, monkeypatch, start, end):
+    problem = context['problem']
+    students = [context['student'].username]
+    with app.app_context():
+        for timestamp in (t1, between_t1_t2, t2, after_t2):
+            for score in (20, 80):
+                utils.submission.create_submission(
+                    user=students[0],
+                    problem=problem,
+                    timestamp=timestamp,
+                    score=score,
+                )
+        start = start and datetime.fromtimestamp(start)
+        end = end and datetime.fromtimestamp(end)
+        expected = {
+            item['user']: {
+                item['problem']:
+                {k: item[k]
+                 for k in ('count', 'total', 'max', 'min')}
+            }
+            for item in Scoreboard._aggregate(
+                students,
+                [problem.id],
+                gte=start,
+                lte=end,
+            )
+        }
+        aggregate = Scoreboard._aggregate
+        periods = []
+
+        def counted_aggregate(*args, **ks):
+            periods.append(ks)
+            return aggregate(*args, **ks)
+
+        monkeypatch.setattr(Scoreboard, '_aggregate', counted_aggregate)
+        assert Scoreboard.query(students, [problem.id], start, end) == expected
+        if start is None and end is None:
+            # read from buckets only
+            assert periods == []
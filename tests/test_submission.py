@@ -1013,9 +1013,12 @@ class TestSubmissionConfig(SubmissionTester):
         assert json['data'] == {
             'rateLimit':
             10,
+            'sandboxStrategy':
+            'least-loaded',
             'sandboxInstances': [{
                 'name': 'Test',
                 'url': 'http://sandbox:6666',
                 'token': 'AAAAA',
+                'weight': 1,
             }]
         }
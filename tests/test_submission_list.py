@@ -0,0 +1,124 @@
+import pytest
+from mongo import engine, Submission
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def problem(app):
+    with app.app_context():
+        problem = utils.problem.create_problem()
+        for _ in range(5):
+            utils.submission.create_submission(
+                user=utils.user.create_user(),
+                problem=problem,
+            )
+        yield problem
+
+
+def test_list_serializer_is_compatible(problem):
+    submissions = Submission.filter(
+        user=problem.owner,
+        problem=problem.problem_id,
+    )
+    projected = Submission.filter(
+        user=problem.owner,
+        problem=problem.problem_id,
+        only=Submission.LIST_FIELDS,
+    )
+    assert [s.to_list_dict() for s in projected] == \
+        [s.to_dict() for s in submissions]
+
+
+def test_filter_with_projection(problem):
+    engine.Submission.objects.update(tasks=[
+        engine.TaskResult(
+            status=0,
+            exec_time=10,
+            memory_usage=10,
+            score=100,
+            cases=[],
+        ),
+    ])
+    submission = Submission.filter(
+        user=problem.owner,
+        problem=problem.problem_id,
+        only=Submission.LIST_FIELDS,
+    )[0]
+    # case results are not loaded
+    assert submission.tasks == []
+    assert submission.reload().tasks != []
+
+
+def test_get_submission_list(problem, forge_client):
+    admin = utils.user.create_user(role=0)
+    rv = forge_client(admin.username).get(
+        f'/submission?offset=0&count=-1&problemId={problem.problem_id}')
+    assert rv.status_code == 200, rv.get_json()
+    data = rv.get_json()['data']
+    assert data['submissionCount'] == 5
+    expected = [
+        Submission(s.id).to_dict()
+        for s in engine.Submission.objects.order_by('-timestamp')
+    ]
+    assert data['submissions'] == expected
+
+
+def test_list_serializer_query_count(problem, db_reads):
+    submissions = Submission.filter(
+        user=problem.owner,
+        problem=problem.problem_id,
+        only=Submission.LIST_FIELDS,
+    )
+    db_reads.clear()
+    expected = [s.to_list_dict() for s in submissions]
+    # one query for each submission
+    assert db_reads.count('user') == 5
+    submissions = Submission.filter(
+        user=problem.owner,
+        problem=problem.problem_id,
+        only=Submission.LIST_FIELDS,
+    )
+    db_reads.clear()
+    assert Submission.to_list_dicts(submissions) == expected
+    # one query for the whole page
+    assert db_reads.count('user') == 1
+
+
+def test_get_submission_list_with_cursor(problem, forge_client):
+    admin = utils.user.create_user(role=0)
+    client = forge_client(admin.username)
+    url = f'/submission?count=2&problemId={problem.problem_id}'
+    rv = client.get(url)
+    data = rv.get_json()['data']
+    assert data['prevCursor'] is None
+    ids = [s['submissionId'] for s in data['submissions']]
+    while data['nextCursor'] is not None:
+        rv = client.get(f'{url}&cursor={data["nextCursor"]}')
+        assert rv.status_code == 200, rv.get_json()
+        data = rv.get_json()['data']
+        assert data['submissionCount'] == 5
+        ids += [s['submissionId'] for s in data['submissions']]
+    assert ids == [
+        str(s.id) for s in engine.Submission.objects.order_by('-timestamp')
+    ]
+    rv = client.get(f'{url}&cursor=invalid')
+    assert rv.status_code == 400
+
+
+def test_submission_count_can_be_skipped(problem, forge_client):
+    admin = utils.user.create_user(role=0)
+    rv = forge_client(admin.username).get(
+        f'/submission?count=2&problemId={problem.problem_id}&withCount=0')
+    assert rv.status_code == 200, rv.get_json()
+    data = rv.get_json()['data']
+    assert data['submissionCount'] is None
+    assert len(data['submissions']) == 2
+    assert data['nextCursor'] is not None
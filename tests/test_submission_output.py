@@ -0,0 +1,232 @@
+import pytest
+from bson import ObjectId
+from zipfile import ZipFile
+from mongo import engine, Course, Problem, Submission, SubmissionConfig
+from mongo import submission as submission_lib
+from mongo.utils import read_grid_files, delete_grid_files
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+@pytest.fixture
+def submission(app):
+    with app.app_context():
+        problem = utils.problem.create_problem(
+            test_case_info=utils.problem.create_test_case_info(
+                language=0,
+                task_len=2,
+                case_count_range=(3, 3),
+            ))
+        yield utils.submission.create_submission(
+            user=utils.user.create_user(),
+            problem=problem,
+        )
+
+
+def fake_results(submission: Submission):
+    return [[{
+        'exitCode': 0,
+        'status': 'AC',
+        'stdout': f'{i}-{j}' * (j * 1000),
+        'stderr': '',
+        'execTime': 10,
+        'memoryUsage': 1024,
+    } for j in range(task.case_count)]
+            for i, task in enumerate(submission.problem.test_case.tasks)]
+
+
+def count_grid_files():
+    return engine.get_db()['fs.files'].count_documents({})
+
+
+def test_pack_outputs_into_one_file(submission: Submission):
+    before = count_grid_files()
+    submission.process_result(fake_results(submission))
+    submission.reload()
+    # one GridFS file for the whole result
+    assert count_grid_files() == before + 1
+    assert not any(case.output for task in submission.tasks
+                   for case in task.cases)
+    assert submission.get_single_output(1, 2) == {
+        'stdout': '1-2' * 2000,
+        'stderr': '',
+    }
+    result = submission.get_detailed_result()
+    assert result[0]['cases'][1]['stdout'] == '0-1' * 1000
+    assert result[1]['cases'][0]['stdout'] == ''
+
+
+def test_output_prefix_is_unambiguous():
+    assert Submission.output_prefix(1, 2) == '1/2/'
+    assert Submission.output_prefix(10, 100) != \
+        Submission.output_prefix(101, 0)
+
+
+def test_store_output_per_case(submission: Submission, monkeypatch):
+    monkeypatch.setattr(SubmissionConfig, 'PACK_OUTPUT', False)
+    before = count_grid_files()
+    submission.process_result(fake_results(submission))
+    submission.reload()
+    # the empty outputs of first cases are stored inline
+    assert count_grid_files() == before + 4
+    assert not submission.obj.output
+    assert submission.get_single_output(0, 1)['stdout'] == '0-1' * 1000
+    case = submission.get_detailed_result()[1]['cases'][2]
+    # only the beginning of large output is returned
+    assert case['stdout'] == ('1-2' * 2000)[:4096]
+    assert case['stdoutSize'] == 6000
+
+
+def test_rejudge_deletes_packed_output(submission: Submission):
+    submission.process_result(fake_results(submission))
+    submission.reload()
+    grid_ids = submission.output_file_ids()
+    assert len(grid_ids) == 1
+    submission.rejudge()
+    submission.reload()
+    assert not submission.obj.output
+    fs = engine.get_db()['fs.files']
+    assert fs.count_documents({'_id': {'$in': grid_ids}}) == 0
+
+
+def test_store_small_output_inline(submission: Submission, monkeypatch):
+    monkeypatch.setattr(SubmissionConfig, 'INLINE_OUTPUT_SIZE', 10**5)
+    before = count_grid_files()
+    submission.process_result(fake_results(submission))
+    submission.reload()
+    assert count_grid_files() == before
+    assert not submission.obj.output
+    assert submission.get_single_output(1, 2, text=False) == {
+        'stdout': b'1-2' * 2000,
+        'stderr': b'',
+    }
+    assert submission.get_detailed_result()[0]['cases'][1]['stdout'] == \
+        '0-1' * 1000
+    assert 'inlineOutput' not in submission.get_result()[0]['cases'][0]
+
+
+def test_inline_existing_outputs(submission: Submission, monkeypatch):
+    monkeypatch.setattr(SubmissionConfig, 'INLINE_OUTPUT_SIZE', 0)
+    monkeypatch.setattr(SubmissionConfig, 'PACK_OUTPUT', False)
+    submission.process_result(fake_results(submission))
+    submission.reload()
+    old_ids = submission.output_file_ids()
+    assert len(old_ids) == 6
+    expected = submission.get_detailed_result()
+    # outputs of the first two cases are small enough
+    monkeypatch.setattr(SubmissionConfig, 'INLINE_OUTPUT_SIZE', 4000)
+    monkeypatch.setattr(SubmissionConfig, 'PACK_OUTPUT', True)
+    assert submission.inline_outputs()
+    assert submission.get_detailed_result() == expected
+    # the rest are packed into one file
+    assert len(submission.output_file_ids()) == 1
+    fs = engine.get_db()['fs.files']
+    assert fs.count_documents({'_id': {'$in': old_ids}}) == 0
+    assert not submission.inline_outputs()
+
+
+def test_read_grid_files(submission: Submission, monkeypatch):
+    monkeypatch.setattr(SubmissionConfig, 'INLINE_OUTPUT_SIZE', 0)
+    monkeypatch.setattr(SubmissionConfig, 'PACK_OUTPUT', False)
+    submission.process_result(fake_results(submission))
+    submission.reload()
+    grid_ids = submission.output_file_ids()
+    files = read_grid_files(grid_ids + [ObjectId()])
+    assert files.keys() == {*grid_ids}
+    for grid_id in grid_ids:
+        assert files[grid_id] == engine.GridFSProxy(grid_id).read()
+
+
+def test_detailed_result_is_cached(submission: Submission):
+    submission.process_result(fake_results(submission))
+    submission.reload()
+    expected = submission.get_detailed_result()
+    # the cached result is used even if outputs are gone
+    delete_grid_files(submission.output_file_ids())
+    assert submission.get_detailed_result() == expected
+    # rejudging starts a new judgement
+    submission.rejudge()
+    submission.reload()
+    assert submission.get_detailed_result() == []
+
+
+def test_get_output_with_range(submission: Submission, forge_client):
+    submission.process_result(fake_results(submission))
+    admin = utils.user.create_user(role=0)
+    client = forge_client(admin.username)
+    url = f'/submission/{submission.id}/output/1/2/stdout'
+    rv = client.get(url)
+    assert rv.status_code == 200
+    assert rv.data == b'1-2' * 2000
+    rv = client.get(url, headers={'Range': 'bytes=3-8'})
+    assert rv.status_code == 206
+    assert rv.data == b'1-21-2'
+    assert rv.headers['Content-Range'] == 'bytes 3-8/6000'
+    rv = client.get(f'/submission/{submission.id}/output/1/2/stdin')
+    assert rv.status_code == 400
+    rv = client.get(f'/submission/{submission.id}/output/9/0/stdout')
+    assert rv.status_code == 400
+
+
+def test_stream_output_of_others(submission: Submission, forge_client):
+    submission.process_result(fake_results(submission))
+    course = Course(submission.problem.courses[0].course_name)
+    other = utils.user.create_user(course=course)
+    assert Submission(submission.id).permission(other) == 1
+    Problem(submission.problem_id).update(can_view_stdout=True)
+    url = f'/submission/{submission.id}/output/1/2/stdout'
+    # the same outputs can be viewed in the detail
+    rv = forge_client(other.username).get(url)
+    assert rv.status_code == 200
+    assert rv.data == b'1-2' * 2000
+    Problem(submission.problem_id).update(can_view_stdout=False)
+    rv = forge_client(other.username).get(url)
+    assert rv.status_code == 403
+
+
+def test_preview_drops_only_cut_character():
+    data = 'aé'.encode()
+    assert Submission._decode_preview(data[:2], 3) == 'a'
+    assert Submission._decode_preview(data, 3) == 'aé'
+    with pytest.raises(UnicodeDecodeError):
+        Submission._decode_preview(b'a\xffb' + data[:2], 10)
+    # the whole output is returned
+    with pytest.raises(UnicodeDecodeError):
+        Submission._decode_preview(data[:2], 2)
+
+
+def test_output_archives_are_closed(submission: Submission, monkeypatch):
+    opened = []
+
+    class TrackedZipFile(ZipFile):
+
+        def __init__(self, *args, **ks):
+            super().__init__(*args, **ks)
+            opened.append(self)
+
+    monkeypatch.setattr(submission_lib, 'ZipFile', TrackedZipFile)
+    for pack in (True, False):
+        monkeypatch.setattr(SubmissionConfig, 'PACK_OUTPUT', pack)
+        submission.process_result(fake_results(submission))
+        submission.reload()
+        assert submission.get_single_output(1, 2)['stdout'] == '1-2' * 2000
+        submission._read_outputs()
+    assert len(opened) != 0
+    assert all(zf.fp is None for zf in opened)
+
+
+def test_stream_large_output_files(submission: Submission, monkeypatch):
+    submission.process_result(fake_results(submission))
+    submission.reload()
+    expected = submission._read_outputs()
+    # no file is loaded in batch
+    monkeypatch.setattr(SubmissionConfig, 'OUTPUT_BATCH_READ_SIZE', 0)
+    assert read_grid_files(submission.output_file_ids(), max_size=0) == {}
+    assert submission._read_outputs() == expected
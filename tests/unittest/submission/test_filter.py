@@ -101,3 +101,72 @@ def test_with_empty_period():
             after=after,
             before=before,
         )
+
+
+def test_cursor_pagination():
+    admin = utils.user.create_user(role=User.engine.Role.ADMIN)
+    problem_id = utils.problem.create_problem(
+        owner=admin,
+        course='Public',
+    ).problem_id
+    for _ in range(10):
+        Submission.add(
+            problem_id=problem_id,
+            username=admin.username,
+            lang=0,
+        )
+    expected = [s.id for s in Submission.filter(user=admin)]
+    pages = []
+    cursor = None
+    while True:
+        submissions, total, cursor, _ = Submission.filter_page(
+            user=admin,
+            count=3,
+            cursor=cursor,
+            with_count=True,
+        )
+        assert total == 10
+        pages.append([s.id for s in submissions])
+        if cursor is None:
+            break
+    assert [*map(len, pages)] == [3, 3, 3, 1]
+    assert sum(pages, []) == expected
+    # go back from the last page
+    _, _, _, prev_cursor = Submission.filter_page(
+        user=admin,
+        count=3,
+        offset=9,
+    )
+    submissions, _, next_cursor, prev_cursor = Submission.filter_page(
+        user=admin,
+        count=3,
+        cursor=prev_cursor,
+    )
+    assert [s.id for s in submissions] == pages[2]
+    assert next_cursor is not None and prev_cursor is not None
+    # neither the count nor cursors unless asked and meaningful
+    submissions, total, next_cursor, prev_cursor = Submission.filter_page(
+        user=admin,
+        count=3,
+        offset=3,
+        sort_by='runTime',
+    )
+    assert len(submissions) == 3
+    assert total is None
+    assert next_cursor is None and prev_cursor is None
+
+
+def test_invalid_cursor():
+    admin = utils.user.create_user(role=User.engine.Role.ADMIN)
+    with pytest.raises(ValueError, match='invalid cursor'):
+        Submission.filter(user=admin, cursor='not-a-cursor')
+    submission = Submission.add(
+        problem_id=utils.problem.create_problem(owner=admin).problem_id,
+        username=admin.username,
+        lang=0,
+    )
+    cursor = Submission.encode_cursor(Submission(submission))
+    with pytest.raises(ValueError):
+        Submission.filter(user=admin, cursor=cursor, offset=1)
+    with pytest.raises(ValueError):
+        Submission.filter(user=admin, cursor=cursor, sort_by='runTime')
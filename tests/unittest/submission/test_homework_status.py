@@ -0,0 +1,225 @@
+import pytest
+from datetime import datetime
+from tests import utils
+from mongo.base import identity_map
+from mongo import (
+    Course,
+    engine,
+    Homework,
+    Submission,
+    User,
+)
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+def setup_homework(end: float, penalty: str = ''):
+    course = utils.course.create_course(name='Test')
+    student = utils.user.create_user(course=course, role=2)
+    problem = utils.problem.create_problem(course=course)
+    utils.homework.add_homework(
+        user=User('first_admin'),
+        course='Test',
+        penalty=penalty,
+        problem_ids=[problem.id],
+        start=int(datetime.now().timestamp()) - 86411,
+        end=end,
+        hw_name='test',
+        markdown='',
+        scoreboard_status=0,
+    )
+    return student, problem
+
+
+def get_status(student, problem):
+    homework = Homework.get_by_name('Test', 'test')
+    return homework.student_status[student.username][str(problem.id)]
+
+
+def judge(submissions):
+    for submission in submissions:
+        Submission(submission.id).finish_judging()
+
+
+def test_update_status_in_place(app):
+    student, problem = setup_homework(end=int(datetime.now().timestamp()) +
+                                      86400)
+    with app.app_context():
+        submission = utils.submission.create_submission(
+            problem=problem,
+            user=student,
+            score=30,
+            status=1,
+        )
+        submission.finish_judging()
+        other = utils.submission.create_submission(
+            problem=problem,
+            user=student,
+            score=20,
+            status=1,
+        )
+        other.finish_judging()
+    status = get_status(student, problem)
+    assert status['submissionIds'] == [submission.id, other.id]
+    # lower score won't replace the high score
+    assert status['score'] == 30
+    assert status['rawScore'] == 30
+
+
+def test_judgement_order_does_not_matter(app):
+    _, problem = setup_homework(end=int(datetime.now().timestamp()) + 86400)
+    scores = (10, 100, 40, 70, 20)
+    results = []
+    with app.app_context():
+        for order in (scores, scores[::-1], (40, 100, 10, 20, 70)):
+            student = utils.user.create_user(course=Course('Test'), role=2)
+            submissions = [
+                utils.submission.create_submission(
+                    problem=problem,
+                    user=student,
+                    score=score,
+                    status=0 if score == 100 else 1,
+                ) for score in order
+            ]
+            judge(submissions)
+            status = get_status(student, problem)
+            assert sorted(status['submissionIds']) == \
+                sorted(s.id for s in submissions)
+            results.append((
+                status['score'],
+                status['rawScore'],
+                status['problemStatus'],
+            ))
+    assert results == [(100, 100, 0)] * 3
+
+
+@pytest.mark.parametrize('scores', [(100, 30), (30, 100)])
+def test_in_time_judgements_interleave(app, monkeypatch, scores):
+    student, problem = setup_homework(end=int(datetime.now().timestamp()) +
+                                      86400)
+    with app.app_context():
+        first, second = (utils.submission.create_submission(
+            problem=problem,
+            user=student,
+            score=score,
+            status=0 if score == 100 else 1,
+        ) for score in scores)
+        collection = type(engine.HomeworkStatus._get_collection())
+        update_one = collection.update_one
+        raced = []
+
+        # judge the second submission between the raw score update and the
+        # high score update of the first one
+        def racing_update(self, query, update, *args, **ks):
+            result = update_one(self, query, update, *args, **ks)
+            if not raced and '$max' in update:
+                raced.append(query)
+                Submission(second.id).finish_judging()
+            return result
+
+        monkeypatch.setattr(collection, 'update_one', racing_update)
+        judge([first])
+    assert len(raced) == 1
+    status = get_status(student, problem)
+    assert status['submissionIds'] == [first.id, second.id]
+    assert status['score'] == 100
+    assert status['rawScore'] == 100
+    assert status['problemStatus'] == 0
+
+
+def test_overdue_judgement_retries_after_concurrent_change(
+    app,
+    monkeypatch,
+):
+    end = int(datetime.now().timestamp()) - 86410
+    student, problem = setup_homework(end=end, penalty='score=score*0.5')
+    with app.app_context():
+        first, second = (utils.submission.create_submission(
+            problem=problem,
+            user=student,
+            score=score,
+        ) for score in (40, 80))
+        do_penalty = Homework.do_penalty
+        raced = []
+
+        # judge the second submission while the first one is computing its
+        # penalty from the status it has read
+        def racing_penalty(self, submission, stat):
+            if not raced:
+                raced.append(submission.id)
+                Submission(second.id).finish_judging()
+            return do_penalty(self, submission, stat)
+
+        monkeypatch.setattr(Homework, 'do_penalty', racing_penalty)
+        judge([first])
+    assert raced == [first.id]
+    status = get_status(student, problem)
+    assert sorted(status['submissionIds']) == sorted([first.id, second.id])
+    assert status['rawScore'] == 80
+    assert status['score'] == 40
+
+
+def test_penalty_does_not_change_submission(app):
+    end = int(datetime.now().timestamp()) - 86410
+    student, problem = setup_homework(end=end, penalty='score=score*0.5')
+    with app.app_context(), identity_map():
+        submission = utils.submission.create_submission(
+            problem=problem,
+            user=student,
+            score=80,
+        )
+        judge([submission])
+        assert Submission(submission.id).score == 80
+    assert get_status(student, problem)['score'] == 40
+
+
+def test_only_load_status_of_given_student(app):
+    student, problem = setup_homework(end=int(datetime.now().timestamp()) +
+                                      86400)
+    homework = Homework.get_by_name('Test', 'test')
+    statuses = Homework.get_student_statuses([homework], student.username)
+    assert statuses == {
+        str(homework.id): {
+            str(problem.id): Homework.default_problem_status(),
+        }
+    }
+    statuses = Homework.get_student_statuses([homework], 'not_a_student')
+    assert statuses == {str(homework.id): None}
+    assert student.username in homework.student_status
+
+
+def test_migrate_embedded_status(app):
+    student, problem = setup_homework(end=int(datetime.now().timestamp()) +
+                                      86400)
+    homework = Homework.get_by_name('Test', 'test')
+    engine.HomeworkStatus.objects(homework=homework).delete()
+    embedded = {
+        'score': 60,
+        'rawScore': 80,
+        'problemStatus': 1,
+        'submissionIds': ['a', 'b'],
+    }
+    engine.Homework._get_collection().update_one(
+        {'_id': homework.id},
+        {
+            '$set': {
+                'studentStatus': {
+                    student.username: {
+                        str(problem.id): embedded
+                    }
+                }
+            }
+        },
+    )
+    assert Homework(homework.id).migrate_student_status()
+    assert get_status(student, problem) == embedded
+    doc = engine.Homework._get_collection().find_one({'_id': homework.id})
+    assert 'studentStatus' not in doc
+    # nothing to migrate
+    assert not Homework(homework.id).migrate_student_status()
@@ -14,6 +14,8 @@ from mongo import (
     User,
     Problem,
     Homework,
+    Penalty,
+    PenaltyError,
 )
 
 
@@ -186,3 +188,66 @@ def test_penalty_in_time(client, app):
     assert Homework.get_by_name('Test',
                                 'test').student_status[student.username][str(
                                     problem.id)]['score'] == 100
+
+
+@pytest.mark.parametrize('source, score, overtime, expected', [
+    ('score=score*(0.8**overtime)', 100, 1, 80),
+    ('score = score if overtime < 3 else 0', 100, 2, 100),
+    ('score = score if overtime < 3 else 0', 100, 3, 0),
+    ('if overtime > 1:\n    score = score / 2\nelse:\n    score = 0', 90, 2,
+     45),
+    ('score = 0', 100, 1, 0),
+    ('', 60, 1, 60),
+    ('score = score * 0.5 ** overtime', 100, 1000, 100 * 0.5**1000),
+])
+def test_evaluate_penalty(source, score, overtime, expected):
+    assert Penalty.compile(source)(score, overtime) == expected
+
+
+@pytest.mark.parametrize('source', [
+    '__import__("os").system("ls")',
+    'score = open("/etc/passwd")',
+    'import os',
+    'score = score.__class__',
+    'x = 1',
+    'score = "a"',
+    'score = [score]',
+    'score = score if',
+])
+def test_illegal_penalty(source):
+    with pytest.raises(PenaltyError):
+        Penalty.compile(source)
+
+
+@pytest.mark.parametrize('source', [
+    'score = score / overtime',
+    'score = 10 ** 9999999 * score',
+])
+def test_invalid_penalty(source):
+    with pytest.raises(PenaltyError):
+        Penalty.compile(source)(0, 0)
+
+
+def test_penalty_is_compiled_once():
+    source = 'score = score * (0.9 ** overtime)'
+    assert Penalty.compile(source) is Penalty.compile(source)
+    assert Penalty.compile(source)(100, 1) == 90
+
+
+@pytest.mark.parametrize('penalty', [
+    'score = open("a")',
+    'score = score / overtime',
+])
+def test_add_homework_with_bad_penalty(client, penalty):
+    with pytest.raises(ValueError):
+        utils.homework.add_homework(
+            user=User('first_admin'),
+            course='Public',
+            penalty=penalty,
+            hw_name='test',
+            markdown='',
+            scoreboard_status=0,
+            start=0,
+            end=0,
+            problem_ids=[],
+        )
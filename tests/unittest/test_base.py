@@ -0,0 +1,64 @@
+from mongo import *
+from mongo import engine
+from tests import utils
+
+
+def setup_function(_):
+    utils.drop_db()
+
+
+def teardown_function(_):
+    utils.drop_db()
+
+
+def test_truth_test_without_query(db_reads):
+    user = utils.user.create_user()
+    db_reads.clear()
+    loaded = User(user.username)
+    assert db_reads == ['user']
+    assert loaded and loaded == user
+    assert not User('nobody')
+    assert db_reads == ['user', 'user']
+
+
+def test_delete_through_wrapper():
+    course = utils.course.create_course()
+    course = Course(course.course_name)
+    course.delete()
+    assert not course
+
+
+def test_refresh_existence():
+    user = User(utils.user.create_user().username)
+    engine.User.objects(username=user.username).delete()
+    assert user
+    assert not user.exists(refresh=True)
+    assert not user
+
+
+def test_unsaved_document_is_checked():
+    user = User(
+        engine.User(
+            username='nobody',
+            user_id='nobody',
+            email='nobody@noj.tw',
+            md5='nobody',
+        ))
+    assert not user
+    user.save()
+    assert user
+
+
+def test_load_with_filter(app):
+    course = utils.course.create_course()
+    ann = Announcement.new_ann(
+        title='test',
+        creator=course.teacher,
+        markdown='',
+        pinned=False,
+        course=course,
+    )
+    assert Announcement(ann.id)
+    Announcement(ann.id).update(status=1)
+    assert not Announcement(ann.id)
+    assert not Announcement(ann)